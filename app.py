@@ -1,140 +1,242 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 from flask_cors import CORS
 import sqlite3
-from datetime import datetime, time, timedelta, date
+from datetime import datetime, time, date
 import pytz
 import uuid
 import os
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
-from dotenv import load_dotenv
+import io
 import json
-import pdfkit
+import logging
+import time as time_module
 import base64
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import Alignment
+import hashlib
+import csv
+import math
+
+from config import (
+    SMTP_SERVER,
+    SMTP_PORT,
+    SMTP_USERNAME,
+    SMTP_PASSWORD,
+    ADMIN_EMAIL,
+    SMTP_STARTTLS,
+    SMTP_TIMEOUT,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_BACKOFF,
+    OUTBOX_POLL_INTERVAL,
+    SMTP_IDLE_TIMEOUT,
+    SMTP_MAX_MESSAGES_PER_SESSION,
+    WKHTMLTOPDF_PATH,
+    REPORT_JOB_WORKERS,
+    REPORT_JOB_RETENTION_SECONDS,
+    REPORT_JOB_POLL_INTERVAL,
+    REPORT_JOB_CLAIM_TIMEOUT,
+    REPORT_JOB_MAX_ATTEMPTS,
+    REPORT_ARCHIVE,
+    REPORT_ARCHIVE_DIR,
+    REPORT_ARCHIVE_MAX_BYTES,
+    REPORT_ARCHIVE_RETENTION_DAYS,
+    REPORT_CACHE,
+    USER_CACHE_TTL,
+    USER_CACHE_SIZE,
+    SPECIAL_USERS_FILE,
+    PDF_RENDER_WORKERS,
+    PDF_RENDER_TIMEOUT,
+    COMPRESS_MIN_BYTES,
+    COMPRESS_LEVEL,
+    DB_AUTO_MIGRATE,
+    PROFILE_ENABLED,
+    PROFILE_HEADER,
+    PROFILE_TOKEN,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_DIR,
+    PROFILE_MAX_FILES,
+    LOG_LEVEL,
+    LOG_FORMAT,
+    LOG_QUEUE_SIZE,
+    LOG_SAMPLE_RATE,
+)
+from db import CalendarRangeError, check_schema, get_data_versions, get_db, get_pool, init_db
+from reporting import (
+    TASK_COLUMNS,
+    aggregate_tasks,
+    build_team_report,
+    fetch_daily_effort,
+    fetch_tasks,
+    fetch_working_days,
+    summarize_daily_effort,
+    task_to_dict,
+    write_excel_report,
+)
+from jobs import JobQueue
+from mailer import Mailer
+from user_directory import SpecialUsers, UserDirectory
+from report_cache import ReportCache
+from report_archive import ARCHIVE_PAGE_SIZE, MAX_ARCHIVE_PAGE_SIZE, ReportArchive
+from pdf_renderer import PdfRenderer
+from http_compression import compress_response
+from metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS, REGISTRY, REPORT_STAGE_SECONDS
+from profiler import RequestProfiler
+from logging_setup import configure_logging, logging_stats, new_request_id, request_id_var, start_log_writer
+
+configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE)
+log = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='frontend/build')
 app.secret_key = 'your_secret_key'
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# Load environment variables
-load_dotenv()
-
-SMTP_SERVER = os.getenv('SMTP_SERVER')
-SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
-SMTP_USERNAME = os.getenv('SMTP_USERNAME')
-SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
-ADMIN_EMAIL = os.getenv('ADMIN_EMAIL')
-
-# Path to wkhtmltopdf
-WKHTMLTOPDF_PATH = os.getenv('WKHTMLTOPDF_PATH', '/usr/local/bin/wkhtmltopdf')
-
 # Configurable time range for task submission
 SUBMISSION_START_TIME = time(9, 0)  # 9:00 AM IST
 SUBMISSION_END_TIME = time(19, 30)  # 7:30 PM IST
 IST = pytz.timezone('Asia/Kolkata')
 
-pdfkit_config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
-
-def init_db():
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-
-    # TED system tables
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL UNIQUE,
-        email TEXT NOT NULL,
-        password TEXT NOT NULL,
-        role TEXT NOT NULL,
-        status TEXT DEFAULT 'active'
-    )''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS tasks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        area_of_effort TEXT,
-        effort_hours INTEGER,
-        effort_minutes INTEGER,
-        effort_towards TEXT,
-        time_log_type TEXT,
-        manager_note TEXT,
-        broad_area_of_work TEXT,
-        reviewer_note TEXT,
-        output_file TEXT,
-        output_location TEXT,
-        task_date DATE DEFAULT (DATE('now', 'localtime'))
-    )''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS invitations (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT NOT NULL UNIQUE,
-        user_id TEXT NOT NULL,
-        role TEXT NOT NULL,
-        invitation_code TEXT NOT NULL,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-    )''')
-
-    # Payroll system tables
-    cursor.execute('''CREATE TABLE IF NOT EXISTS employees (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        email TEXT NOT NULL UNIQUE,
-        department TEXT NOT NULL
-    )''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS payroll (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        employee_id INTEGER NOT NULL,
-        period TEXT NOT NULL,
-        salary REAL NOT NULL,
-        bonus REAL,
-        deductions REAL,
-        tax REAL,
-        net_salary REAL NOT NULL,
-        FOREIGN KEY (employee_id) REFERENCES employees(id)
-    )''')
-    
-    conn.commit()
-    conn.close()
-
-init_db()
+# Largest batch accepted by /add_tasks
+MAX_TASKS_PER_BATCH = 100
+
+# Paging for /get_tasks_for_period
+TASK_PAGE_SIZE = 500  # default page size when ?limit is not given
+MAX_TASK_PAGE_SIZE = 1000
+TASK_STREAM_BATCH_SIZE = 500  # rows fetched per chunk in NDJSON mode
+
+# Largest payroll run accepted by /run_payroll
+MAX_PAYROLL_RECORDS = 5000
+
+# Creating and migrating the schema is a deploy step (`python db.py migrate`), so importing the
+# app in each worker only checks the version. DB_AUTO_MIGRATE=true migrates here instead, and so
+# does `python app.py`, before any of the app's state is set up. The migration's pooled connection
+# is closed afterwards so workers forked from this process do not inherit an open SQLite handle.
+if DB_AUTO_MIGRATE or __name__ == '__main__':
+    init_db()
+    get_pool().close_all()
+else:
+    check_schema()
+
+report_jobs = JobQueue(REPORT_JOB_WORKERS, REPORT_JOB_RETENTION_SECONDS, name='report-job', poll_interval=REPORT_JOB_POLL_INTERVAL,
+                       claim_timeout=REPORT_JOB_CLAIM_TIMEOUT, max_attempts=REPORT_JOB_MAX_ATTEMPTS)
+report_archive = ReportArchive(REPORT_ARCHIVE_DIR, REPORT_ARCHIVE_MAX_BYTES, REPORT_ARCHIVE_RETENTION_DAYS, COMPRESS_LEVEL)
+report_cache = ReportCache(report_archive, enabled=REPORT_CACHE and REPORT_ARCHIVE)
+pdf_renderer = PdfRenderer(WKHTMLTOPDF_PATH, PDF_RENDER_WORKERS, PDF_RENDER_TIMEOUT)
+mailer = Mailer(SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, starttls=SMTP_STARTTLS, timeout=SMTP_TIMEOUT,
+                batch_size=OUTBOX_BATCH_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS, retry_backoff=OUTBOX_RETRY_BACKOFF,
+                poll_interval=OUTBOX_POLL_INTERVAL, idle_timeout=SMTP_IDLE_TIMEOUT,
+                max_messages_per_session=SMTP_MAX_MESSAGES_PER_SESSION)
+user_directory = UserDirectory(USER_CACHE_TTL, USER_CACHE_SIZE)
+special_users_file = SpecialUsers(SPECIAL_USERS_FILE)
+request_profiler = RequestProfiler(PROFILE_DIR, enabled=PROFILE_ENABLED, sample_rate=PROFILE_SAMPLE_RATE,
+                                   token=PROFILE_TOKEN, max_files=PROFILE_MAX_FILES)
+
+# Point-in-time state of the pools, queues and caches, read when /metrics is scraped
+def pipeline_gauges():
+    gauges = {'ted_report_jobs_pending': report_jobs.pending()}
+    gauges.update({f'ted_db_pool_{key}': value for key, value in get_pool().stats().items()})
+    pdf_stats = pdf_renderer.stats()
+    gauges.update({'ted_pdf_render_queue_depth': pdf_stats['queue_depth'], 'ted_pdf_render_active': pdf_stats['active']})
+    gauges['ted_report_cache_entries'] = report_cache.stats()['entries']
+    gauges['ted_user_cache_entries'] = user_directory.stats()['entries']
+    archive_stats = report_archive.stats()
+    gauges.update({'ted_report_archive_entries': archive_stats['entries'], 'ted_report_archive_bytes': archive_stats['stored_bytes']})
+    log_stats = logging_stats()
+    gauges.update({'ted_log_queue_depth': log_stats['queued'], 'ted_log_records_dropped': log_stats['dropped']})
+    return gauges
+
+def outbox_gauges():
+    stats = mailer.stats()
+    return {'ted_outbox_messages': {status: stats[status] for status in ('queued', 'sending', 'sent', 'failed')}}
+
+REGISTRY.register_gauges('Current pool, queue and cache state.', pipeline_gauges)
+REGISTRY.register_gauges('Outbox messages by delivery status.', outbox_gauges, label='status')
+
+# Opt-in request profiling. Registered first so the capture covers the other hooks too; when
+# profiling is disabled this is one attribute check per request.
+@app.before_request
+def start_request_profile():
+    if request_profiler.enabled and request_profiler.wanted(request.headers.get(PROFILE_HEADER)):
+        g.profile = request_profiler.start()
+        g.profile_started = time_module.perf_counter()
+
+@app.after_request
+def save_request_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        name = request_profiler.stop(profile, route, response.status_code, time_module.perf_counter() - g.profile_started)
+        response.headers['X-Profile-Name'] = name
+    return response
+
+# A request that raised never reaches after_request; save what was captured anyway
+@app.teardown_request
+def discard_request_profile(error):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_profiler.stop(profile, route, 'error', time_module.perf_counter() - g.profile_started)
+
+# The log writer, outbox delivery and report job threads are started by the first request rather
+# than at import, so a server that forks workers after loading the app starts them in each worker
+@app.before_request
+def start_background_workers():
+    start_log_writer()
+    if not mailer.started:
+        mailer.start()
+    if not report_jobs.started:
+        report_jobs.start()
+
+# Correlation id for the request's log lines, taken from X-Request-ID or generated, and echoed back
+@app.before_request
+def assign_request_id():
+    g.request_id_token = request_id_var.set(new_request_id(request.headers.get('X-Request-ID')))
+
+@app.after_request
+def send_request_id(response):
+    response.headers['X-Request-ID'] = request_id_var.get()
+    return response
+
+@app.teardown_request
+def clear_request_id(error):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        request_id_var.reset(token)
+
+# Per-route request counts and latency for /metrics, plus a sampled access log line. Registered
+# before compress() so that the compression time is included (after_request hooks run in reverse order).
+@app.before_request
+def start_request_timer():
+    g.request_started = time_module.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time_module.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(elapsed, route, request.method)
+        HTTP_REQUESTS.inc(1, route, request.method, str(response.status_code))
+        log.log(logging.WARNING if response.status_code >= 500 else logging.INFO, 'request', extra={
+            'method': request.method, 'route': route, 'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2), 'sample_rate': LOG_SAMPLE_RATE})
+    return response
+
+# Compress JSON and NDJSON responses for clients that accept gzip or brotli
+@app.after_request
+def compress(response):
+    return compress_response(response, request.accept_encodings, COMPRESS_MIN_BYTES, COMPRESS_LEVEL)
 
 def is_within_submission_time():
     now = datetime.now(IST).time()
     return SUBMISSION_START_TIME <= now <= SUBMISSION_END_TIME
 
-def count_weekdays(start_date, end_date):
-    weekdays = 0
-    current_date = start_date
-    while current_date <= end_date:
-        if current_date.weekday() < 5:  # Monday to Friday are 0-4
-            weekdays += 1
-        current_date += timedelta(days=1)
-    return weekdays
+# Queue the invitation email in the outbox; it goes out when the caller commits
+def send_invitation_email(conn, email, invitation_code):
+    from email.mime.text import MIMEText  # the MIME builders are imported on first use, not at startup
 
-def send_invitation_email(email, invitation_code):
-    try:
-        msg = MIMEText(f'You have been invited to register. Use the following invitation code to register: {invitation_code}')
-        msg['Subject'] = 'Invitation to Register'
-        msg['From'] = SMTP_USERNAME
-        msg['To'] = email
-
-        print(f"Connecting to SMTP server: {SMTP_SERVER}:{SMTP_PORT}")
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.ehlo()  # Can be omitted
-            server.starttls()
-            server.ehlo()  # Can be omitted
-            print("Logging in to SMTP server")
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            print(f"Sending email to {email}")
-            server.sendmail(SMTP_USERNAME, email, msg.as_string())
-        print(f"Email sent to {email}")
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-        raise e  # Re-raise the exception to be handled by the caller
+    msg = MIMEText(f'You have been invited to register. Use the following invitation code to register: {invitation_code}')
+    msg['Subject'] = 'Invitation to Register'
+    msg['From'] = SMTP_USERNAME
+    msg['To'] = email
+    return mailer.enqueue(conn, 'invitation', msg)
 
 # TED system routes (Existing routes)
 
@@ -142,7 +244,6 @@ def send_invitation_email(email, invitation_code):
 @app.route('/invite', methods=['POST'])
 def invite():
     data = request.json
-    print(f"Received data: {data}")  # Log incoming data
 
     email = data.get('email')
     user_id = data.get('user_id')
@@ -156,28 +257,25 @@ def invite():
     if role not in ['employee', 'manager', 'reviewer']:
         return jsonify({'message': 'Invalid role'}), 400
 
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
     try:
-        # Check if an invitation already exists for this email
-        cursor.execute('SELECT * FROM invitations WHERE email = ? OR user_id = ?', (email, user_id))
-        existing_invitation = cursor.fetchone()
-        if existing_invitation:
-            print("Invitation already exists for this email or user_id")
-            return jsonify({'message': 'Invitation already exists for this email or user_id'}), 400
-        
-        print(f"Attempting to insert invitation into database for {email} with role {role} and code {invitation_code}")
-        cursor.execute('INSERT INTO invitations (email, user_id, role, invitation_code) VALUES (?, ?, ?, ?)', (email, user_id, role, invitation_code))
-        conn.commit()
-        print("Invitation inserted into database successfully")
-        send_invitation_email(email, invitation_code)
-        print("Invitation email sent successfully")
+        with get_db() as conn:
+            cursor = conn.cursor()
+            # Check if an invitation already exists for this email
+            cursor.execute('SELECT * FROM invitations WHERE email = ? OR user_id = ?', (email, user_id))
+            existing_invitation = cursor.fetchone()
+            if existing_invitation:
+                log.info('Invitation already exists', extra={'user_id': user_id})
+                return jsonify({'message': 'Invitation already exists for this email or user_id'}), 400
+
+            cursor.execute('INSERT INTO invitations (email, user_id, role, invitation_code) VALUES (?, ?, ?, ?)', (email, user_id, role, invitation_code))
+            message_id = send_invitation_email(conn, email, invitation_code)
+            conn.commit()
+        mailer.wake()
+        log.info('Invitation created', extra={'user_id': user_id, 'role': role, 'message_id': message_id})
     except Exception as e:
-        print(f"Error: {e}")  # Log any other errors
+        log.exception('Invitation failed', extra={'user_id': user_id})
         return jsonify({'message': f'An error occurred: {e}'}), 500
-    finally:
-        conn.close()
-    return jsonify({'message': 'Invitation sent successfully'}), 201
+    return jsonify({'message': 'Invitation sent successfully', 'message_id': message_id}), 201
 
 # Register route
 @app.route('/register', methods=['POST'])
@@ -189,46 +287,40 @@ def register():
     role = data['role']
     invitation_code = data.get('invitation')
 
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-
-    # Fetch special users from the JSON file
-    with open('special_users.json', 'r') as f:
-        special_users = json.load(f)
-
-    print(f"Registering user: {user_id}, email: {email}, role: {role}, invitation: {invitation_code}")
+    # Special users from the JSON file, re-read only when it changes
+    special_users = special_users_file.get()
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        # Check if the user is in the special users list
+        if (role == 'manager' and user_id in special_users['managers']) or (role == 'reviewer' and user_id in special_users['reviewers']):
+            try:
+                cursor.execute('INSERT INTO users (user_id, email, password, role) VALUES (?, ?, ?, ?)', (user_id, email, password, role))
+                conn.commit()
+                user_directory.invalidate(user_id)
+                log.info('Special user registered', extra={'user_id': user_id, 'role': role})
+            except sqlite3.IntegrityError:
+                log.info('Registration rejected: user ID or email already exists', extra={'user_id': user_id})
+                return jsonify({'message': 'User ID or email already exists'}), 400
+            return jsonify({'user_id': user_id, 'role': role}), 201
+
+        # Otherwise, check the invitation code and user_id
+        cursor.execute('SELECT * FROM invitations WHERE user_id = ? AND role = ? AND invitation_code = ?', (user_id, role, invitation_code))
+        invitation = cursor.fetchone()
+        if not invitation:
+            log.warning('Registration rejected: invalid invitation or role', extra={'user_id': user_id, 'role': role})
+            return jsonify({'message': 'Invalid invitation or role'}), 400
 
-    # Check if the user is in the special users list
-    if (role == 'manager' and user_id in special_users['managers']) or (role == 'reviewer' and user_id in special_users['reviewers']):
         try:
             cursor.execute('INSERT INTO users (user_id, email, password, role) VALUES (?, ?, ?, ?)', (user_id, email, password, role))
+            cursor.execute('DELETE FROM invitations WHERE user_id = ? AND role = ? AND invitation_code = ?', (user_id, role, invitation_code))
             conn.commit()
-            print("Special user registered successfully")
+            user_directory.invalidate(user_id)
+            log.info('User registered', extra={'user_id': user_id, 'role': role})
         except sqlite3.IntegrityError:
-            print("User ID or email already exists")
+            log.info('Registration rejected: user ID or email already exists', extra={'user_id': user_id})
             return jsonify({'message': 'User ID or email already exists'}), 400
-        finally:
-            conn.close()
-        return jsonify({'user_id': user_id, 'role': role}), 201
-
-    # Otherwise, check the invitation code and user_id
-    cursor.execute('SELECT * FROM invitations WHERE user_id = ? AND role = ? AND invitation_code = ?', (user_id, role, invitation_code))
-    invitation = cursor.fetchone()
-    if not invitation:
-        print("Invalid invitation or role")
-        return jsonify({'message': 'Invalid invitation or role'}), 400
-
-    try:
-        cursor.execute('INSERT INTO users (user_id, email, password, role) VALUES (?, ?, ?, ?)', (user_id, email, password, role))
-        conn.commit()
-        cursor.execute('DELETE FROM invitations WHERE user_id = ? AND role = ? AND invitation_code = ?', (user_id, role, invitation_code))
-        conn.commit()
-        print("User registered successfully")
-    except sqlite3.IntegrityError:
-        print("User ID or email already exists")
-        return jsonify({'message': 'User ID or email already exists'}), 400
-    finally:
-        conn.close()
     return jsonify({'user_id': user_id, 'role': role}), 201
 
 # Login route
@@ -237,21 +329,51 @@ def login():
     data = request.json
     user_id = data['user_id']
     password = data['password']
-    
-    print(f"Login attempt for user_id: {user_id}")
 
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE user_id = ? AND password = ?', (user_id, password))
-    user = cursor.fetchone()
-    conn.close()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM users WHERE user_id = ? AND password = ?', (user_id, password))
+        user = cursor.fetchone()
     if user:
-        print("Login successful")
+        log.info('Login succeeded', extra={'user_id': user_id, 'sample_rate': LOG_SAMPLE_RATE})
         return jsonify({'user_id': user[1], 'role': user[4]}), 200
     else:
-        print("Login failed: Invalid credentials")
+        log.warning('Login failed: invalid credentials', extra={'user_id': user_id})
         return jsonify({'message': 'Invalid credentials'}), 401
 
+TASK_FIELDS = ('area_of_effort', 'effort_hours', 'effort_minutes', 'effort_towards', 'time_log_type', 'output_file', 'output_location')
+INSERT_TASK_SQL = '''INSERT INTO tasks 
+    (user_id, area_of_effort, effort_hours, effort_minutes, effort_towards, time_log_type, output_file, output_location, task_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+# Check a submitted task; returns (column values for INSERT_TASK_SQL without user_id, None) or (None, error message)
+def validate_task(data, today):
+    missing = [field for field in TASK_FIELDS if field not in data]
+    if missing:
+        return None, f"Missing fields: {', '.join(missing)}"
+
+    try:
+        effort_hours = int(data['effort_hours']) if data['effort_hours'] else 0
+        effort_minutes = int(data['effort_minutes']) if data['effort_minutes'] else 0
+    except (TypeError, ValueError):
+        return None, 'Effort hours and minutes must be whole numbers'
+    task_date = data.get('task_date', None)
+
+    # Check if the task_date is not a previous date
+    if task_date:
+        try:
+            task_date_obj = datetime.strptime(task_date, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return None, 'Task date must be in YYYY-MM-DD format'
+        if task_date_obj < today:
+            return None, 'Cannot add a task for a previous date'
+
+    if effort_hours < 0 or effort_minutes < 0:
+        return None, 'Effort hours and minutes must be non-negative'
+
+    return (data['area_of_effort'], effort_hours, effort_minutes, data['effort_towards'], data['time_log_type'],
+            data['output_file'], data['output_location'], task_date), None
+
 # Add task route
 @app.route('/add_task', methods=['POST'])
 def add_task():
@@ -260,39 +382,64 @@ def add_task():
 
     data = request.json
     user_id = data['user_id']
-    area_of_effort = data['area_of_effort']
-    effort_hours = int(data['effort_hours']) if data['effort_hours'] else 0
-    effort_minutes = int(data['effort_minutes']) if data['effort_minutes'] else 0
-    effort_towards = data['effort_towards']
-    time_log_type = data['time_log_type']
-    output_file = data['output_file']
-    output_location = data['output_location']
-    task_date = data.get('task_date', None)
+    values, error = validate_task(data, date.today())
+    if error:
+        return jsonify({'message': error}), 400
 
-    # Check if the task_date is not a previous date
-    if task_date:
-        task_date_obj = datetime.strptime(task_date, '%Y-%m-%d').date()
-        today = date.today()
-        if task_date_obj < today:
-            return jsonify({'message': 'Cannot add a task for a previous date'}), 400
+    user = user_directory.get(user_id)
+    if user and user[1] != 'employee':
+        return jsonify({'message': 'Only employees can add tasks'}), 403
 
-    if effort_hours < 0 or effort_minutes < 0:
-        return jsonify({'message': 'Effort hours and minutes must be non-negative'}), 400
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(INSERT_TASK_SQL, (user_id,) + values)
+        conn.commit()
+    report_cache.invalidate(user_id)
+    return jsonify({'message': 'Task added successfully'}), 201
+
+# Add several tasks for one user in a single request and transaction
+@app.route('/add_tasks', methods=['POST'])
+def add_tasks():
+    if not is_within_submission_time():
+        return jsonify({'message': 'Tasks can only be submitted between 9:00 AM and 7:30 PM IST'}), 403
 
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT role FROM users WHERE user_id = ?', (user_id,))
-    user_role = cursor.fetchone()
-    if user_role and user_role[0] != 'employee':
+    data = request.json
+    user_id = data.get('user_id')
+    tasks = data.get('tasks')
+    if not user_id or not isinstance(tasks, list) or not tasks:
+        return jsonify({'message': 'user_id and a non-empty list of tasks are required'}), 400
+    if len(tasks) > MAX_TASKS_PER_BATCH:
+        return jsonify({'message': f'At most {MAX_TASKS_PER_BATCH} tasks can be submitted at once'}), 400
+
+    today = date.today()
+    results = []
+    rows = []
+    for index, task in enumerate(tasks):
+        values, error = validate_task(task, today) if isinstance(task, dict) else (None, 'Task must be an object')
+        if error:
+            results.append({'index': index, 'status': 'error', 'message': error})
+        else:
+            results.append({'index': index, 'status': 'created'})
+            rows.append((user_id,) + values)
+
+    if not rows:
+        return jsonify({'message': 'No valid tasks to add', 'created': 0, 'failed': len(results), 'results': results}), 400
+
+    user = user_directory.get(user_id)
+    if user and user[1] != 'employee':
         return jsonify({'message': 'Only employees can add tasks'}), 403
 
-    cursor.execute('''INSERT INTO tasks 
-        (user_id, area_of_effort, effort_hours, effort_minutes, effort_towards, time_log_type, output_file, output_location, task_date)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
-        (user_id, area_of_effort, effort_hours, effort_minutes, effort_towards, time_log_type, output_file, output_location, task_date))
-    conn.commit()
-    conn.close()
-    return jsonify({'message': 'Task added successfully'}), 201
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(INSERT_TASK_SQL, rows)
+        conn.commit()
+    report_cache.invalidate(user_id)
+    return jsonify({
+        'message': f'{len(rows)} of {len(tasks)} tasks added successfully',
+        'created': len(rows),
+        'failed': len(tasks) - len(rows),
+        'results': results
+    }), 201
 
 # Update task route
 @app.route('/update_task', methods=['PUT'])
@@ -307,200 +454,241 @@ def update_task():
     output_file = data['output_file']
     output_location = data['output_location']
     
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT task_date, user_id FROM tasks WHERE id = ?', (task_id,))
+        task_date = cursor.fetchone()
+        if task_date:
+            task_date_str, task_user_id = task_date
+            task_date = datetime.strptime(task_date_str, '%Y-%m-%d').date()
+            today = datetime.now().date()
+            if task_date != today:
+                return jsonify({'message': 'You can only edit tasks for the current day'}), 403
 
-    cursor.execute('SELECT task_date FROM tasks WHERE id = ?', (task_id,))
-    task_date = cursor.fetchone()
+        cursor.execute('''
+            UPDATE tasks SET area_of_effort = ?, effort_hours = ?, effort_minutes = ?, effort_towards = ?, time_log_type = ?, output_file = ?, output_location = ?
+            WHERE id = ?
+        ''', (area_of_effort, effort_hours, effort_minutes, effort_towards, time_log_type, output_file, output_location, task_id))
+        conn.commit()
     if task_date:
-        task_date_str = task_date[0]
-        task_date = datetime.strptime(task_date_str, '%Y-%m-%d').date()
-        today = datetime.now().date()
-        if task_date != today:
-            conn.close()
-            return jsonify({'message': 'You can only edit tasks for the current day'}), 403
-
-    cursor.execute('''
-        UPDATE tasks SET area_of_effort = ?, effort_hours = ?, effort_minutes = ?, effort_towards = ?, time_log_type = ?, output_file = ?, output_location = ?
-        WHERE id = ?
-    ''', (area_of_effort, effort_hours, effort_minutes, effort_towards, time_log_type, output_file, output_location, task_id))
-    conn.commit()
-    conn.close()
+        report_cache.invalidate(task_user_id)
     return jsonify({'message': 'Task updated successfully'}), 200
 
+# ETag for the current request: its path and query string plus the versions of the data it reads.
+# Checking it costs one primary-key lookup in data_versions instead of re-running the route.
+def data_etag(*scopes):
+    with get_db() as conn:
+        versions = get_data_versions(conn, scopes)
+    key = repr((request.path, sorted(request.args.items(multi=True)), scopes, versions))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+# 304 response when the client already has the current version, otherwise None
+def not_modified(etag):
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(Response(status=304), etag)
+    return None
+
+# Per-user data: browsers may keep it but must revalidate every time. The ETag is weak
+# because the same data may be sent gzip- or brotli-encoded.
+def with_etag(response, etag):
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# Compact JSON without jsonify's key sorting, for the large task payloads
+def json_response(payload):
+    return Response(json.dumps(payload, separators=(',', ':')), mimetype='application/json')
+
+# Task rows as {'tasks': [{...}, ...]}, or with columnar=True as {'fields': [...], 'rows': [[...], ...]},
+# which serializes the row tuples directly instead of building a dict per row
+def task_payload(tasks, columnar):
+    if columnar:
+        return {'fields': TASK_COLUMNS, 'rows': tasks}
+    return {'tasks': [task_to_dict(task) for task in tasks]}
+
+def task_scope(user_id):
+    return f'tasks:{user_id}' if user_id else 'tasks'
+
 # Get tasks for a specific date
 @app.route('/get_tasks_for_date', methods=['GET'])
 def get_tasks_for_date():
     user_id = request.args.get('user_id')
     task_date = request.args.get('task_date')
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-    if user_id:
-        cursor.execute('SELECT * FROM tasks WHERE user_id = ? AND task_date = ?', (user_id, task_date))
-    else:
-        cursor.execute('SELECT * FROM tasks WHERE task_date = ?', (task_date,))
-    tasks = cursor.fetchall()
-    conn.close()
-    task_list = [
-        {
-            'id': task[0],
-            'user_id': task[1],
-            'area_of_effort': task[2],
-            'effort_hours': task[3],
-            'effort_minutes': task[4],
-            'effort_towards': task[5],
-            'time_log_type': task[6],
-            'manager_note': task[7],
-            'broad_area_of_work': task[8],
-            'reviewer_note': task[9],
-            'output_file': task[10],
-            'output_location': task[11],
-            'task_date': task[12]
-        } for task in tasks
-    ]
-    total_effort_hours = sum(int(task['effort_hours'] or 0) + int(task['effort_minutes'] or 0) / 60 for task in task_list)
-    return jsonify({'tasks': task_list, 'total_effort_hours': total_effort_hours}), 200
+    etag = data_etag(task_scope(user_id))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    with get_db() as conn:
+        cursor = conn.cursor()
+        if user_id:
+            cursor.execute('SELECT * FROM tasks WHERE user_id = ? AND task_date = ? ORDER BY id', (user_id, task_date))
+        else:
+            cursor.execute('SELECT * FROM tasks WHERE task_date = ? ORDER BY id', (task_date,))
+        tasks = cursor.fetchall()
+    payload = task_payload(tasks, request.args.get('format') == 'columns')
+    payload['total_effort_hours'] = sum(int(task[3] or 0) + int(task[4] or 0) / 60 for task in tasks)
+    return with_etag(json_response(payload), etag), 200
+
+def encode_task_cursor(task_date, task_id):
+    return base64.urlsafe_b64encode(f'{task_date}|{task_id}'.encode()).decode()
+
+def decode_task_cursor(cursor):
+    task_date, task_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return task_date, int(task_id)
+
+# Yield tasks as NDJSON lines straight from the cursor, a batch at a time
+def stream_tasks(query, params):
+    with get_db() as conn:
+        cursor = conn.execute(query, params)
+        while True:
+            tasks = cursor.fetchmany(TASK_STREAM_BATCH_SIZE)
+            if not tasks:
+                break
+            yield ''.join(json.dumps(task_to_dict(task)) + '\n' for task in tasks)
 
 # Get tasks for a period
+#   ?limit=N[&cursor=...]  returns one page ordered by (task_date, id) plus next_cursor
+#   ?format=ndjson         streams every matching task as newline-delimited JSON
+#   ?format=columns        returns {fields, rows} (plus next_cursor when paging) instead of one object per task
 @app.route('/get_tasks_for_period', methods=['GET'])
 def get_tasks_for_period():
     user_id = request.args.get('user_id')
     from_date = request.args.get('from_date')
     to_date = request.args.get('to_date')
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
+    etag = data_etag(task_scope(user_id))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
     query = 'SELECT * FROM tasks WHERE task_date BETWEEN ? AND ?'
     params = [from_date, to_date]
     if user_id:
         query += ' AND user_id = ?'
         params.append(user_id)
-    cursor.execute(query, params)
-    tasks = cursor.fetchall()
-    conn.close()
-    task_list = [
-        {
-            'id': task[0],
-            'user_id': task[1],
-            'area_of_effort': task[2],
-            'effort_hours': task[3],
-            'effort_minutes': task[4],
-            'effort_towards': task[5],
-            'time_log_type': task[6],
-            'manager_note': task[7],
-            'broad_area_of_work': task[8],
-            'reviewer_note': task[9],
-            'output_file': task[10],
-            'output_location': task[11],
-            'task_date': task[12]
-        } for task in tasks
-    ]
-    return jsonify(task_list), 200
+
+    columnar = request.args.get('format') == 'columns'
+    if request.args.get('format') == 'ndjson':
+        return with_etag(Response(stream_tasks(query + ' ORDER BY task_date, id', params), mimetype='application/x-ndjson'), etag), 200
+
+    if 'limit' in request.args or 'cursor' in request.args:
+        try:
+            limit = min(max(int(request.args.get('limit', TASK_PAGE_SIZE)), 1), MAX_TASK_PAGE_SIZE)
+            if request.args.get('cursor'):
+                cursor_date, cursor_id = decode_task_cursor(request.args['cursor'])
+                # Start the index range at the cursor's day rather than at from_date
+                params[0] = max(from_date or '', cursor_date)
+                query += ' AND (task_date, id) > (?, ?)'
+                params.extend((cursor_date, cursor_id))
+        except ValueError:
+            return jsonify({'message': 'Invalid limit or cursor'}), 400
+        query += ' ORDER BY task_date, id LIMIT ?'
+        params.append(limit + 1)  # one extra row tells us whether there is a next page
+        with get_db() as conn:
+            tasks = conn.execute(query, params).fetchall()
+        next_cursor = None
+        if len(tasks) > limit:
+            tasks = tasks[:limit]
+            next_cursor = encode_task_cursor(tasks[-1][12], tasks[-1][0])
+        payload = task_payload(tasks, columnar)
+        payload['next_cursor'] = next_cursor
+        return with_etag(json_response(payload), etag), 200
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query + ' ORDER BY task_date, id', params)
+        tasks = cursor.fetchall()
+    if columnar:
+        return with_etag(json_response(task_payload(tasks, columnar)), etag), 200
+    return with_etag(json_response([task_to_dict(task) for task in tasks]), etag), 200
+
+# Check a report's from_date/to_date; returns (from_date, to_date, None) or (None, None, error message)
+def parse_date_range(from_date, to_date):
+    try:
+        from_day = datetime.strptime(from_date, '%Y-%m-%d').date()
+        to_day = datetime.strptime(to_date, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None, None, 'from_date and to_date must be dates in YYYY-MM-DD format'
+    if from_day > to_day:
+        return None, None, 'from_date must not be after to_date'
+    return from_day.isoformat(), to_day.isoformat(), None
 
 # Get report route
 @app.route('/get_report', methods=['GET'])
 def get_report():
     user_id = request.args.get('user_id')
-    from_date = request.args.get('from_date')
-    to_date = request.args.get('to_date')
+    from_date, to_date, error = parse_date_range(request.args.get('from_date'), request.args.get('to_date'))
+    if error:
+        return jsonify({'message': error}), 400
+    etag = data_etag(task_scope(user_id), 'calendar')
+    cached = not_modified(etag)
+    if cached:
+        return cached
 
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        WITH RECURSIVE dates(date) AS (
-            SELECT ?
-            UNION ALL
-            SELECT date(date, '+1 day')
-            FROM dates
-            WHERE date < ?
-        )
-        SELECT date
-        FROM dates
-        WHERE date NOT IN (
-            SELECT task_date
-            FROM tasks
-            WHERE user_id = ?
-            AND task_date BETWEEN ? AND ?
-        )
-        AND strftime('%w', date) NOT IN ('0', '6')
-    ''', (from_date, to_date, user_id, from_date, to_date))
-    missed_dates = [row[0] for row in cursor.fetchall()]
-
-    cursor.execute('''
-        SELECT SUM(effort_hours + effort_minutes / 60.0) AS total_hours
-        FROM tasks
-        WHERE user_id = ? AND task_date BETWEEN ? AND ?
-    ''', (user_id, from_date, to_date))
-    total_effort_hours = cursor.fetchone()[0] or 0.0
-
-    cursor.execute('''
-        SELECT COALESCE(NULLIF(broad_area_of_work, ''), 'Undefined') AS broad_area_of_work,
-               SUM(effort_hours + effort_minutes / 60.0) AS total_hours
-        FROM tasks
-        WHERE user_id = ? AND task_date BETWEEN ? AND ?
-        GROUP BY broad_area_of_work
-    ''', (user_id, from_date, to_date))
-    broad_area_of_work_hours = cursor.fetchall()
-
-    cursor.execute('''
-        SELECT task_date
-        FROM tasks
-        WHERE user_id = ? AND task_date BETWEEN ? AND ?
-        GROUP BY task_date
-        HAVING SUM(effort_hours + effort_minutes / 60.0) < 8
-    ''', (user_id, from_date, to_date))
-    less_than_8_hours_dates = [row[0] for row in cursor.fetchall()]
-
-    cursor.execute('''
-        SELECT task_date, area_of_effort
-        FROM tasks
-        WHERE user_id = ? AND task_date BETWEEN ? AND ? AND (output_file IS NULL OR output_file = '')
-    ''', (user_id, from_date, to_date))
-    missing_files_tasks = cursor.fetchall()
-
-    cursor.execute('''
-        SELECT effort_towards, SUM(effort_hours + effort_minutes / 60.0) AS total_hours
-        FROM tasks
-        WHERE user_id = ? AND task_date BETWEEN ? AND ?
-        GROUP BY effort_towards
-    ''', (user_id, from_date, to_date))
-    effort_towards_hours = cursor.fetchall()
-
-    cursor.execute('''
-        SELECT task_date, area_of_effort, manager_note, reviewer_note
-        FROM tasks
-        WHERE user_id = ? AND task_date BETWEEN ? AND ?
-    ''', (user_id, from_date, to_date))
-    notes = cursor.fetchall()
-
-    start_date = datetime.strptime(from_date, '%Y-%m-%d').date()
-    end_date = datetime.strptime(to_date, '%Y-%m-%d').date()
-    total_working_days = count_weekdays(start_date, end_date)
-
-    conn.close()
-
-    report = {
-        'missed_dates': missed_dates,
-        'total_effort_hours': float(total_effort_hours),
-        'broad_area_of_work_hours': [(item[0], float(item[1])) for item in broad_area_of_work_hours],
-        'less_than_8_hours_dates': less_than_8_hours_dates,
-        'missing_files_tasks': [(task[0], task[1]) for task in missing_files_tasks],
-        'effort_towards_hours': [(item[0], float(item[1])) for item in effort_towards_hours],
-        'notes': notes,
-        'total_working_days': total_working_days
-    }
+    try:
+        with get_db() as conn:
+            tasks = fetch_tasks(conn, user_id, from_date, to_date)
+            working_days = fetch_working_days(conn, from_date, to_date)
+    except CalendarRangeError as e:
+        return jsonify({'message': str(e)}), 400
+
+    with REPORT_STAGE_SECONDS.time('aggregate'):
+        report = aggregate_tasks(tasks, working_days)
+
+    return with_etag(jsonify(report), etag), 200
+
+# Team report route: get_report metrics for every employee in one request
+@app.route('/get_team_report', methods=['GET'])
+def get_team_report():
+    from_date, to_date, error = parse_date_range(request.args.get('from_date'), request.args.get('to_date'))
+    if error:
+        return jsonify({'message': error}), 400
+    etag = data_etag('tasks', 'users', 'calendar')
+    cached = not_modified(etag)
+    if cached:
+        return cached
 
-    return jsonify(report), 200
+    try:
+        with get_db() as conn:
+            users = build_team_report(conn, from_date, to_date)
+    except CalendarRangeError as e:
+        return jsonify({'message': str(e)}), 400
+
+    return with_etag(jsonify({'from_date': from_date, 'to_date': to_date, 'users': users}), etag), 200
+
+# Day-level effort summary for dashboards, served from the daily_effort rollup
+@app.route('/get_effort_summary', methods=['GET'])
+def get_effort_summary():
+    user_id = request.args.get('user_id')
+    from_date, to_date, error = parse_date_range(request.args.get('from_date'), request.args.get('to_date'))
+    if error:
+        return jsonify({'message': error}), 400
+    etag = data_etag(task_scope(user_id), 'calendar')
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        with get_db() as conn:
+            days = fetch_daily_effort(conn, user_id, from_date, to_date)
+            working_days = fetch_working_days(conn, from_date, to_date)
+    except CalendarRangeError as e:
+        return jsonify({'message': str(e)}), 400
+
+    return with_etag(jsonify(summarize_daily_effort(days, working_days)), etag), 200
 
 # Delete task route
 @app.route('/delete_task', methods=['DELETE'])
 def delete_task():
     task_id = request.args.get('task_id')
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id FROM tasks WHERE id = ?', (task_id,))
+        task_owner = cursor.fetchone()
+        cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+        conn.commit()
+    if task_owner:
+        report_cache.invalidate(task_owner[0])
     return jsonify({'message': 'Task deleted successfully'}), 200
 
 # Add manager note route
@@ -510,12 +698,15 @@ def add_manager_note():
     task_id = data['task_id']
     manager_note = data['manager_note']
     broad_area_of_work = data['broad_area_of_work']
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE tasks SET manager_note = ?, broad_area_of_work = ? WHERE id = ?', 
-        (manager_note, broad_area_of_work, task_id))
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE tasks SET manager_note = ?, broad_area_of_work = ? WHERE id = ?', 
+            (manager_note, broad_area_of_work, task_id))
+        cursor.execute('SELECT user_id FROM tasks WHERE id = ?', (task_id,))
+        task_owner = cursor.fetchone()
+        conn.commit()
+    if task_owner:
+        report_cache.invalidate(task_owner[0])
     return jsonify({'message': 'Manager note added successfully'}), 200
 
 # Add reviewer note route
@@ -524,384 +715,279 @@ def add_reviewer_note():
     data = request.json
     task_id = data['task_id']
     reviewer_note = data['reviewer_note']
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE tasks SET reviewer_note = ? WHERE id = ?', 
-        (reviewer_note, task_id))
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE tasks SET reviewer_note = ? WHERE id = ?', 
+            (reviewer_note, task_id))
+        cursor.execute('SELECT user_id FROM tasks WHERE id = ?', (task_id,))
+        task_owner = cursor.fetchone()
+        conn.commit()
+    if task_owner:
+        report_cache.invalidate(task_owner[0])
     return jsonify({'message': 'Reviewer note added successfully'}), 200
 
 # Get users route
 @app.route('/get_users', methods=['GET'])
 def get_users():
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, email FROM users WHERE role = 'employee'")
-    users = cursor.fetchall()
-    conn.close()
+    etag = data_etag('users')
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id, email FROM users WHERE role = 'employee'")
+        users = cursor.fetchall()
     user_list = [{'user_id': user[0], 'email': user[1]} for user in users]
-    return jsonify(user_list), 200
+    return with_etag(jsonify(user_list), etag), 200
 
 # Special users route
 @app.route('/special_users', methods=['GET'])
 def special_users():
-    return send_from_directory(os.path.dirname(__file__), 'special_users.json')
-
-# Send report route
-@app.route('/send_report', methods=['POST'])
-def send_report():
-    data = request.json
-    user_id = data['user_id']
-    from_date = data.get('from_date')
-    to_date = data.get('to_date')
-    task_date = data.get('task_date')
-    role = data.get('role')  # Get the role from the request data
-
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT email, role FROM users WHERE user_id = ?', (user_id,))
-    user_info = cursor.fetchone()
-    if not user_info:
-        return jsonify({'message': 'User not found'}), 404
-
-    user_email, user_role = user_info
-
-    if task_date:
-        cursor.execute('SELECT * FROM tasks WHERE user_id = ? AND task_date = ?', (user_id, task_date))
-    else:
-        cursor.execute('SELECT * FROM tasks WHERE user_id = ? AND task_date BETWEEN ? AND ?', (user_id, from_date, to_date))
-    tasks = cursor.fetchall()
-
-    if not tasks:
-        conn.close()
-        return jsonify({'message': 'No tasks found for the specified date(s)'}), 404
-
-    task_list = [
-        {
-            'id': task[0],
-            'user_id': task[1],
-            'area_of_effort': task[2],
-            'effort_hours': task[3],
-            'effort_minutes': task[4],
-            'effort_towards': task[5],
-            'time_log_type': task[6],
-            'manager_note': task[7],
-            'broad_area_of_work': task[8],
-            'reviewer_note': task[9],
-            'output_file': task[10],
-            'output_location': task[11],
-            'task_date': task[12]
-        } for task in tasks
-    ]
+    return jsonify(special_users_file.get()), 200
 
+# Render the HTML, PDF and Excel versions of a report as in-memory buffers ({format: bytes})
+def render_report(user_id, user_email, tasks, working_days, task_date, role, date_info):
     tasks_by_date = {}
-    for task in task_list:
-        if task['task_date'] not in tasks_by_date:
-            tasks_by_date[task['task_date']] = []
-        tasks_by_date[task['task_date']].append(task)
-
-    total_effort_hours = sum(task['effort_hours'] + task['effort_minutes'] / 60 for task in task_list)
-
-    if not task_date:
-        cursor.execute('''
-            WITH RECURSIVE dates(date) AS (
-                SELECT ?
-                UNION ALL
-                SELECT date(date, '+1 day')
-                FROM dates
-                WHERE date < ?
-            )
-            SELECT date
-            FROM dates
-            WHERE date NOT IN (
-                SELECT task_date
-                FROM tasks
-                WHERE user_id = ?
-                AND task_date BETWEEN ? AND ?
-            )
-            AND strftime('%w', date) NOT IN ('0', '6')
-        ''', (from_date, to_date, user_id, from_date, to_date))
-        missed_dates = [row[0] for row in cursor.fetchall()]
+    for task in tasks:
+        tasks_by_date.setdefault(task[12], []).append(task_to_dict(task))
 
-        cursor.execute('''
-            SELECT COALESCE(NULLIF(broad_area_of_work, ''), 'Undefined') AS broad_area_of_work,
-                   SUM(effort_hours + effort_minutes / 60.0) AS total_hours
-            FROM tasks
-            WHERE user_id = ? AND task_date BETWEEN ? AND ?
-            GROUP BY broad_area_of_work
-        ''', (user_id, from_date, to_date))
-        broad_area_of_work_hours = cursor.fetchall()
+    with REPORT_STAGE_SECONDS.time('aggregate'):
+        report = aggregate_tasks(tasks, working_days)
+    total_effort_hours = report['total_effort_hours']
+    if task_date:
+        report = None
 
-        cursor.execute('''
-            SELECT task_date
-            FROM tasks
-            WHERE user_id = ? AND task_date BETWEEN ? AND ?
-            GROUP BY task_date
-            HAVING SUM(effort_hours + effort_minutes / 60.0) < 8
-        ''', (user_id, from_date, to_date))
-        less_than_8_hours_dates = [row[0] for row in cursor.fetchall()]
+    with REPORT_STAGE_SECONDS.time('html'):
+        days = [
+            (date, date_tasks, sum(task['effort_hours'] + task['effort_minutes'] / 60 for task in date_tasks))
+            for date, date_tasks in tasks_by_date.items()
+        ]
+        html = app.jinja_env.get_template('report.html').render(
+            user_id=user_id, user_email=user_email, date_info=date_info, role=role,
+            total_effort_hours=total_effort_hours, days=days, report=report)
 
-        cursor.execute('''
-            SELECT task_date, area_of_effort
-            FROM tasks
-            WHERE user_id = ? AND task_date BETWEEN ? AND ? AND (output_file IS NULL OR output_file = '')
-        ''', (user_id, from_date, to_date))
-        missing_files_tasks = cursor.fetchall()
+    # Convert HTML to PDF straight from memory on the render pool (includes time queued for a renderer)
+    with REPORT_STAGE_SECONDS.time('pdf'):
+        pdf_data = pdf_renderer.render(html)
 
-        cursor.execute('''
-            SELECT effort_towards, SUM(effort_hours + effort_minutes / 60.0) AS total_hours
-            FROM tasks
-            WHERE user_id = ? AND task_date BETWEEN ? AND ?
-            GROUP BY effort_towards
-        ''', (user_id, from_date, to_date))
-        effort_towards_hours = cursor.fetchall()
-
-        start_date = datetime.strptime(from_date, '%Y-%m-%d').date()
-        end_date = datetime.strptime(to_date, '%Y-%m-%d').date()
-        total_working_days = count_weekdays(start_date, end_date)
-
-        report = {
-            'missed_dates': missed_dates,
-            'total_effort_hours': float(total_effort_hours),
-            'broad_area_of_work_hours': [(item[0], float(item[1])) for item in broad_area_of_work_hours],
-            'less_than_8_hours_dates': less_than_8_hours_dates,
-            'missing_files_tasks': [(task[0], task[1]) for task in missing_files_tasks],
-            'effort_towards_hours': [(item[0], float(item[1])) for item in effort_towards_hours],
-            'total_working_days': total_working_days
-        }
-    else:
-        report = None
+    with REPORT_STAGE_SECONDS.time('xlsx'):
+        excel_buffer = io.BytesIO()
+        write_excel_report(excel_buffer, user_email, tasks_by_date, total_effort_hours, report, role)
 
-    conn.close()
+    return {'html': html.encode('utf-8'), 'pdf': pdf_data, 'xlsx': excel_buffer.getvalue()}
 
+# Build the HTML, PDF and Excel reports and email them to the admin (runs on the report worker pool)
+def build_and_send_report(job, user_id, user_email, tasks, working_days, from_date, to_date, task_date, role):
     if task_date:
         date_info = f"on {task_date}"
     else:
         date_info = f"from {from_date} to {to_date}"
-
-    task_report = f"""
-    <html>
-        <head>
-            <style>
-                table {{
-                    width: 1200px;
-                    border-collapse: collapse;
-                    table-layout: fixed;
-                    word-wrap: break-word;
-                }}
-                th, td {{
-                    border: 1px solid black;
-                    padding: 8px;
-                    text-align: left;
-                }}
-                th {{
-                    background-color: #f2f2f2;
-                }}
-                .break-word {{
-                    word-wrap: break-word;
-                }}
-            </style>
-        </head>
-        <body>
-            <h3>Task Report for {user_id} {date_info}</h3>
-            <p><strong>Employee Email:</strong> {user_email}</p>
-            <p><strong>Total Effort Hours:</strong> {total_effort_hours:.2f} hours</p>
-    """
-
-    for date, tasks in tasks_by_date.items():
-        daily_effort_hours = sum(task['effort_hours'] + task['effort_minutes'] / 60 for task in tasks)
-        task_report += f"""
-            <h4>Tasks for {date}</h4>
-            <p><strong>Total Effort Hours:</strong> {daily_effort_hours:.2f} hours</p>
-            <table>
-                <thead>
-                    <tr>
-                        <th>Area of Effort</th>
-                        <th>Effort (hours)</th>
-                        <th>Effort Towards</th>
-                        <th>Time Log Type</th>
-                        <th>Output File</th>
-                        <th>Output Location</th>
-                        {f'<th>Manager Note</th><th>Broad Area of Work</th><th>Reviewer Note</th>' if role != 'employee' else ''}
-                    </tr>
-                </thead>
-                <tbody>
-        """
-        for task in tasks:
-            output_file_link = f'<a href="{task["output_file"]}" target="_blank">{task["output_file"]}</a>' if task['output_file'] else 'No output file'
-            output_location_link = f'<a href="{task["output_location"]}" target="_blank">{task["output_location"]}</a>' if task['output_location'] else 'No output location'
-            task_report += f"""
-                    <tr>
-                        <td>{task['area_of_effort']}</td>
-                        <td>{task['effort_hours']}h {task['effort_minutes']}m</td>
-                        <td>{task['effort_towards']}</td>
-                        <td>{task['time_log_type']}</td>
-                        <td class="break-word">{output_file_link}</td>
-                        <td class="break-word">{output_location_link}</td>
-                        {'<td>' + (task['manager_note'] or 'No manager note') + '</td><td>' + (task['broad_area_of_work'] or 'No broad area of work') + '</td><td>' + (task['reviewer_note'] or 'No reviewer note') + '</td>' if role != 'employee' else ''}
-                    </tr>
-            """
-        task_report += """
-                </tbody>
-            </table>
-        """
-
-    if report:
-        task_report += f"""
-            <h4>Total Working Days</h4>
-            <p>{report['total_working_days']} days</p>
-            <h4>Missed TED Dates</h4>
-            <ul>
-                {''.join(f"<li>{date}</li>" for date in report['missed_dates'])}
-            </ul>
-            <h4>Broad Area of Work and Time Effort Hours</h4>
-            <ul>
-                {''.join(f"<li>{item[0]}: {item[1]:.2f} hours</li>" for item in report['broad_area_of_work_hours'])}
-            </ul>
-            <h4>Less than 8 hours TED Dates</h4>
-            <ul>
-                {''.join(f"<li>{date}</li>" for date in report['less_than_8_hours_dates'])}
-            </ul>
-            <h4>No Files of TED Link Missing Dates</h4>
-            <ul>
-        """
-        for task in report['missing_files_tasks']:
-            date, area_of_effort = task
-            task_report += f"""
-                <li>
-                    <strong>{date}:</strong> {area_of_effort}
-                </li>
-            """
-        task_report += f"""
-            </ul>
-            <h4>Effort Towards and Time Effort Hours</h4>
-            <ul>
-                {''.join(f"<li>{item[0]}: {item[1]:.2f} hours</li>" for item in report['effort_towards_hours'])}
-            </ul>
-        """
-
-    task_report += """
-        </body>
-    </html>
-    """
-
-    # Create a directory for the employee if it doesn't exist
-    employee_dir = os.path.join('reports', user_id)
-    os.makedirs(employee_dir, exist_ok=True)
-
-    # Save report to an HTML file
-    html_filename = os.path.join(employee_dir, f"report_{user_id}_{date_info.replace(' ', '_').replace(':', '-')}.html")
-    pdf_filename = os.path.join(employee_dir, f"report_{user_id}_{date_info.replace(' ', '_').replace(':', '-')}.pdf")
-    excel_filename = os.path.join(employee_dir, f"report_{user_id}_{date_info.replace(' ', '_').replace(':', '-')}.xlsx")
-
-    with open(html_filename, 'w') as file:
-        file.write(task_report)
-
-    # Convert HTML to PDF
-    pdfkit.from_file(html_filename, pdf_filename, configuration=pdfkit_config)
-
-    # Generate Excel report
-    excel_data = []
-    for date, tasks in tasks_by_date.items():
-        for task in tasks:
-            task_data = {
-                'Task Date': date,
-                'Area of Effort': task['area_of_effort'],
-                'Effort (hours)': f"{task['effort_hours']}h {task['effort_minutes']}m",
-                'Effort Towards': task['effort_towards'],
-                'Time Log Type': task['time_log_type'],
-                'Output File': task['output_file'],
-                'Output Location': task['output_location']
-            }
-            if role != 'employee':
-                task_data.update({
-                    'Manager Note': task['manager_note'],
-                    'Broad Area of Work': task['broad_area_of_work'],
-                    'Reviewer Note': task['reviewer_note']
-                })
-            excel_data.append(task_data)
-
-    # Create the DataFrame
-    df_tasks = pd.DataFrame(excel_data)
-
-    # Create a summary DataFrame
-    if role == 'employee':
-        summary_data = [
-            {'Section': 'Employee Email', 'Details': user_email},
-            {'Section': 'Total Effort Hours', 'Details': f"{total_effort_hours:.2f} hours"}
-        ]
-    else:
-        summary_data = [
-            {'Section': 'Employee Email', 'Details': user_email},
-            {'Section': 'Total Effort Hours', 'Details': f"{total_effort_hours:.2f} hours"},
-            {'Section': 'Total Working Days', 'Details': report['total_working_days'] if report else ''},
-            {'Section': 'Missed TED Dates', 'Details': ', '.join(report['missed_dates']) if report else ''},
-            {'Section': 'Broad Area of Work and Time Effort Hours', 'Details': ', '.join([f"{item[0]}: {item[1]:.2f} hours" for item in report['broad_area_of_work_hours']]) if report else ''},
-            {'Section': 'Less than 8 hours TED Dates', 'Details': ', '.join(report['less_than_8_hours_dates']) if report else ''},
-            {'Section': 'No Files of TED Link Missing Dates', 'Details': ', '.join([f"{task[0]}: {task[1]}" for task in report['missing_files_tasks']]) if report else ''},
-            {'Section': 'Effort Towards and Time Effort Hours', 'Details': ', '.join([f"{item[0]}: {item[1]:.2f} hours" for item in report['effort_towards_hours']]) if report else ''}
-        ]
-    df_summary = pd.DataFrame(summary_data)
-
-    # Write both DataFrames to Excel
-    with pd.ExcelWriter(excel_filename) as writer:
-        df_summary.to_excel(writer, sheet_name='Summary', index=False)
-        df_tasks.to_excel(writer, sheet_name='Tasks', index=False)
- 
-    # Open the Excel file to adjust formatting
-    workbook = load_workbook(excel_filename)
-    for sheet in workbook.sheetnames:
-        worksheet = workbook[sheet]
-        for col in worksheet.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                    
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            worksheet.column_dimensions[column].width = adjusted_width
-            for row in worksheet.iter_rows():
-                for cell in row:
-                    cell.alignment = Alignment(wrap_text=True)
-    workbook.save(excel_filename)
-
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = user_email
-        msg['To'] = ADMIN_EMAIL
-        msg['Subject'] = f'Task Report for {user_id} {date_info}'
-
-        with open(html_filename, 'r') as file:
-            msg.attach(MIMEText(file.read(), 'html'))
-
+    base_filename = f"report_{user_id}_{date_info.replace(' ', '_').replace(':', '-')}"
+    filenames = {fmt: f"{base_filename}.{fmt}" for fmt in ('html', 'pdf', 'xlsx')}
+
+    # Reuse the archived files of an identical earlier report when nothing has changed
+    cache_key = report_cache.make_key(user_id, user_email, role, date_info, tasks, working_days)
+    buffers = report_cache.get(user_id, cache_key)
+    cached = buffers is not None
+    if not cached:
+        buffers = render_report(user_id, user_email, tasks, working_days, task_date, role, date_info)
+
+    # Record the report in the archive (stored once per distinct content)
+    archive_id = None
+    if REPORT_ARCHIVE:
+        archive_id = report_archive.put(user_id, from_date, to_date, role, base_filename, buffers)
+        if not cached:
+            report_cache.put(user_id, cache_key, archive_id)
+
+    from email import encoders
+    from email.mime.base import MIMEBase
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    msg = MIMEMultipart()
+    msg['From'] = user_email
+    msg['To'] = ADMIN_EMAIL
+    msg['Subject'] = f'Task Report for {user_id} {date_info}'
+    msg.attach(MIMEText(buffers['html'].decode('utf-8'), 'html'))
+    for fmt in ('pdf', 'xlsx'):
         attachment = MIMEBase('application', 'octet-stream')
-        with open(pdf_filename, 'rb') as file:
-            attachment.set_payload(file.read())
+        attachment.set_payload(buffers[fmt])
         encoders.encode_base64(attachment)
-        attachment.add_header('Content-Disposition', f'attachment; filename={pdf_filename}')
+        attachment.add_header('Content-Disposition', 'attachment', filename=filenames[fmt])
         msg.attach(attachment)
 
-        attachment = MIMEBase('application', 'octet-stream')
-        with open(excel_filename, 'rb') as file:
-            attachment.set_payload(file.read())
-        encoders.encode_base64(attachment)
-        attachment.add_header('Content-Disposition', f'attachment; filename={excel_filename}')
-        msg.attach(attachment)
+    with get_db() as conn:
+        message_id = mailer.enqueue(conn, 'report', msg)
+        conn.commit()
+    mailer.wake()
+    return {'message': 'Report queued for delivery', 'message_id': message_id, 'archive_id': archive_id, 'cached': cached}
+
+# A send_report job: load the tasks as they are when the job runs, then build and send the report
+def run_send_report_job(job, user_id, user_email, from_date, to_date, task_date, role, profile=False):
+    with get_db() as conn:
+        tasks = fetch_tasks(conn, user_id, from_date, to_date)
+        working_days = fetch_working_days(conn, from_date, to_date) if tasks else []
+    if not tasks:
+        raise ValueError('No tasks found for the specified date(s)')
+    build = request_profiler.wrap(build_and_send_report, 'send_report_job') if profile else build_and_send_report
+    return build(job, user_id, user_email, tasks, working_days, from_date, to_date, task_date, role)
 
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.sendmail(user_email, ADMIN_EMAIL, msg.as_string())
+report_jobs.register('send_report', run_send_report_job)
 
-        return jsonify({'message': 'Report sent and saved successfully'}), 200
-    except Exception as e:
-        return jsonify({'message': f'Failed to send report: {e}'}), 500
+# Send report route
+@app.route('/send_report', methods=['POST'])
+def send_report():
+    data = request.json
+    user_id = data['user_id']
+    from_date = data.get('from_date')
+    to_date = data.get('to_date')
+    task_date = data.get('task_date')
+    role = data.get('role')  # Get the role from the request data
+
+    user = user_directory.get(user_id)
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+    user_email = user[0]
+
+    if task_date:
+        from_date = to_date = task_date
+    from_date, to_date, error = parse_date_range(from_date, to_date)
+    if error:
+        return jsonify({'message': error}), 400
+    if task_date:
+        task_date = from_date
+    with get_db() as conn:
+        has_tasks = conn.execute('SELECT 1 FROM tasks WHERE user_id = ? AND task_date BETWEEN ? AND ? LIMIT 1',
+                                 (user_id, from_date, to_date)).fetchone()
+    if not has_tasks:
+        return jsonify({'message': 'No tasks found for the specified date(s)'}), 404
+
+    # Rendering and delivery happen on the report workers; a profiled request profiles its job too
+    job_id = report_jobs.submit('send_report', user_id=user_id, user_email=user_email, from_date=from_date, to_date=to_date,
+                                task_date=task_date, role=role, profile=bool(g.get('profile')))
+    return jsonify({'message': 'Report queued', 'job_id': job_id}), 202
+
+# Report pipeline stats route
+@app.route('/report_stats', methods=['GET'])
+def report_stats():
+    return jsonify({
+        'pending_jobs': report_jobs.pending(),
+        'pdf_renderer': pdf_renderer.stats(),
+        'report_cache': report_cache.stats(),
+        'report_archive': report_archive.stats(),
+        'outbox': mailer.stats()
+    }), 200
+
+def encode_archive_cursor(last_sent_at, archive_id):
+    return base64.urlsafe_b64encode(f'{last_sent_at!r}|{archive_id}'.encode()).decode()
+
+def decode_archive_cursor(cursor):
+    last_sent_at, archive_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return float(last_sent_at), int(archive_id)
+
+# Archived reports, most recently sent first, answered from the archive index
+#   ?user_id=&from_date=&to_date=  filter by user and by a date range the report overlaps
+#   ?limit=N[&cursor=...]          page size and the next_cursor of the previous page
+@app.route('/reports', methods=['GET'])
+def list_reports():
+    try:
+        limit = min(max(int(request.args.get('limit', ARCHIVE_PAGE_SIZE)), 1), MAX_ARCHIVE_PAGE_SIZE)
+        after = decode_archive_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'message': 'Invalid limit or cursor'}), 400
+    reports = report_archive.list(request.args.get('user_id'), request.args.get('from_date'), request.args.get('to_date'),
+                                  limit + 1, after)  # one extra row tells us whether there is a next page
+    next_cursor = None
+    if len(reports) > limit:
+        reports = reports[:limit]
+        next_cursor = encode_archive_cursor(reports[-1]['last_sent_at'], reports[-1]['id'])
+    return jsonify({'reports': reports, 'next_cursor': next_cursor}), 200
+
+# One archived report with the sizes of its files
+@app.route('/reports/<int:archive_id>', methods=['GET'])
+def get_archived_report(archive_id):
+    entry = report_archive.entry(archive_id)
+    if entry is None:
+        return jsonify({'message': 'Report not found'}), 404
+    return jsonify(entry), 200
+
+# Download one format (html, pdf or xlsx) of an archived report
+@app.route('/reports/<int:archive_id>/<fmt>', methods=['GET'])
+def download_archived_report(archive_id, fmt):
+    mimetypes = {
+        'html': 'text/html',
+        'pdf': 'application/pdf',
+        'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    }
+    if fmt not in mimetypes:
+        return jsonify({'message': 'Format must be html, pdf or xlsx'}), 400
+    found = report_archive.get(archive_id, fmt)
+    if found is None:
+        return jsonify({'message': 'Report not found'}), 404
+    name, data = found
+    response = Response(data, mimetype=mimetypes[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}.{fmt}"'
+    return response, 200
+
+# Prometheus metrics route
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4'), 200
+
+# Saved request profiles, newest first
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    return jsonify({'profiler': request_profiler.stats(), 'profiles': request_profiler.list()}), 200
+
+# Download a saved profile (pstats format, for snakeviz/flameprof/pstats)
+@app.route('/profiles/<name>', methods=['GET'])
+def get_profile(name):
+    if request_profiler.path(name) is None:
+        return jsonify({'message': 'Profile not found'}), 404
+    return send_from_directory(os.path.abspath(PROFILE_DIR), name, as_attachment=True, mimetype='application/octet-stream')
+
+# Top functions of a saved profile as text (?sort=cumulative|tottime|calls, ?limit=40)
+@app.route('/profiles/<name>/summary', methods=['GET'])
+def get_profile_summary(name):
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls'):
+        return jsonify({'message': 'sort must be cumulative, tottime or calls'}), 400
+    try:
+        limit = int(request.args.get('limit', 40))
+    except ValueError:
+        return jsonify({'message': 'limit must be an integer'}), 400
+    summary = request_profiler.summary(name, sort, limit)
+    if summary is None:
+        return jsonify({'message': 'Profile not found'}), 404
+    return Response(summary, mimetype='text/plain'), 200
+
+# User lookup cache stats route
+@app.route('/user_cache_stats', methods=['GET'])
+def user_cache_stats():
+    return jsonify({
+        'user_directory': user_directory.stats(),
+        'special_users': special_users_file.stats()
+    }), 200
+
+# Report job status route
+@app.route('/report_jobs/<job_id>', methods=['GET'])
+def get_report_job(job_id):
+    job = report_jobs.get(job_id)
+    if not job:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
+# Outbox message status route
+@app.route('/outbox/<int:message_id>', methods=['GET'])
+def get_outbox_message(message_id):
+    with get_db() as conn:
+        row = conn.execute(
+            'SELECT id, kind, recipients, subject, status, attempts, last_error, created_at, next_attempt_at, sent_at FROM outbox WHERE id = ?',
+            (message_id,)).fetchone()
+    if not row:
+        return jsonify({'message': 'Message not found'}), 404
+    return jsonify(dict(zip(('message_id', 'kind', 'recipients', 'subject', 'status', 'attempts', 'last_error', 'created_at', 'next_attempt_at', 'sent_at'), row))), 200
 
 # Payroll Management System routes
 
@@ -913,16 +999,14 @@ def add_employee():
     email = data['email']
     department = data['department']
 
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute('INSERT INTO employees (name, email, department) VALUES (?, ?, ?)', (name, email, department))
-        conn.commit()
-        return jsonify({'message': 'Employee added successfully'}), 201
-    except sqlite3.IntegrityError:
-        return jsonify({'message': 'Email already exists'}), 400
-    finally:
-        conn.close()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('INSERT INTO employees (name, email, department) VALUES (?, ?, ?)', (name, email, department))
+            conn.commit()
+            return jsonify({'message': 'Employee added successfully'}), 201
+        except sqlite3.IntegrityError:
+            return jsonify({'message': 'Email already exists'}), 400
 
 # Add payroll record route
 @app.route('/add_payroll', methods=['POST'])
@@ -936,30 +1020,136 @@ def add_payroll():
     tax = data['tax']
     net_salary = salary + bonus - deductions - tax
 
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                INSERT INTO payroll (employee_id, period, salary, bonus, deductions, tax, net_salary)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (employee_id, period, salary, bonus, deductions, tax, net_salary))
+            conn.commit()
+            return jsonify({'message': 'Payroll record added successfully'}), 201
+        except sqlite3.IntegrityError:
+            return jsonify({'message': 'Failed to add payroll record'}), 400
+
+PAYROLL_AMOUNT_FIELDS = ('salary', 'bonus', 'deductions', 'tax')
+REQUIRED_PAYROLL_FIELDS = ('salary', 'tax')  # bonus and deductions default to 0 as in /add_payroll
+
+# Check one /run_payroll record; returns ((employee_id, salary, bonus, deductions, tax), None) or (None, error message)
+def validate_payroll_record(record):
     try:
-        cursor.execute('''
-            INSERT INTO payroll (employee_id, period, salary, bonus, deductions, tax, net_salary)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (employee_id, period, salary, bonus, deductions, tax, net_salary))
-        conn.commit()
-        return jsonify({'message': 'Payroll record added successfully'}), 201
-    except sqlite3.IntegrityError:
-        return jsonify({'message': 'Failed to add payroll record'}), 400
-    finally:
-        conn.close()
+        employee_id = int(record.get('employee_id'))
+    except (TypeError, ValueError):
+        return None, 'employee_id must be an integer'
+
+    amounts = []
+    for field in PAYROLL_AMOUNT_FIELDS:
+        value = record.get(field)
+        if value is None or value == '':
+            if field in REQUIRED_PAYROLL_FIELDS:
+                return None, f'Missing field: {field}'
+            value = 0
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None, f'{field} must be a number'
+        if value < 0 or not math.isfinite(value):
+            return None, f'{field} must be a non-negative number'
+        amounts.append(value)
+    return (employee_id,) + tuple(amounts), None
+
+# Run payroll for a whole period from a JSON list or a CSV upload, in one transaction.
+# Rerunning a period updates the existing (employee_id, period) rows instead of adding new ones.
+@app.route('/run_payroll', methods=['POST'])
+def run_payroll():
+    if 'file' in request.files:
+        period = request.form.get('period')
+        try:
+            records = list(csv.DictReader(io.StringIO(request.files['file'].read().decode('utf-8-sig'))))
+        except (UnicodeDecodeError, csv.Error) as e:
+            return jsonify({'message': f'Could not read CSV file: {e}'}), 400
+    else:
+        data = request.json or {}
+        period = data.get('period')
+        records = data.get('records')
+
+    if not period or not isinstance(records, list) or not records:
+        return jsonify({'message': 'period and a non-empty list of records (or a CSV file) are required'}), 400
+    if len(records) > MAX_PAYROLL_RECORDS:
+        return jsonify({'message': f'At most {MAX_PAYROLL_RECORDS} records can be run at once'}), 400
+
+    results = []
+    rows = []
+    seen = set()
+    for index, record in enumerate(records):
+        values, error = validate_payroll_record(record) if isinstance(record, dict) else (None, 'Record must be an object')
+        if not error and values[0] in seen:
+            error = 'Duplicate employee_id in this run'
+        if error:
+            results.append({'index': index, 'status': 'error', 'message': error})
+        else:
+            seen.add(values[0])
+            rows.append((index,) + values)
+
+    inserts = []
+    updates = []
+    with get_db() as conn:
+        # Take the write lock up front so concurrent runs of the same period cannot both insert
+        conn.execute('BEGIN IMMEDIATE')
+        employee_ids = json.dumps([row[1] for row in rows])
+        known = {row[0] for row in conn.execute(
+            'SELECT id FROM employees WHERE id IN (SELECT value FROM json_each(?))', (employee_ids,))}
+        existing = {row[0] for row in conn.execute(
+            'SELECT DISTINCT employee_id FROM payroll WHERE employee_id IN (SELECT value FROM json_each(?)) AND period = ?',
+            (employee_ids, period))}
+
+        for index, employee_id, salary, bonus, deductions, tax in rows:
+            if employee_id not in known:
+                results.append({'index': index, 'status': 'error', 'message': f'Unknown employee_id {employee_id}'})
+                continue
+            net_salary = salary + bonus - deductions - tax
+            if employee_id in existing:
+                updates.append((salary, bonus, deductions, tax, net_salary, employee_id, period))
+                status = 'updated'
+            else:
+                inserts.append((employee_id, period, salary, bonus, deductions, tax, net_salary))
+                status = 'created'
+            results.append({'index': index, 'status': status, 'employee_id': employee_id, 'net_salary': net_salary})
+
+        if not inserts and not updates:
+            conn.rollback()
+        else:
+            conn.executemany('''
+                INSERT INTO payroll (employee_id, period, salary, bonus, deductions, tax, net_salary)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', inserts)
+            conn.executemany('''
+                UPDATE payroll SET salary = ?, bonus = ?, deductions = ?, tax = ?, net_salary = ?
+                WHERE employee_id = ? AND period = ?
+            ''', updates)
+            conn.commit()
+
+    results.sort(key=lambda result: result['index'])
+    summary = {
+        'period': period,
+        'created': len(inserts),
+        'updated': len(updates),
+        'failed': len(records) - len(inserts) - len(updates),
+        'results': results
+    }
+    if not inserts and not updates:
+        return jsonify(dict(summary, message='No valid payroll records')), 400
+    return jsonify(dict(summary, message=f'{len(inserts) + len(updates)} of {len(records)} payroll records saved')), 201
 
 # Get payroll records route
 @app.route('/get_payroll_records', methods=['GET'])
 def get_payroll_records():
     employee_id = request.args.get('employee_id')
-    conn = sqlite3.connect('ted.db')
-    cursor = conn.cursor()
     query = 'SELECT * FROM payroll WHERE employee_id = ?'
-    cursor.execute(query, (employee_id,))
-    payroll_records = cursor.fetchall()
-    conn.close()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (employee_id,))
+        payroll_records = cursor.fetchall()
     payroll_list = [
         {
             'id': record[0],
@@ -974,6 +1164,46 @@ def get_payroll_records():
     ]
     return jsonify(payroll_list), 200
 
+# Payroll totals per department and period, served from the payroll_department_summary rollup
+@app.route('/get_payroll_summary', methods=['GET'])
+def get_payroll_summary():
+    department = request.args.get('department')
+    from_period = request.args.get('from_period')
+    to_period = request.args.get('to_period')
+    period = request.args.get('period')
+    if period:
+        from_period = to_period = period
+
+    query = 'SELECT department, period, headcount, salary, bonus, deductions, tax, net_salary FROM payroll_department_summary WHERE 1 = 1'
+    params = []
+    if department:
+        query += ' AND department = ?'
+        params.append(department)
+    if from_period:
+        query += ' AND period >= ?'
+        params.append(from_period)
+    if to_period:
+        query += ' AND period <= ?'
+        params.append(to_period)
+    query += ' ORDER BY period, department'
+
+    with get_db() as conn:
+        rows = conn.execute(query, params).fetchall()
+    summary = [
+        {
+            'department': row[0],
+            'period': row[1],
+            'headcount': row[2],
+            'gross_salary': round(row[3] + row[4], 2),
+            'salary': round(row[3], 2),
+            'bonus': round(row[4], 2),
+            'deductions': round(row[5], 2),
+            'tax': round(row[6], 2),
+            'net_salary': round(row[7], 2)
+        } for row in rows
+    ]
+    return jsonify(summary), 200
+
 # Serve the React app
 @app.route('/')
 def serve_home():
@@ -0,0 +1,86 @@
+# JSON encoding and compression benchmark for the task list payloads.
+#
+# Builds a synthetic ted.db, fetches a team-wide /get_tasks_for_period slice and compares
+# encode time and payload size for the old jsonify path (sorted dict per row), the compact
+# dict path and the columnar ?format=columns path, raw and gzip/brotli compressed.
+#
+#   python benchmarks/bench_json.py --users 200 --days 90
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON encoding and compression benchmark')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--tasks-per-day', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--gzip-level', type=int, default=6)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ted-bench-')
+    os.environ['DB_PATH'] = os.path.join(workdir, 'ted.db')
+
+    # Imported after DB_PATH is set so the pool points at the synthetic database
+    from db import get_db, init_db
+    from reporting import TASK_COLUMNS, task_to_dict
+    from benchmarks.synthetic import populate
+    from http_compression import BROTLI_QUALITY
+
+    try:
+        init_db()
+        populate(os.environ['DB_PATH'], users=args.users, days=args.days, tasks_per_day=args.tasks_per_day)
+        with get_db() as conn:
+            tasks = conn.execute('SELECT * FROM tasks WHERE task_date BETWEEN ? AND ?', ('2000-01-01', '2100-01-01')).fetchall()
+        print(f'{len(tasks)} tasks')
+        print()
+
+        variants = [
+            ('jsonify (sorted dicts)', lambda: json.dumps([task_to_dict(task) for task in tasks], separators=(',', ':'), sort_keys=True)),
+            ('compact dicts', lambda: json.dumps([task_to_dict(task) for task in tasks], separators=(',', ':'))),
+            ('columns', lambda: json.dumps({'fields': TASK_COLUMNS, 'rows': tasks}, separators=(',', ':'))),
+        ]
+        print(f"{'format':<24}{'encode ms':>10}{'bytes':>12}{'gzip':>10}{'gzip ms':>9}{'br':>10}{'br ms':>8}")
+        for name, encode in variants:
+            body, encode_ms = timed(encode, args.repeat)
+            data = body.encode()
+            gzipped, gzip_ms = timed(lambda: gzip.compress(data, args.gzip_level), args.repeat)
+            line = f'{name:<24}{encode_ms:>10.1f}{len(data):>12}{len(gzipped):>10}{gzip_ms:>9.1f}'
+            if brotli:
+                compressed, brotli_ms = timed(lambda: brotli.compress(data, quality=BROTLI_QUALITY), args.repeat)
+                line += f'{len(compressed):>10}{brotli_ms:>8.1f}'
+            else:
+                line += f"{'-':>10}{'-':>8}"
+            print(line)
+        if not brotli:
+            print()
+            print('brotli is not installed; install it to compare br sizes')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+# Query-plan regression benchmark for the hot tasks / payroll / invitations queries.
+#
+# Builds a large synthetic ted.db, checks with EXPLAIN QUERY PLAN that none of the
+# queries below falls back to a full table scan, and reports timings.
+#
+#   python benchmarks/bench_query_plans.py --users 200 --days 365
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+USER = 'bench_user7'
+FROM_DATE = '2024-03-01'
+TO_DATE = '2024-05-31'
+DAY = '2024-04-15'
+
+# (route, sql, params) -- keep in sync with the statements in app.py and reporting.py
+QUERIES = [
+    ('get_tasks_for_date', 'SELECT * FROM tasks WHERE user_id = ? AND task_date = ? ORDER BY id', (USER, DAY)),
+    ('get_tasks_for_date (all users)', 'SELECT * FROM tasks WHERE task_date = ? ORDER BY id', (DAY,)),
+    ('get_tasks_for_period', 'SELECT * FROM tasks WHERE task_date BETWEEN ? AND ? AND user_id = ? ORDER BY task_date, id', (FROM_DATE, TO_DATE, USER)),
+    ('get_tasks_for_period (all users)', 'SELECT * FROM tasks WHERE task_date BETWEEN ? AND ? ORDER BY task_date, id', (DAY, DAY)),
+    ('get_tasks_for_period: page',
+     'SELECT * FROM tasks WHERE task_date BETWEEN ? AND ? AND user_id = ? AND (task_date, id) > (?, ?) ORDER BY task_date, id LIMIT ?',
+     (DAY, TO_DATE, USER, DAY, 0, 501)),
+    ('get_tasks_for_period: page (all users)',
+     'SELECT * FROM tasks WHERE task_date BETWEEN ? AND ? AND (task_date, id) > (?, ?) ORDER BY task_date, id LIMIT ?',
+     (DAY, TO_DATE, DAY, 0, 501)),
+    ('send_report: any tasks',
+     'SELECT 1 FROM tasks WHERE user_id = ? AND task_date BETWEEN ? AND ? LIMIT 1',
+     (USER, FROM_DATE, TO_DATE)),
+    ('get_report / send_report: task slice',
+     'SELECT * FROM tasks WHERE user_id = ? AND task_date BETWEEN ? AND ? ORDER BY task_date, id',
+     (USER, FROM_DATE, TO_DATE)),
+    ('get_team_report: range scan',
+     'SELECT * FROM tasks WHERE task_date BETWEEN ? AND ? ORDER BY task_date, id',
+     (DAY, DAY)),
+    ('get_team_report: employees',
+     "SELECT user_id, email FROM users WHERE role = 'employee' ORDER BY user_id",
+     ()),
+    ('get_effort_summary: daily_effort',
+     'SELECT task_date, total_minutes, task_count, missing_file_count FROM daily_effort WHERE user_id = ? AND task_date BETWEEN ? AND ? ORDER BY task_date',
+     (USER, FROM_DATE, TO_DATE)),
+    ('working days',
+     'SELECT date FROM calendar WHERE date BETWEEN ? AND ? AND is_weekday = 1 AND is_holiday = 0 ORDER BY date',
+     (FROM_DATE, TO_DATE)),
+    ('mailer: claim due messages',
+     "SELECT id FROM outbox WHERE status IN ('queued', 'sending') AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+     (1e12, 50)),
+    ('mailer: claimed batch',
+     'SELECT id, sender, recipients, message, attempts FROM outbox WHERE claim_id = ? ORDER BY id',
+     ('claim',)),
+    ('jobs: lost after max attempts',
+     "SELECT id FROM jobs WHERE status = 'running' AND next_attempt_at <= ? AND attempts >= ?",
+     (1e12, 3)),
+    ('jobs: claim next due',
+     "SELECT id FROM jobs WHERE status IN ('queued', 'running') AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 1",
+     (1e12,)),
+    ('jobs: claimed job',
+     'SELECT * FROM jobs WHERE claim_id = ?',
+     ('claim',)),
+    ('jobs: pending',
+     "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')",
+     ()),
+    ('jobs: prune finished',
+     'SELECT id FROM jobs WHERE finished_at < ?',
+     (0,)),
+    ('get_payroll_records', 'SELECT * FROM payroll WHERE employee_id = ?', (3,)),
+    ('run_payroll: known employees',
+     'SELECT id FROM employees WHERE id IN (SELECT value FROM json_each(?))',
+     ('[1, 2, 3]',)),
+    ('run_payroll: existing rows',
+     'SELECT DISTINCT employee_id FROM payroll WHERE employee_id IN (SELECT value FROM json_each(?)) AND period = ?',
+     ('[1, 2, 3]', '2024-01')),
+    ('get_payroll_summary: period',
+     'SELECT department, period, headcount, salary, bonus, deductions, tax, net_salary FROM payroll_department_summary WHERE 1 = 1 AND period >= ? AND period <= ? ORDER BY period, department',
+     ('2024-01', '2024-01')),
+    ('get_payroll_summary: department',
+     'SELECT department, period, headcount, salary, bonus, deductions, tax, net_salary FROM payroll_department_summary WHERE 1 = 1 AND department = ? AND period >= ? ORDER BY period, department',
+     ('Engineering', '2024-01')),
+    ('ETag: data versions',
+     'SELECT scope, version FROM data_versions WHERE scope IN (?, ?)',
+     (f'tasks:{USER}', 'calendar')),
+    ('invite', 'SELECT * FROM invitations WHERE email = ? OR user_id = ?', ('invite3@example.com', 'invitee3')),
+    ('user directory: lookup', 'SELECT email, role, status FROM users WHERE user_id = ?', (USER,)),
+    ('report archive: same content',
+     'SELECT id FROM report_archive WHERE user_id = ? AND content_hash = ?',
+     (USER, 'hash')),
+    ('report archive: known blobs',
+     'SELECT hash FROM report_blobs WHERE hash IN (SELECT value FROM json_each(?))',
+     ('["a", "b"]',)),
+    ('report archive: expired',
+     'SELECT id FROM report_archive WHERE last_sent_at < ? AND id != ?',
+     (0, 1)),
+    ('report archive: oldest',
+     'SELECT id FROM report_archive WHERE id != ? ORDER BY last_sent_at LIMIT 1',
+     (1,)),
+    ('report archive: blob still used',
+     'SELECT 1 FROM report_archive_files WHERE blob_hash = ? LIMIT 1',
+     ('hash',)),
+    ('/reports: user page',
+     'SELECT * FROM report_archive WHERE 1 = 1 AND user_id = ? AND (last_sent_at, id) < (?, ?) ORDER BY last_sent_at DESC, id DESC LIMIT ?',
+     (USER, 1e12, 1 << 62, 51)),
+    ('/reports: all users page',
+     'SELECT * FROM report_archive WHERE 1 = 1 AND (last_sent_at, id) < (?, ?) ORDER BY last_sent_at DESC, id DESC LIMIT ?',
+     (1e12, 1 << 62, 51)),
+    ('/reports/<id>/<format>',
+     'SELECT a.name, b.hash, b.encoding FROM report_archive a JOIN report_archive_files f ON f.archive_id = a.id '
+     'JOIN report_blobs b ON b.hash = f.blob_hash WHERE a.id = ? AND f.format = ?',
+     (1, 'pdf')),
+    ('report cache: archived files',
+     'SELECT f.format, b.hash, b.encoding FROM report_archive_files f JOIN report_blobs b ON b.hash = f.blob_hash '
+     'WHERE f.archive_id = ?',
+     (1,)),
+    ('report cache: lookup', 'SELECT archive_id FROM report_cache WHERE key = ? AND user_id = ?', ('key', USER)),
+    ('report cache: invalidate', 'DELETE FROM report_cache WHERE user_id = ?', (USER,)),
+    ('report cache: archive entry deleted', 'DELETE FROM report_cache WHERE archive_id = ?', (1,)),
+]
+
+FULL_SCAN = re.compile(r'^SCAN (tasks|payroll|invitations|users|employees|daily_effort|calendar|outbox|payroll_department_summary|data_versions|report_archive|report_archive_files|report_blobs|report_cache|jobs)$')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--tasks-per-day', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--keep', action='store_true', help='keep the generated database')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ted-bench-')
+    os.environ['DB_PATH'] = os.path.join(workdir, 'ted.db')
+
+    # Imported after DB_PATH is set so the pool points at the synthetic database
+    from db import get_db, get_pool, init_db
+    from benchmarks.synthetic import populate
+
+    init_db()
+    started = time.perf_counter()
+    counts = populate(os.environ['DB_PATH'], users=args.users, days=args.days, tasks_per_day=args.tasks_per_day)
+    print(f"Loaded {counts['tasks']} tasks, {counts['users']} users, {counts['payroll']} payroll rows "
+          f"in {time.perf_counter() - started:.1f}s ({os.environ['DB_PATH']})")
+    print()
+
+    failures = []
+    with get_db() as conn:
+        print(f"{'query':<40} {'rows':>6} {'avg ms':>9}  plan")
+        for name, sql, params in QUERIES:
+            plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+            scans = [step for step in plan if FULL_SCAN.match(step)]
+            if scans:
+                failures.append((name, scans))
+
+            rows = 0
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                rows = len(conn.execute(sql, params).fetchall())
+            elapsed_ms = (time.perf_counter() - started) * 1000 / args.repeat
+            print(f"{name:<40} {rows:>6} {elapsed_ms:>9.3f}  {' | '.join(plan)}")
+
+    print()
+    if not args.keep:
+        get_pool().close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if failures:
+        for name, scans in failures:
+            print(f'FULL TABLE SCAN in {name}: {scans}')
+        sys.exit(1)
+    print('OK: no full table scans')
+
+
+if __name__ == '__main__':
+    main()
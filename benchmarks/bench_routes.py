@@ -0,0 +1,385 @@
+# Load test for the Flask routes.
+#
+# Builds a synthetic ted.db in a temporary directory, points SMTP at a local sink and
+# wkhtmltopdf at a stub, then drives every route with --requests calls at --concurrency and
+# prints throughput and p50/p95/p99 latency per route. /send_report also gets a row for its
+# background job (render + enqueue), measured from the job queue.
+#
+#   python benchmarks/bench_routes.py --users 50 --days 90 --requests 200 --concurrency 8
+#   python benchmarks/bench_routes.py --server --routes get_report,send_report
+#   python benchmarks/bench_routes.py --save before.json        # on the old commit
+#   python benchmarks/bench_routes.py --compare before.json     # on the new one
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stand_ins import SmtpSink, write_wkhtmltopdf_stub  # noqa: E402
+
+START = date(2024, 1, 1)
+WINDOW_DAYS = 30  # date range used by the period and report routes
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))]
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': sum(count for status, count in statuses.items() if status >= 400),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0
+    }
+
+
+# Everything a request builder needs to pick realistic arguments
+class Workload:
+    def __init__(self, users, days, task_ids, employee_ids, load_todays_tasks):
+        self.user_ids = [f'bench_user{i}' for i in range(users)]
+        self.days = days
+        self.task_ids = task_ids
+        self.employee_ids = employee_ids
+        self.sequence = itertools.count()  # unique suffixes for rows that must not collide
+        self.delete_ids = iter(task_ids[len(task_ids) // 2:][::-1])  # deletes work down from the newest tasks
+        self.job_ids = []
+        self.message_ids = []
+        self._load_todays_tasks = load_todays_tasks
+        self._todays_tasks = None
+        self._lock = threading.Lock()
+
+    def user(self, rng):
+        return rng.choice(self.user_ids)
+
+    def window(self, rng):
+        first = START + timedelta(days=rng.randint(0, max(0, self.days - WINDOW_DAYS)))
+        return first.isoformat(), (first + timedelta(days=WINDOW_DAYS - 1)).isoformat()
+
+    def day(self, rng):
+        return (START + timedelta(days=rng.randint(0, self.days - 1))).isoformat()
+
+    def existing_task(self, rng):
+        return rng.choice(self.task_ids[:len(self.task_ids) // 2])  # never deleted by delete_task
+
+    # /update_task only edits tasks dated today, i.e. the ones add_task and add_tasks created
+    def todays_task(self, rng):
+        with self._lock:
+            if self._todays_tasks is None:
+                self._todays_tasks = self._load_todays_tasks() or [0]
+            return rng.choice(self._todays_tasks)
+
+    def next_delete(self):
+        with self._lock:
+            return next(self.delete_ids, self.task_ids[0])
+
+    def remember(self, kind, value):
+        if value is not None:
+            with self._lock:
+                (self.job_ids if kind == 'job' else self.message_ids).append(value)
+
+    def recent(self, rng, kind):
+        with self._lock:
+            values = self.job_ids if kind == 'job' else self.message_ids
+            return rng.choice(values) if values else 0
+
+
+def new_task(rng, n):
+    return {
+        'area_of_effort': f'Load test #{n}',
+        'effort_hours': rng.randint(0, 4),
+        'effort_minutes': rng.choice([0, 15, 30, 45]),
+        'effort_towards': 'Client Work',
+        'time_log_type': 'Billable',
+        'output_file': rng.choice(['', f'https://files.example.com/load/{n}']),
+        'output_location': '',
+        'task_date': date.today().isoformat()
+    }
+
+
+def payroll_period(n):
+    return f'{2100 + n // 12}-{n % 12 + 1:02d}'  # far from the synthetic history, unique per request
+
+
+# (route, method, build(workload, rng) -> (path, json body or None)), in the order they run.
+# Reads go first so they see the synthetic data as generated.
+def scenarios():
+    return [
+        ('get_tasks_for_date', 'GET', lambda w, r: (f'/get_tasks_for_date?user_id={w.user(r)}&task_date={w.day(r)}', None)),
+        ('get_tasks_for_period', 'GET', lambda w, r: ('/get_tasks_for_period?from_date={}&to_date={}&user_id={}'.format(*w.window(r), w.user(r)), None)),
+        ('get_tasks_for_period (team, columns)', 'GET', lambda w, r: ('/get_tasks_for_period?from_date={}&to_date={}&format=columns'.format(*w.window(r)), None)),
+        ('get_tasks_for_period (team, ndjson)', 'GET', lambda w, r: ('/get_tasks_for_period?from_date={}&to_date={}&format=ndjson'.format(*w.window(r)), None)),
+        ('get_report', 'GET', lambda w, r: ('/get_report?user_id={}&from_date={}&to_date={}'.format(w.user(r), *w.window(r)), None)),
+        ('get_team_report', 'GET', lambda w, r: ('/get_team_report?from_date={}&to_date={}'.format(*w.window(r)), None)),
+        ('get_effort_summary', 'GET', lambda w, r: ('/get_effort_summary?user_id={}&from_date={}&to_date={}'.format(w.user(r), *w.window(r)), None)),
+        ('get_users', 'GET', lambda w, r: ('/get_users', None)),
+        ('special_users', 'GET', lambda w, r: ('/special_users', None)),
+        ('get_payroll_records', 'GET', lambda w, r: (f'/get_payroll_records?employee_id={r.choice(w.employee_ids)}', None)),
+        ('get_payroll_summary', 'GET', lambda w, r: (f'/get_payroll_summary?period=2024-{r.randint(1, max(1, min(12, w.days // 30))):02d}', None)),
+        ('login', 'POST', lambda w, r: ('/login', {'user_id': w.user(r), 'password': 'secret'})),
+        ('register', 'POST', lambda w, r: (lambda n: ('/register', {'user_id': f'invitee{n}', 'email': f'invite{n}@example.com', 'password': 'secret',
+                                                                    'role': 'employee', 'invitation': f'code{n}'}))(next(w.sequence))),
+        ('invite', 'POST', lambda w, r: (lambda n: ('/invite', {'email': f'load{n}@example.com', 'user_id': f'load{n}', 'role': 'employee'}))(next(w.sequence))),
+        ('add_task', 'POST', lambda w, r: ('/add_task', dict(new_task(r, next(w.sequence)), user_id=w.user(r)))),
+        ('add_tasks', 'POST', lambda w, r: ('/add_tasks', {'user_id': w.user(r), 'tasks': [new_task(r, next(w.sequence)) for _ in range(10)]})),
+        ('update_task', 'PUT', lambda w, r: ('/update_task', dict(new_task(r, next(w.sequence)), task_id=w.todays_task(r)))),
+        ('add_manager_note', 'POST', lambda w, r: ('/add_manager_note', {'task_id': w.existing_task(r), 'manager_note': 'Looks good', 'broad_area_of_work': 'IT'})),
+        ('add_reviewer_note', 'POST', lambda w, r: ('/add_reviewer_note', {'task_id': w.existing_task(r), 'reviewer_note': 'ok'})),
+        ('delete_task', 'DELETE', lambda w, r: (f'/delete_task?task_id={w.next_delete()}', None)),
+        ('add_employee', 'POST', lambda w, r: (lambda n: ('/add_employee', {'name': f'Load {n}', 'email': f'employee{n}@example.com', 'department': 'Engineering'}))(next(w.sequence))),
+        ('add_payroll', 'POST', lambda w, r: ('/add_payroll', {'employee_id': r.choice(w.employee_ids), 'period': payroll_period(next(w.sequence)),
+                                                               'salary': 50000, 'bonus': 500, 'deductions': 100, 'tax': 5000})),
+        ('run_payroll', 'POST', lambda w, r: ('/run_payroll', {'period': payroll_period(next(w.sequence)), 'records': [
+            {'employee_id': employee_id, 'salary': 50000, 'bonus': 0, 'deductions': 100, 'tax': 5000} for employee_id in w.employee_ids[:20]]})),
+        ('send_report', 'POST', lambda w, r: ('/send_report', dict(zip(('from_date', 'to_date'), w.window(r)), user_id=w.user(r), role=r.choice(['employee', 'manager'])))),
+        ('report_jobs', 'GET', lambda w, r: (f"/report_jobs/{w.recent(r, 'job')}", None)),
+        ('outbox', 'GET', lambda w, r: (f"/outbox/{w.recent(r, 'message')}", None)),
+        ('report_stats', 'GET', lambda w, r: ('/report_stats', None)),
+        ('reports', 'GET', lambda w, r: (f'/reports?user_id={w.user(r)}', None)),
+        ('user_cache_stats', 'GET', lambda w, r: ('/user_cache_stats', None)),
+        ('metrics', 'GET', lambda w, r: ('/metrics', None)),
+        ('profiles', 'GET', lambda w, r: ('/profiles', None)),
+    ]
+
+
+# Sends one request and returns (status, parsed JSON body or None); the body is read in full
+class TestClientDriver:
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        data = response.get_data()
+        return response.status_code, response.get_json(silent=True) if response.is_json else None, len(data)
+
+
+class ServerDriver:
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def request(self, method, path, body):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                status, payload, content_type = response.status, response.read(), response.headers.get('Content-Type', '')
+        except urllib.error.HTTPError as e:
+            status, payload, content_type = e.code, e.read(), e.headers.get('Content-Type', '')
+        parsed = json.loads(payload) if content_type.startswith('application/json') and payload else None
+        return status, parsed, len(payload)
+
+
+def run_scenario(driver, workload, name, method, build, requests, concurrency, seed):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = itertools.count()
+
+    def worker(index):
+        rng = random.Random(f'{seed}-{name}-{index}')
+        while next(counter) < requests:
+            path, body = build(workload, rng)
+            started = time.perf_counter()
+            status, payload, _ = driver.request(method, path, body)
+            elapsed = time.perf_counter() - started
+            if isinstance(payload, dict):
+                workload.remember('job', payload.get('job_id'))
+                workload.remember('message', payload.get('message_id'))
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+# Wait for queued report jobs and outgoing mail to finish; returns the job row for /send_report
+def drain(app, workload, timeout):
+    deadline = time.monotonic() + timeout
+    while app.report_jobs.pending() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    while time.monotonic() < deadline:
+        outbox = app.mailer.stats()
+        if not outbox['queued'] and not outbox['sending']:
+            break
+        app.mailer.wake()
+        time.sleep(0.05)
+
+    jobs = [app.report_jobs.get(job_id) for job_id in workload.job_ids]
+    jobs = [job for job in jobs if job and job.finished_at]
+    if not jobs:
+        return None
+    statuses = {}
+    for job in jobs:
+        code = 200 if job.status == 'succeeded' else 500
+        statuses[code] = statuses.get(code, 0) + 1
+    elapsed = max(job.finished_at for job in jobs) - min(job.created_at for job in jobs)
+    return summarize([job.finished_at - job.started_at for job in jobs], statuses, elapsed)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_results(results, baseline=None):
+    header = f"{'route':<40}{'reqs':>6}{'err':>5}{'req/s':>9}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    if baseline:
+        header += f"{'p50 Δ':>9}{'p95 Δ':>9}"
+    print(header)
+    for name, row in results.items():
+        line = (f"{name:<40}{row['requests']:>6}{row['errors']:>5}{row['throughput']:>9.1f}{row['mean_ms']:>9.2f}"
+                f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}{row['max_ms']:>9.2f}")
+        before = (baseline or {}).get(name)
+        if before:
+            for key in ('p50_ms', 'p95_ms'):
+                line += f'{(row[key] - before[key]) / before[key] * 100:>+8.0f}%' if before[key] else f"{'-':>9}"
+        print(line)
+    print('latencies in ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-route load test on a synthetic database')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--tasks-per-day', type=int, default=4)
+    parser.add_argument('--notes-rate', type=float, default=0.5)
+    parser.add_argument('--requests', type=int, default=100, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per route before measuring')
+    parser.add_argument('--routes', help='comma-separated route names to run (default: all)')
+    parser.add_argument('--server', action='store_true', help='go through a local threaded HTTP server instead of the test client')
+    parser.add_argument('--pdf-delay', type=float, default=0.0, help='seconds the wkhtmltopdf stub takes per render')
+    parser.add_argument('--drain-timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON from an earlier --save to compare against')
+    parser.add_argument('--verbose', action='store_true', help="show the app's own log output")
+    args = parser.parse_args()
+
+    selected = scenarios()
+    if args.routes:
+        names = set(args.routes.split(','))
+        unknown = names - {name for name, _, _ in selected}
+        if unknown:
+            parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+        selected = [scenario for scenario in selected if scenario[0] in names]
+
+    workdir = tempfile.mkdtemp(prefix='ted-load-')
+    sink = SmtpSink().start()
+    # Set before the app is imported: config.py reads the environment once, and load_dotenv
+    # does not override variables that are already set, so .env cannot point this at real SMTP
+    os.environ.update({
+        'DB_PATH': os.path.join(workdir, 'ted.db'),
+        'SMTP_SERVER': '127.0.0.1',
+        'SMTP_PORT': str(sink.port),
+        'SMTP_USERNAME': 'bench@example.com',
+        'SMTP_PASSWORD': '',
+        'SMTP_STARTTLS': 'false',
+        'ADMIN_EMAIL': 'admin@example.com',
+        'OUTBOX_POLL_INTERVAL': '0.2',
+        'WKHTMLTOPDF_PATH': write_wkhtmltopdf_stub(workdir, args.pdf_delay),
+        'REPORT_ARCHIVE_DIR': os.path.join(workdir, 'report-archive'),
+        'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+        'HOLIDAYS_FILE': os.path.join(workdir, 'holidays.json'),
+        'SPECIAL_USERS_FILE': os.path.join(ROOT, 'special_users.json'),
+    })
+    invitations = args.requests + args.warmup if any(name == 'register' for name, _, _ in selected) else 0
+
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+            from db import get_db, init_db
+            from benchmarks.synthetic import populate
+
+            init_db()
+            counts = populate(os.environ['DB_PATH'], users=args.users, days=args.days, tasks_per_day=args.tasks_per_day,
+                              notes_rate=args.notes_rate, start=START, seed=args.seed, invitations=invitations)
+            with get_db() as conn:
+                task_ids = [row[0] for row in conn.execute('SELECT id FROM tasks ORDER BY id')]
+                employee_ids = [row[0] for row in conn.execute('SELECT id FROM employees ORDER BY id')]
+
+            import app as app_module
+            app_module.is_within_submission_time = lambda: True  # /add_task(s) only accept tasks during office hours
+
+            server = None
+            if args.server:
+                from werkzeug.serving import make_server
+                server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+                threading.Thread(target=server.serve_forever, name='bench-http', daemon=True).start()
+                driver = ServerDriver(f'http://127.0.0.1:{server.server_port}')
+            else:
+                driver = TestClientDriver(app_module.app)
+
+            def load_todays_tasks():
+                with get_db() as conn:
+                    return [row[0] for row in conn.execute('SELECT id FROM tasks WHERE task_date = ?', (date.today().isoformat(),))]
+
+            workload = Workload(args.users, args.days, task_ids, employee_ids, load_todays_tasks)
+            results = {}
+            for name, method, build in selected:
+                if args.warmup:
+                    run_scenario(driver, workload, name, method, build, args.warmup, 1, f'{args.seed}-warmup')
+                results[name] = run_scenario(driver, workload, name, method, build, args.requests, args.concurrency, args.seed)
+                print(f'{name}: done', file=sys.stderr)
+            job_row = drain(app_module, workload, args.drain_timeout)
+            if job_row:
+                results['send_report (background job)'] = job_row
+            if server:
+                server.shutdown()
+
+        print(f"{counts['users']} users, {counts['tasks']} tasks, {counts['payroll']} payroll rows; "
+              f"{args.requests} requests per route at concurrency {args.concurrency} via {'HTTP server' if args.server else 'test client'}")
+        print(f'SMTP sink received {sink.messages} messages ({sink.bytes} bytes)')
+        print()
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                saved = json.load(f)
+            baseline = saved['routes']
+            print(f"compared with {args.compare} (revision {saved.get('revision') or 'unknown'})")
+        print_results(results, baseline)
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump({'revision': git_revision(), 'args': vars(args), 'routes': results}, f, indent=2)
+            print(f'saved to {args.save}')
+    finally:
+        sink.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
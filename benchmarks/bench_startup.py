@@ -0,0 +1,123 @@
+# Startup-time benchmark: how long a worker takes to import app.py.
+#
+# Runs `python -X importtime -c "import app"` against a migrated synthetic database several
+# times and reports the import time of app and its slowest direct imports. Exits non-zero if
+# a dependency that should be loaded lazily (openpyxl, cProfile, the MIME builders) is imported
+# at startup, if importing the app starts the outbox or report job threads, or if --max-ms is exceeded.
+#
+#   python benchmarks/bench_startup.py --repeat 10
+#   python benchmarks/bench_startup.py --max-ms 150
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Only needed to render or send reports, or to profile; importing them at startup is a regression
+DEFERRED_MODULES = ('openpyxl', 'numpy', 'cProfile', 'pstats', 'email.mime')
+
+# Threads (by name prefix) importing the app must not start; they belong in the worker, after any fork
+DEFERRED_THREADS = ('log-writer', 'mailer', 'report-job')
+
+PROBE = 'import app, threading; print(",".join(thread.name for thread in threading.enumerate()))'
+
+
+# Modules in `-X importtime` order (children before their parent), from lines like
+# "import time: <self us> | <cumulative us> | <indent><module>"
+def parse_importtime(stderr):
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_field, cumulative_field, name = line.split('|')
+        self_us = int(self_field.split(':')[1])
+        cumulative_us = int(cumulative_field)
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), depth, self_us, cumulative_us))
+    return modules
+
+
+# Modules imported directly by the top-level module `name`: the depth-1 entries just before it
+def direct_imports(modules, name):
+    index = next(i for i, (module, depth, _, _) in enumerate(modules) if module == name and depth == 0)
+    children = []
+    for module in reversed(modules[:index]):
+        if module[1] == 0:
+            break
+        if module[1] == 1:
+            children.append(module)
+    return children
+
+
+def run_once(env):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        sys.exit(f'importing app failed:\n{result.stderr[-2000:]}')
+    return wall, parse_importtime(result.stderr), result.stdout.strip().split(',')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker startup (import) time benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='slowest direct imports of app to list')
+    parser.add_argument('--max-ms', type=float, help='fail if the median import time of app exceeds this')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ted-startup-')
+    env = dict(os.environ,
+               DB_PATH=os.path.join(workdir, 'ted.db'),
+               SMTP_SERVER='127.0.0.1',
+               SMTP_USERNAME='',
+               SMTP_PASSWORD='')
+    os.environ['DB_PATH'] = env['DB_PATH']
+
+    try:
+        from db import init_db  # reads DB_PATH at import time
+        init_db()
+
+        run_once(env)  # compile bytecode and warm the page cache before measuring
+        runs = [run_once(env) for _ in range(args.repeat)]
+        app_ms = [next(cumulative for name, depth, _, cumulative in modules if name == 'app' and depth == 0) / 1000
+                  for _, modules, _ in runs]
+        wall_ms = [wall * 1000 for wall, _, _ in runs]
+        median_ms = statistics.median(app_ms)
+        print(f'import app: median {median_ms:.1f} ms, min {min(app_ms):.1f} ms '
+              f'(process wall time median {statistics.median(wall_ms):.1f} ms) over {args.repeat} runs')
+        print()
+
+        _, modules, threads = min(runs, key=lambda run: run[0])
+        direct = direct_imports(modules, 'app')
+        print(f"{'module':<32}{'cumulative ms':>14}{'self ms':>10}")
+        for name, _, self_us, cumulative_us in sorted(direct, key=lambda module: -module[3])[:args.top]:
+            print(f'{name:<32}{cumulative_us / 1000:>14.1f}{self_us / 1000:>10.1f}')
+        print()
+
+        problems = []
+        imported = {name for name, _, _, _ in modules}
+        for module in DEFERRED_MODULES:
+            if module in imported:
+                problems.append(f'{module} is imported at startup')
+        for thread in DEFERRED_THREADS:
+            if any(name.startswith(thread) for name in threads):
+                problems.append(f'importing app starts the {thread} thread')
+        if args.max_ms is not None and median_ms > args.max_ms:
+            problems.append(f'median import time {median_ms:.1f} ms is over the {args.max_ms:.1f} ms budget')
+        for problem in problems:
+            print(f'FAIL: {problem}')
+        if problems:
+            sys.exit(1)
+        print('OK: heavy report dependencies are loaded lazily')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Local stand-ins for the external services the report pipeline talks to, so the benchmarks
+# never send real mail or need wkhtmltopdf installed.
+import os
+import socketserver
+import stat
+import threading
+
+# Smallest file wkhtmltopdf consumers accept as a PDF
+STUB_PDF = b'%PDF-1.4\n1 0 obj << /Type /Catalog >> endobj\ntrailer << /Root 1 0 R >>\n%%EOF\n'
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost benchmark SMTP sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                for data_line in self.rfile:
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(data_line)
+                self.server.received(size)
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:  # MAIL, RCPT, RSET, NOOP
+                self.reply('250 OK')
+
+
+# Accepts and discards every message; counts what it received
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _SmtpHandler)
+        self.messages = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def received(self, size):
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='smtp-sink', daemon=True).start()
+        return self
+
+
+# Write an executable that behaves like `wkhtmltopdf ... - -`: reads HTML on stdin, writes a PDF
+# to stdout. delay adds a fixed render time so PDF pool contention still shows up.
+def write_wkhtmltopdf_stub(directory, delay=0.0):
+    path = os.path.join(directory, 'wkhtmltopdf')
+    pdf = STUB_PDF.decode('ascii').replace('%', '%%').replace('\n', '\\n')
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\n')
+        f.write('cat > /dev/null\n')
+        if delay:
+            f.write(f'sleep {delay}\n')
+        f.write(f"printf '{pdf}'\n")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
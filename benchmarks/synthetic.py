@@ -0,0 +1,117 @@
+# Synthetic data for the benchmarks. Run directly to write a standalone database:
+#
+#   python benchmarks/synthetic.py --out /tmp/ted-large.db --users 200 --days 365
+import argparse
+import os
+import random
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+AREAS = ['Design review', 'Client call', 'Code changes', 'Documentation', 'Testing', 'Research']
+EFFORT_TOWARDS = ['Brand Building', 'Client Work', 'Internal', 'Training']
+TIME_LOG_TYPES = ['Billable', 'Non-billable']
+BROAD_AREAS = ['', 'IT', 'Marketing', 'Operations']
+DEPARTMENTS = ['Engineering', 'Marketing', 'Operations', 'Finance']
+
+
+def weekdays(start, days):
+    current = start
+    for _ in range(days):
+        if current.weekday() < 5:
+            yield current
+        current += timedelta(days=1)
+
+
+# Fill an initialised (init_db) database with employees, a few managers and reviewers, pending
+# invitations, the employees' tasks (notes_rate of them with manager/reviewer notes) and payroll history
+def populate(path, users=50, days=365, tasks_per_day=4, start=date(2024, 1, 1), seed=42,
+             notes_rate=0.5, managers=2, reviewers=2, invitations=None):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+
+    user_ids = [f'bench_user{i}' for i in range(users)]
+    cursor.executemany(
+        "INSERT OR IGNORE INTO users (user_id, email, password, role) VALUES (?, ?, 'secret', 'employee')",
+        [(user_id, f'{user_id}@example.com') for user_id in user_ids])
+    cursor.executemany(
+        "INSERT OR IGNORE INTO users (user_id, email, password, role) VALUES (?, ?, 'secret', ?)",
+        [(f'bench_{role}{i}', f'bench_{role}{i}@example.com', role)
+         for role, count in (('manager', managers), ('reviewer', reviewers)) for i in range(count)])
+    cursor.executemany(
+        "INSERT OR IGNORE INTO invitations (email, user_id, role, invitation_code) VALUES (?, ?, 'employee', ?)",
+        [(f'invite{i}@example.com', f'invitee{i}', f'code{i}') for i in range(users if invitations is None else invitations)])
+
+    task_rows = []
+    for user_id in user_ids:
+        for day in weekdays(start, days):
+            if rng.random() < 0.05:  # some missed days
+                continue
+            for n in range(rng.randint(1, tasks_per_day * 2 - 1)):
+                task_rows.append((
+                    user_id,
+                    f'{rng.choice(AREAS)} #{n}',
+                    rng.randint(0, 4),
+                    rng.choice([0, 15, 30, 45]),
+                    rng.choice(EFFORT_TOWARDS),
+                    rng.choice(TIME_LOG_TYPES),
+                    rng.choice(['Looks good', 'Please attach the output']) if rng.random() < notes_rate else None,
+                    rng.choice(BROAD_AREAS),
+                    rng.choice(['ok', 'Needs a second look']) if rng.random() < notes_rate else None,
+                    rng.choice(['', f'https://files.example.com/{user_id}/{day}/{n}']),
+                    rng.choice(['', 'Shared drive']),
+                    day.isoformat(),
+                ))
+    cursor.executemany('''INSERT INTO tasks
+        (user_id, area_of_effort, effort_hours, effort_minutes, effort_towards, time_log_type, manager_note,
+         broad_area_of_work, reviewer_note, output_file, output_location, task_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', task_rows)
+
+    cursor.executemany(
+        'INSERT OR IGNORE INTO employees (name, email, department) VALUES (?, ?, ?)',
+        [(f'Employee {i}', f'{user_id}@example.com', rng.choice(DEPARTMENTS)) for i, user_id in enumerate(user_ids)])
+    cursor.execute('SELECT id FROM employees')
+    employee_ids = [row[0] for row in cursor.fetchall()]
+    payroll_rows = []
+    for employee_id in employee_ids:
+        salary = rng.randint(30, 150) * 1000
+        for month in range(max(1, days // 30)):
+            period = f'{start.year + (start.month - 1 + month) // 12}-{(start.month - 1 + month) % 12 + 1:02d}'
+            bonus = rng.choice([0, 0, 500, 1000])
+            deductions = rng.choice([0, 100, 250])
+            tax = round(salary * 0.1, 2)
+            payroll_rows.append((employee_id, period, salary, bonus, deductions, tax, salary + bonus - deductions - tax))
+    cursor.executemany('''INSERT INTO payroll (employee_id, period, salary, bonus, deductions, tax, net_salary)
+        VALUES (?, ?, ?, ?, ?, ?, ?)''', payroll_rows)
+
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+    return {'users': len(user_ids), 'tasks': len(task_rows), 'payroll': len(payroll_rows)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic ted.db for benchmarking')
+    parser.add_argument('--out', required=True, help='database file to create (must not exist)')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--tasks-per-day', type=int, default=4)
+    parser.add_argument('--notes-rate', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if os.path.exists(args.out):
+        parser.error(f'{args.out} already exists')
+    os.environ['DB_PATH'] = args.out
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from db import init_db  # reads DB_PATH at import time
+
+    init_db()
+    counts = populate(args.out, users=args.users, days=args.days, tasks_per_day=args.tasks_per_day,
+                      notes_rate=args.notes_rate, seed=args.seed)
+    print(f"Wrote {args.out}: {counts['users']} users, {counts['tasks']} tasks, {counts['payroll']} payroll rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+SMTP_SERVER = os.getenv('SMTP_SERVER')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+SMTP_USERNAME = os.getenv('SMTP_USERNAME')
+SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+ADMIN_EMAIL = os.getenv('ADMIN_EMAIL')
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() not in ('0', 'false', 'no')  # off for a local debugging server
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', 30))
+
+# Outbox delivery (invitations and reports)
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))  # messages claimed per delivery round
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_RETRY_BACKOFF = float(os.getenv('OUTBOX_RETRY_BACKOFF', 30))  # seconds, doubled after each failure
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 5))  # seconds between outbox checks when idle
+SMTP_IDLE_TIMEOUT = float(os.getenv('SMTP_IDLE_TIMEOUT', 60))  # seconds an unused SMTP session is kept open
+SMTP_MAX_MESSAGES_PER_SESSION = int(os.getenv('SMTP_MAX_MESSAGES_PER_SESSION', 100))
+
+# Logging: JSON lines (or LOG_FORMAT=text) written to stdout by a background thread
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # records beyond this are dropped instead of blocking requests
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 1.0))  # fraction of routine per-request messages (logins, access log) kept
+
+# Path to wkhtmltopdf
+WKHTMLTOPDF_PATH = os.getenv('WKHTMLTOPDF_PATH', '/usr/local/bin/wkhtmltopdf')
+
+# SQLite database and connection pool
+DB_PATH = os.getenv('DB_PATH', 'ted.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))  # max open connections per process
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 16384))  # page cache per connection
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 128))  # prepared statements kept per connection
+DB_AUTO_MIGRATE = os.getenv('DB_AUTO_MIGRATE', 'false').lower() in ('1', 'true', 'yes')  # migrate on import instead of `python db.py migrate`
+METRICS_SQL_TIMING = os.getenv('METRICS_SQL_TIMING', 'true').lower() not in ('0', 'false', 'no')  # per-statement timings on /metrics
+
+# Company holidays ({"YYYY-MM-DD": "Holiday name"}), loaded into the calendar table at startup if present
+HOLIDAYS_FILE = os.getenv('HOLIDAYS_FILE', 'holidays.json')
+
+# Cached user lookups (add_task, send_report) and special_users.json
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 30))  # seconds before a cached user is looked up again
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+SPECIAL_USERS_FILE = os.getenv('SPECIAL_USERS_FILE', 'special_users.json')
+
+# Background report jobs (/send_report)
+REPORT_JOB_WORKERS = int(os.getenv('REPORT_JOB_WORKERS', 2))  # reports generated concurrently
+REPORT_JOB_RETENTION_SECONDS = int(os.getenv('REPORT_JOB_RETENTION_SECONDS', 3600))  # how long finished jobs stay visible
+REPORT_JOB_POLL_INTERVAL = float(os.getenv('REPORT_JOB_POLL_INTERVAL', 1))  # seconds between checks for jobs queued by other processes
+REPORT_JOB_CLAIM_TIMEOUT = float(os.getenv('REPORT_JOB_CLAIM_TIMEOUT', 600))  # seconds before a running job is assumed lost
+REPORT_JOB_MAX_ATTEMPTS = int(os.getenv('REPORT_JOB_MAX_ATTEMPTS', 3))  # runs of a lost job before it is marked failed
+
+# Archive of sent reports, deduplicated and compressed, indexed in the database. Entries not
+# sent for REPORT_ARCHIVE_RETENTION_DAYS are dropped, then the least recently sent while the
+# archive is over REPORT_ARCHIVE_MAX_BYTES (0 turns either limit off). REPORT_SAVE_FILES is the
+# old name of REPORT_ARCHIVE and is still honoured.
+REPORT_ARCHIVE = os.getenv('REPORT_ARCHIVE', os.getenv('REPORT_SAVE_FILES', 'true')).lower() not in ('0', 'false', 'no')
+REPORT_ARCHIVE_DIR = os.getenv('REPORT_ARCHIVE_DIR', os.path.join('reports', 'archive'))
+REPORT_ARCHIVE_MAX_BYTES = int(os.getenv('REPORT_ARCHIVE_MAX_BYTES', 1024 * 1024 * 1024))
+REPORT_ARCHIVE_RETENTION_DAYS = int(os.getenv('REPORT_ARCHIVE_RETENTION_DAYS', 365))
+# Re-sending a report whose inputs have not changed reads it back from the archive instead of
+# rendering it again; only takes effect with REPORT_ARCHIVE on
+REPORT_CACHE = os.getenv('REPORT_CACHE', 'true').lower() not in ('0', 'false', 'no')
+
+# wkhtmltopdf render pool
+PDF_RENDER_WORKERS = int(os.getenv('PDF_RENDER_WORKERS', 2))  # wkhtmltopdf processes allowed at once
+PDF_RENDER_TIMEOUT = float(os.getenv('PDF_RENDER_TIMEOUT', 60))  # seconds before a render is killed
+
+# Response compression (gzip, or brotli when the brotli package is installed)
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))  # smaller responses are sent as is
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))  # gzip level
+
+# On-demand request profiling; a request is profiled when it sends PROFILE_HEADER (equal to
+# PROFILE_TOKEN, if set) or falls into PROFILE_SAMPLE_RATE. Captures are kept in PROFILE_DIR.
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PROFILE_HEADER = os.getenv('PROFILE_HEADER', 'X-Profile')
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))  # fraction of requests profiled without the header
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 100))  # oldest captures are deleted first
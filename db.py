@@ -0,0 +1,765 @@
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from functools import lru_cache
+
+from config import (
+    DB_PATH,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE,
+    DB_STATEMENT_CACHE_SIZE,
+    HOLIDAYS_FILE,
+    METRICS_SQL_TIMING,
+)
+from metrics import DB_POOL_WAIT_SECONDS, SQL_FETCH_SECONDS, SQL_ROWS, SQL_STATEMENT_SECONDS
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class SchemaError(Exception):
+    pass
+
+
+class CalendarRangeError(ValueError):
+    pass
+
+
+# Metric label for a statement: the SQL with whitespace collapsed, cut to a readable length
+@lru_cache(maxsize=1024)
+def statement_label(sql):
+    return re.sub(r'\s+', ' ', sql).strip()[:120]
+
+
+# Cursor that records execute time, fetch time and rows returned per statement
+class InstrumentedCursor(sqlite3.Cursor):
+    _statement = None
+
+    def execute(self, sql, parameters=()):
+        self._statement = statement_label(sql)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            SQL_STATEMENT_SECONDS.observe(time.perf_counter() - started, self._statement)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._statement = statement_label(sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            SQL_STATEMENT_SECONDS.observe(time.perf_counter() - started, self._statement)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._record_fetch(started, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._record_fetch(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._record_fetch(started, len(rows))
+        return rows
+
+    def __next__(self):
+        # Iterating a cursor row by row only counts rows; timing every row would cost more than the row
+        row = super().__next__()
+        if self._statement is not None:
+            SQL_ROWS.inc(1, self._statement)
+        return row
+
+    def _record_fetch(self, started, rows):
+        if self._statement is not None:
+            SQL_FETCH_SECONDS.inc(time.perf_counter() - started, self._statement)
+            SQL_ROWS.inc(rows, self._statement)
+
+
+# sqlite3's Connection.execute() does not go through cursor(), so both are routed to InstrumentedCursor
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ConnectionPool:
+    def __init__(self, path, size, timeout):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # LIFO keeps the most recently used (warmest) connection in play
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Connections are handed between request threads, so the same-thread check is off;
+        # a connection is only ever used by the thread that currently holds it.
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+            factory=InstrumentedConnection if METRICS_SQL_TIMING else sqlite3.Connection,
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def acquire(self):
+        started = time.perf_counter()
+        try:
+            return self._acquire()
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f'No database connection available after {self.timeout}s')
+
+    def release(self, conn):
+        # Never hand a half-finished transaction to the next request
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    def stats(self):
+        with self._lock:
+            created = self._created
+        idle = self._idle.qsize()
+        return {'size': self.size, 'open': created, 'idle': idle, 'in_use': created - idle}
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+    return _pool
+
+
+@contextmanager
+def get_db():
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def init_db():
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        # TED system tables
+        cursor.execute('''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL UNIQUE,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL,
+            status TEXT DEFAULT 'active'
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            area_of_effort TEXT,
+            effort_hours INTEGER,
+            effort_minutes INTEGER,
+            effort_towards TEXT,
+            time_log_type TEXT,
+            manager_note TEXT,
+            broad_area_of_work TEXT,
+            reviewer_note TEXT,
+            output_file TEXT,
+            output_location TEXT,
+            task_date DATE DEFAULT (DATE('now', 'localtime'))
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS invitations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL UNIQUE,
+            user_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            invitation_code TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )''')
+
+        # Payroll system tables
+        cursor.execute('''CREATE TABLE IF NOT EXISTS employees (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            department TEXT NOT NULL
+        )''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS payroll (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            employee_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            salary REAL NOT NULL,
+            bonus REAL,
+            deductions REAL,
+            tax REAL,
+            net_salary REAL NOT NULL,
+            FOREIGN KEY (employee_id) REFERENCES employees(id)
+        )''')
+
+        conn.commit()
+        migrate_db(conn)
+
+        if os.path.exists(HOLIDAYS_FILE):
+            load_holidays(conn, HOLIDAYS_FILE)
+
+
+_TASK_MINUTES = 'COALESCE({row}.effort_hours, 0) * 60 + COALESCE({row}.effort_minutes, 0)'
+_TASK_MISSING_FILE = "({row}.output_file IS NULL OR {row}.output_file = '')"
+
+_ADD_TO_DAILY_EFFORT = (
+    'INSERT INTO daily_effort (user_id, task_date, total_minutes, task_count, missing_file_count) '
+    f'VALUES ({{row}}.user_id, {{row}}.task_date, {_TASK_MINUTES}, 1, {_TASK_MISSING_FILE}) '
+    'ON CONFLICT (user_id, task_date) DO UPDATE SET '
+    'total_minutes = total_minutes + excluded.total_minutes, '
+    'task_count = task_count + 1, '
+    'missing_file_count = missing_file_count + excluded.missing_file_count'
+)
+_SUBTRACT_FROM_DAILY_EFFORT = (
+    'UPDATE daily_effort SET '
+    f'total_minutes = total_minutes - ({_TASK_MINUTES}), '
+    'task_count = task_count - 1, '
+    f'missing_file_count = missing_file_count - {_TASK_MISSING_FILE} '
+    'WHERE user_id = {row}.user_id AND task_date = {row}.task_date'
+)
+
+BACKFILL_DAILY_EFFORT = [
+    'DELETE FROM daily_effort',
+    f'''INSERT INTO daily_effort (user_id, task_date, total_minutes, task_count, missing_file_count)
+        SELECT user_id, task_date, SUM({_TASK_MINUTES.format(row='tasks')}), COUNT(*), SUM({_TASK_MISSING_FILE.format(row='tasks')})
+        FROM tasks
+        WHERE task_date IS NOT NULL
+        GROUP BY user_id, task_date''',
+]
+
+# Payroll totals per department and period; a payroll row counts towards its employee's current
+# department, and headcount is the number of distinct employees paid in the group
+_PAYROLL_AMOUNTS = (
+    'COALESCE({row}.salary, 0)',
+    'COALESCE({row}.bonus, 0)',
+    'COALESCE({row}.deductions, 0)',
+    'COALESCE({row}.tax, 0)',
+    'COALESCE({row}.net_salary, 0)',
+)
+_PAYROLL_SUMMARY_COLUMNS = 'department, period, headcount, salary, bonus, deductions, tax, net_salary'
+
+# 1 when the row is its employee's only payroll row for the period, leaving out the payroll row
+# with id {exclude_id} (the row itself; after an update it holds the NEW values)
+_ONLY_PAYROLL_ROW = (
+    'NOT EXISTS (SELECT 1 FROM payroll AS other WHERE other.employee_id = {row}.employee_id '
+    'AND other.period = {row}.period AND other.id != {exclude_id})'
+)
+_ADD_TO_PAYROLL_SUMMARY = (
+    f'INSERT INTO payroll_department_summary ({_PAYROLL_SUMMARY_COLUMNS}) '
+    f"SELECT department, {{row}}.period, {_ONLY_PAYROLL_ROW}, {', '.join(_PAYROLL_AMOUNTS)} "
+    'FROM employees WHERE id = {row}.employee_id '
+    'ON CONFLICT (department, period) DO UPDATE SET '
+    'headcount = headcount + excluded.headcount, '
+    'salary = salary + excluded.salary, '
+    'bonus = bonus + excluded.bonus, '
+    'deductions = deductions + excluded.deductions, '
+    'tax = tax + excluded.tax, '
+    'net_salary = net_salary + excluded.net_salary'
+)
+_SUBTRACT_FROM_PAYROLL_SUMMARY = (
+    'UPDATE payroll_department_summary SET '
+    f'headcount = headcount - {_ONLY_PAYROLL_ROW}, '
+    f'salary = salary - {_PAYROLL_AMOUNTS[0]}, '
+    f'bonus = bonus - {_PAYROLL_AMOUNTS[1]}, '
+    f'deductions = deductions - {_PAYROLL_AMOUNTS[2]}, '
+    f'tax = tax - {_PAYROLL_AMOUNTS[3]}, '
+    f'net_salary = net_salary - {_PAYROLL_AMOUNTS[4]} '
+    'WHERE department = (SELECT department FROM employees WHERE id = {row}.employee_id) AND period = {row}.period'
+)
+_DELETE_EMPTY_PAYROLL_SUMMARY = (
+    'DELETE FROM payroll_department_summary '
+    'WHERE department = (SELECT department FROM employees WHERE id = {row}.employee_id) AND period = {row}.period AND headcount <= 0'
+)
+_AGGREGATE_PAYROLL = (
+    f'''SELECT employees.department, payroll.period, COUNT(DISTINCT payroll.employee_id), {', '.join('SUM(' + amount.format(row='payroll') + ')' for amount in _PAYROLL_AMOUNTS)}
+    FROM payroll JOIN employees ON employees.id = payroll.employee_id'''
+)
+# Rebuild the groups one employee's payroll rows fall into (after the employee moves department or is deleted)
+_RECOMPUTE_PAYROLL_SUMMARY = (
+    'DELETE FROM payroll_department_summary WHERE department = {department} '
+    'AND period IN (SELECT period FROM payroll WHERE employee_id = {employee_id}); '
+    f'INSERT INTO payroll_department_summary ({_PAYROLL_SUMMARY_COLUMNS}) '
+    f'{_AGGREGATE_PAYROLL} '
+    'WHERE employees.department = {department} '
+    'AND payroll.period IN (SELECT period FROM payroll WHERE employee_id = {employee_id}) '
+    'GROUP BY employees.department, payroll.period'
+)
+
+BACKFILL_PAYROLL_SUMMARY = [
+    'DELETE FROM payroll_department_summary',
+    f'''INSERT INTO payroll_department_summary ({_PAYROLL_SUMMARY_COLUMNS})
+        {_AGGREGATE_PAYROLL}
+        GROUP BY employees.department, payroll.period''',
+]
+
+# Change counters behind the ETags of the read routes: 'tasks' (any task), 'tasks:<user_id>',
+# 'users' and 'calendar' (holidays)
+_BUMP_DATA_VERSION = (
+    'INSERT INTO data_versions (scope, version) VALUES ({scope}, 1) '
+    'ON CONFLICT (scope) DO UPDATE SET version = version + 1'
+)
+
+
+def _bump_data_versions(*scopes):
+    return ' '.join(f'{_BUMP_DATA_VERSION.format(scope=scope)};' for scope in scopes)
+
+
+# Working-day calendar, prefilled for this span and extended on demand by extend_calendar()
+CALENDAR_START = '2020-01-01'
+CALENDAR_END = '2040-12-31'
+# The most days a single extend_calendar() call may add to the calendar
+MAX_CALENDAR_FILL_DAYS = 3660
+
+FILL_CALENDAR = '''
+    WITH RECURSIVE dates(date) AS (
+        SELECT date(?)
+        UNION ALL
+        SELECT date(date, '+1 day')
+        FROM dates
+        WHERE date < date(?)
+    )
+    INSERT OR IGNORE INTO calendar (date, is_weekday)
+    SELECT date, strftime('%w', date) NOT IN ('0', '6')
+    FROM dates
+'''
+
+
+# Schema migrations, applied in order on top of the base tables above. Each step is
+# either a SQL string or a (sql, params) pair. The number of applied migrations is
+# tracked in PRAGMA user_version.
+MIGRATIONS = [
+    # 1: indexes for the hot lookup paths
+    [
+        # tasks by user and day (get_tasks_for_date, get_report, send_report); ending the index
+        # at task_date (then rowid) serves ORDER BY task_date, id without a sort
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_date ON tasks (user_id, task_date)',
+        # tasks by day across all users (get_tasks_for_date / get_tasks_for_period without user_id)
+        'CREATE INDEX IF NOT EXISTS idx_tasks_date ON tasks (task_date)',
+        'CREATE INDEX IF NOT EXISTS idx_payroll_employee_period ON payroll (employee_id, period)',
+        # invitations.email is already covered by its UNIQUE index
+        'CREATE INDEX IF NOT EXISTS idx_invitations_user_id ON invitations (user_id)',
+    ],
+    # 2: per user per day effort rollup, kept in step with tasks by triggers
+    [
+        '''CREATE TABLE IF NOT EXISTS daily_effort (
+            user_id TEXT NOT NULL,
+            task_date DATE NOT NULL,
+            total_minutes INTEGER NOT NULL DEFAULT 0,
+            task_count INTEGER NOT NULL DEFAULT 0,
+            missing_file_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, task_date)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_daily_effort_date ON daily_effort (task_date)',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_tasks_daily_effort_insert AFTER INSERT ON tasks
+        WHEN NEW.task_date IS NOT NULL
+        BEGIN
+            {_ADD_TO_DAILY_EFFORT.format(row='NEW')};
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_tasks_daily_effort_delete AFTER DELETE ON tasks
+        WHEN OLD.task_date IS NOT NULL
+        BEGIN
+            {_SUBTRACT_FROM_DAILY_EFFORT.format(row='OLD')};
+            DELETE FROM daily_effort WHERE user_id = OLD.user_id AND task_date = OLD.task_date AND task_count <= 0;
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_tasks_daily_effort_update
+        AFTER UPDATE OF user_id, task_date, effort_hours, effort_minutes, output_file ON tasks
+        WHEN NEW.task_date IS NOT NULL
+        BEGIN
+            {_SUBTRACT_FROM_DAILY_EFFORT.format(row='OLD')};
+            DELETE FROM daily_effort WHERE user_id = OLD.user_id AND task_date = OLD.task_date AND task_count <= 0;
+            {_ADD_TO_DAILY_EFFORT.format(row='NEW')};
+        END''',
+        # clearing a task's date only takes it out of the rollup
+        f'''CREATE TRIGGER IF NOT EXISTS trg_tasks_daily_effort_clear_date
+        AFTER UPDATE OF task_date ON tasks
+        WHEN NEW.task_date IS NULL
+        BEGIN
+            {_SUBTRACT_FROM_DAILY_EFFORT.format(row='OLD')};
+            DELETE FROM daily_effort WHERE user_id = OLD.user_id AND task_date = OLD.task_date AND task_count <= 0;
+        END''',
+        BACKFILL_DAILY_EFFORT[0],
+        BACKFILL_DAILY_EFFORT[1],
+    ],
+    # 3: calendar of weekdays and company holidays for working-day and missed-date lookups
+    [
+        '''CREATE TABLE IF NOT EXISTS calendar (
+            date DATE PRIMARY KEY,
+            is_weekday INTEGER NOT NULL,
+            is_holiday INTEGER NOT NULL DEFAULT 0,
+            holiday_name TEXT
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_calendar_working_days ON calendar (date) WHERE is_weekday = 1 AND is_holiday = 0',
+        (FILL_CALENDAR, (CALENDAR_START, CALENDAR_END)),
+    ],
+    # 4: outgoing mail, delivered by the mailer thread
+    [
+        '''CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            recipients TEXT NOT NULL,
+            subject TEXT,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            claim_id TEXT,
+            created_at REAL NOT NULL,
+            next_attempt_at REAL,
+            sent_at REAL
+        )''',
+        # due messages (mailer claims) and counts by status (stats)
+        'CREATE INDEX IF NOT EXISTS idx_outbox_status_due ON outbox (status, next_attempt_at)',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_claim ON outbox (claim_id) WHERE claim_id IS NOT NULL',
+    ],
+    # 5: per department per period payroll totals, kept in step with payroll and employees by triggers
+    [
+        '''CREATE TABLE IF NOT EXISTS payroll_department_summary (
+            department TEXT NOT NULL,
+            period TEXT NOT NULL,
+            headcount INTEGER NOT NULL DEFAULT 0,
+            salary REAL NOT NULL DEFAULT 0,
+            bonus REAL NOT NULL DEFAULT 0,
+            deductions REAL NOT NULL DEFAULT 0,
+            tax REAL NOT NULL DEFAULT 0,
+            net_salary REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (department, period)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_payroll_department_summary_period ON payroll_department_summary (period)',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payroll_summary_insert AFTER INSERT ON payroll
+        BEGIN
+            {_ADD_TO_PAYROLL_SUMMARY.format(row='NEW', exclude_id='NEW.id')};
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payroll_summary_delete AFTER DELETE ON payroll
+        BEGIN
+            {_SUBTRACT_FROM_PAYROLL_SUMMARY.format(row='OLD', exclude_id='OLD.id')};
+            {_DELETE_EMPTY_PAYROLL_SUMMARY.format(row='OLD')};
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_payroll_summary_update
+        AFTER UPDATE OF employee_id, period, salary, bonus, deductions, tax, net_salary ON payroll
+        BEGIN
+            {_SUBTRACT_FROM_PAYROLL_SUMMARY.format(row='OLD', exclude_id='NEW.id')};
+            {_DELETE_EMPTY_PAYROLL_SUMMARY.format(row='OLD')};
+            {_ADD_TO_PAYROLL_SUMMARY.format(row='NEW', exclude_id='NEW.id')};
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_employees_payroll_summary_update
+        AFTER UPDATE OF id, department ON employees
+        BEGIN
+            {_RECOMPUTE_PAYROLL_SUMMARY.format(department='OLD.department', employee_id='OLD.id')};
+            {_RECOMPUTE_PAYROLL_SUMMARY.format(department='NEW.department', employee_id='NEW.id')};
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_employees_payroll_summary_delete AFTER DELETE ON employees
+        BEGIN
+            {_RECOMPUTE_PAYROLL_SUMMARY.format(department='OLD.department', employee_id='OLD.id')};
+        END''',
+        BACKFILL_PAYROLL_SUMMARY[0],
+        BACKFILL_PAYROLL_SUMMARY[1],
+    ],
+    # 6: data versions, bumped by triggers on every write that can change a read route's answer
+    [
+        '''CREATE TABLE IF NOT EXISTS data_versions (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_tasks_version_insert AFTER INSERT ON tasks
+        BEGIN
+            {_bump_data_versions("'tasks'", "'tasks:' || NEW.user_id")}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_tasks_version_delete AFTER DELETE ON tasks
+        BEGIN
+            {_bump_data_versions("'tasks'", "'tasks:' || OLD.user_id")}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_tasks_version_update AFTER UPDATE ON tasks
+        BEGIN
+            {_bump_data_versions("'tasks'", "'tasks:' || OLD.user_id", "'tasks:' || NEW.user_id")}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_users_version_insert AFTER INSERT ON users
+        BEGIN
+            {_bump_data_versions("'users'")}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_users_version_delete AFTER DELETE ON users
+        BEGIN
+            {_bump_data_versions("'users'")}
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_users_version_update AFTER UPDATE ON users
+        BEGIN
+            {_bump_data_versions("'users'")}
+        END''',
+        # Extending the calendar never changes an answer (reads extend it first); holidays do
+        f'''CREATE TRIGGER IF NOT EXISTS trg_calendar_version_update AFTER UPDATE OF is_holiday ON calendar
+        WHEN OLD.is_holiday IS NOT NEW.is_holiday
+        BEGIN
+            {_bump_data_versions("'calendar'")}
+        END''',
+    ],
+    # 7: index of archived reports; files are stored once per content hash under REPORT_ARCHIVE_DIR.
+    # report_cache maps a report's inputs to its archive entry and is deleted with it.
+    [
+        '''CREATE TABLE IF NOT EXISTS report_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            from_date TEXT,
+            to_date TEXT,
+            role TEXT,
+            name TEXT NOT NULL,
+            formats TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_sent_at REAL NOT NULL,
+            send_count INTEGER NOT NULL DEFAULT 1,
+            UNIQUE (user_id, content_hash)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS report_archive_files (
+            archive_id INTEGER NOT NULL,
+            format TEXT NOT NULL,
+            blob_hash TEXT NOT NULL,
+            PRIMARY KEY (archive_id, format)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS report_blobs (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            encoding TEXT NOT NULL
+        ) WITHOUT ROWID''',
+        # listing per user and overall (newest first), retention (oldest first), blob references
+        'CREATE INDEX IF NOT EXISTS idx_report_archive_user_sent ON report_archive (user_id, last_sent_at)',
+        'CREATE INDEX IF NOT EXISTS idx_report_archive_sent ON report_archive (last_sent_at)',
+        'CREATE INDEX IF NOT EXISTS idx_report_archive_files_blob ON report_archive_files (blob_hash)',
+        '''CREATE TABLE IF NOT EXISTS report_cache (
+            key TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            archive_id INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        ) WITHOUT ROWID''',
+        # invalidation per user, and the delete when an archive entry goes
+        'CREATE INDEX IF NOT EXISTS idx_report_cache_user ON report_cache (user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_report_cache_archive ON report_cache (archive_id)',
+        '''CREATE TRIGGER IF NOT EXISTS trg_report_archive_cache_delete AFTER DELETE ON report_archive
+        BEGIN
+            DELETE FROM report_cache WHERE archive_id = OLD.id;
+        END''',
+    ],
+    # 8: background jobs (/send_report), shared by every worker process and kept across restarts
+    [
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            request_id TEXT,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            claim_id TEXT,
+            created_at REAL NOT NULL,
+            next_attempt_at REAL,
+            started_at REAL,
+            finished_at REAL
+        ) WITHOUT ROWID''',
+        # due jobs (worker claims) and counts by status, claimed batch, pruning of finished jobs
+        'CREATE INDEX IF NOT EXISTS idx_jobs_status_due ON jobs (status, next_attempt_at)',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (claim_id) WHERE claim_id IS NOT NULL',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at) WHERE finished_at IS NOT NULL',
+    ],
+]
+
+
+def migrate_db(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        for statement in statements:
+            if isinstance(statement, tuple):
+                conn.execute(*statement)
+            else:
+                conn.execute(statement)
+        conn.execute(f'PRAGMA user_version = {number}')
+        conn.commit()
+    if version < len(MIGRATIONS):
+        conn.execute('PRAGMA optimize')
+
+
+# Fail fast when the database has not been migrated (`python db.py migrate`) to this code's
+# schema. Uses its own short-lived connection so nothing is left in the pool of a process that
+# is about to fork workers.
+def check_schema():
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        conn.close()
+    if version < len(MIGRATIONS):
+        raise SchemaError(f'{DB_PATH} is at schema version {version}, this code needs {len(MIGRATIONS)}; run `python db.py migrate`')
+
+
+# Current versions of the given data_versions scopes, in order (0 for a scope never written)
+def get_data_versions(conn, scopes):
+    placeholders = ', '.join('?' for _ in scopes)
+    versions = dict(conn.execute(f'SELECT scope, version FROM data_versions WHERE scope IN ({placeholders})', scopes).fetchall())
+    return tuple(versions.get(scope, 0) for scope in scopes)
+
+
+# Rebuild daily_effort from tasks, e.g. after rows were changed with the triggers missing
+def backfill_daily_effort(conn):
+    for statement in BACKFILL_DAILY_EFFORT:
+        conn.execute(statement)
+    conn.commit()
+    return conn.execute('SELECT COUNT(*) FROM daily_effort').fetchone()[0]
+
+
+def backfill_payroll_summary(conn):
+    for statement in BACKFILL_PAYROLL_SUMMARY:
+        conn.execute(statement)
+    conn.commit()
+    return conn.execute('SELECT COUNT(*) FROM payroll_department_summary').fetchone()[0]
+
+
+_calendar_bounds = None
+
+
+def _parse_calendar_date(value):
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise CalendarRangeError(f'Not a YYYY-MM-DD date: {value!r}') from None
+    # strptime also takes unpadded months and days, which would not compare as strings
+    if day.isoformat() != value:
+        raise CalendarRangeError(f'Not a YYYY-MM-DD date: {value!r}')
+    return day
+
+
+# Make sure the calendar has a row for every day between from_date and to_date. Both must be
+# YYYY-MM-DD dates, and the fill may add at most MAX_CALENDAR_FILL_DAYS days.
+def extend_calendar(conn, from_date, to_date):
+    global _calendar_bounds
+    start, end = _parse_calendar_date(from_date), _parse_calendar_date(to_date)
+    if _calendar_bounds is None:
+        _calendar_bounds = tuple(conn.execute('SELECT MIN(date), MAX(date) FROM calendar').fetchone())
+    low, high = _calendar_bounds
+    if low is not None and low <= from_date and to_date <= high:
+        return
+    # Fill contiguously from the existing span so no gaps are left behind
+    if low is None:
+        added = (end - start).days + 1
+    else:
+        added = max((date.fromisoformat(low) - start).days, 0) + max((end - date.fromisoformat(high)).days, 0)
+    if added > MAX_CALENDAR_FILL_DAYS:
+        raise CalendarRangeError(f'{from_date} to {to_date} would add {added} days to the calendar; '
+                                 f'the limit is {MAX_CALENDAR_FILL_DAYS}')
+    low = min(low or from_date, from_date)
+    high = max(high or to_date, to_date)
+    conn.execute(FILL_CALENDAR, (low, high))
+    conn.commit()
+    _calendar_bounds = (low, high)
+
+
+# Replace the company holidays with the ones in a JSON file of {"YYYY-MM-DD": "Holiday name"}
+def load_holidays(conn, path):
+    with open(path, 'r') as f:
+        holidays = json.load(f)
+    if holidays:
+        extend_calendar(conn, min(holidays), max(holidays))
+    conn.execute('UPDATE calendar SET is_holiday = 0, holiday_name = NULL WHERE is_holiday = 1')
+    conn.executemany('UPDATE calendar SET is_holiday = 1, holiday_name = ? WHERE date = ?',
+                     [(name, day) for day, name in holidays.items()])
+    conn.commit()
+    return len(holidays)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='TED database maintenance')
+    parser.add_argument('command', choices=['migrate', 'backfill-daily-effort', 'backfill-payroll-summary', 'load-holidays'])
+    parser.add_argument('path', nargs='?', default=HOLIDAYS_FILE, help='holidays JSON file for load-holidays')
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == 'backfill-daily-effort':
+        with get_db() as conn:
+            print(f'daily_effort rebuilt: {backfill_daily_effort(conn)} rows')
+    elif args.command == 'backfill-payroll-summary':
+        with get_db() as conn:
+            print(f'payroll_department_summary rebuilt: {backfill_payroll_summary(conn)} rows')
+    elif args.command == 'load-holidays':
+        with get_db() as conn:
+            print(f'{load_holidays(conn, args.path)} holidays loaded from {args.path}')
+    else:
+        print(f'{DB_PATH} is at schema version {len(MIGRATIONS)}')
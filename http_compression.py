@@ -0,0 +1,58 @@
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional; responses are gzip-only without it
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/plain', 'text/csv')
+BROTLI_QUALITY = 5  # close to gzip -6 in speed, noticeably smaller output
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+def _gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _brotli_stream(chunks):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+# Compress a Flask response in place with the best encoding the client accepts (br, then gzip).
+# Buffered bodies below min_bytes are left alone; streamed bodies are compressed chunk by chunk.
+def compress_response(response, accept_encodings, min_bytes, level):
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accept_encodings.best_match(available_encodings())
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        chunks = response.iter_encoded()
+        response.response = _brotli_stream(chunks) if encoding == 'br' else _gzip_stream(chunks, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_bytes:
+            return response
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY) if encoding == 'br' else gzip.compress(data, level))
+    response.headers['Content-Encoding'] = encoding
+    return response
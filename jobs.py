@@ -0,0 +1,191 @@
+import json
+import logging
+import threading
+import time
+import uuid
+
+from db import get_db
+from logging_setup import request_id_var
+from metrics import JOB_QUEUE_SECONDS, JOB_SECONDS
+
+log = logging.getLogger(__name__)
+
+
+JOB_COLUMNS = ('id', 'kind', 'payload', 'request_id', 'status', 'attempts', 'result', 'error', 'created_at',
+               'started_at', 'finished_at')
+
+
+class Job:
+    def __init__(self, id, kind, payload, request_id, status, attempts, result, error, created_at, started_at, finished_at):
+        self.id = id
+        self.kind = kind
+        self.payload = json.loads(payload)
+        self.request_id = request_id
+        self.status = status
+        self.attempts = attempts
+        self.result = json.loads(result) if result is not None else None
+        self.error = error
+        self.created_at = created_at
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.claim_id = None  # set on the copy a worker claimed
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+# Runs jobs stored in the jobs table, so every worker process sees every job's status and queued
+# jobs survive a restart. Each process runs `workers` threads that claim due jobs one at a time.
+# Handlers are registered per kind and called as handler(job, **payload), where payload is the
+# JSON-serializable keyword arguments given to submit(). A job that raises is failed; a job whose
+# process died while running it is claimed again after claim_timeout, up to max_attempts runs.
+class JobQueue:
+    def __init__(self, workers, retention_seconds=3600, name='job', poll_interval=1.0, claim_timeout=600,
+                 max_attempts=3):
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self.name = name
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+        self._handlers = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    @property
+    def started(self):
+        return bool(self._threads)
+
+    # Safe to call more than once; only the first call starts the worker threads
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'{self.name}-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    # Queue a job; returns its id. The submitting request's id is kept for the job's log lines.
+    def submit(self, kind, **payload):
+        if kind not in self._handlers:
+            raise ValueError(f'No handler registered for {kind} jobs')
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with get_db() as conn:
+            conn.execute(
+                '''INSERT INTO jobs (id, kind, payload, request_id, status, created_at, next_attempt_at)
+                VALUES (?, ?, ?, ?, 'queued', ?, ?)''',
+                (job_id, kind, json.dumps(payload), request_id_var.get(), now, now))
+            conn.commit()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        with get_db() as conn:
+            row = conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(*row) if row else None
+
+    def pending(self):
+        with get_db() as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                job = self._claim()
+            except Exception:
+                log.exception('Claiming a job failed')
+                job = None
+            if job is not None:
+                self._execute(job)
+                continue
+            if time.monotonic() - self._last_prune > 60:
+                self._last_prune = time.monotonic()
+                try:
+                    self._prune()
+                except Exception:
+                    log.exception('Pruning finished jobs failed')
+            self._wake.wait(self.poll_interval)
+
+    # Claim the next due job, or return None. A running job stays claimed for claim_timeout;
+    # after that its process is assumed dead and the job is run again, or failed once it has
+    # used up max_attempts.
+    def _claim(self):
+        now = time.time()
+        claim_id = str(uuid.uuid4())
+        with get_db() as conn:
+            conn.execute(
+                '''UPDATE jobs SET status = 'failed', error = 'Worker stopped before the job finished',
+                    claim_id = NULL, next_attempt_at = NULL, finished_at = ?
+                WHERE status = 'running' AND next_attempt_at <= ? AND attempts >= ?''',
+                (now, now, self.max_attempts))
+            conn.execute(
+                '''UPDATE jobs SET status = 'running', claim_id = ?, attempts = attempts + 1, started_at = ?,
+                    next_attempt_at = ?
+                WHERE id = (
+                    SELECT id FROM jobs WHERE status IN ('queued', 'running') AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at LIMIT 1
+                )''',
+                (claim_id, now, now + self.claim_timeout, now))
+            conn.commit()
+            row = conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE claim_id = ?", (claim_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job(*row)
+        job.claim_id = claim_id
+        return job
+
+    def _execute(self, job):
+        # Log with the id of the request that queued the job
+        token = request_id_var.set(job.request_id or '-')
+        try:
+            try:
+                result = self._handlers[job.kind](job, **job.payload)
+                status, error = 'succeeded', None
+            except Exception as e:
+                log.exception('Job failed', extra={'job_id': job.id, 'kind': job.kind})
+                status, result, error = 'failed', None, str(e)
+            finished_at = time.time()
+            with get_db() as conn:
+                conn.execute(
+                    '''UPDATE jobs SET status = ?, result = ?, error = ?, claim_id = NULL, next_attempt_at = NULL,
+                        finished_at = ?
+                    WHERE id = ? AND claim_id = ?''',
+                    (status, json.dumps(result) if result is not None else None, error, finished_at, job.id, job.claim_id))
+                conn.commit()
+            JOB_QUEUE_SECONDS.observe(job.started_at - job.created_at, job.kind)
+            JOB_SECONDS.observe(finished_at - job.started_at, job.kind, status)
+        finally:
+            request_id_var.reset(token)
+
+    def _prune(self):
+        with get_db() as conn:
+            conn.execute('DELETE FROM jobs WHERE finished_at < ?', (time.time() - self.retention_seconds,))
+            conn.commit()
@@ -0,0 +1,156 @@
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Correlation id of the request being handled; JobQueue copies it into the report jobs it runs
+request_id_var = contextvars.ContextVar('request_id', default='-')
+
+REQUEST_ID_RE = re.compile(r'^[\w.-]{1,64}$')
+
+# Attributes every LogRecord has; anything else was passed through extra= and is logged as a field
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id', 'sample_rate'}
+
+
+# Use the caller's X-Request-ID when it looks sane, otherwise make one up
+def new_request_id(incoming=None):
+    if incoming and REQUEST_ID_RE.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+# One JSON object per line: time, level, logger, request id, message, extra fields, exception
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': record.request_id,
+            'message': record.getMessage()
+        }
+        if record.sample_rate < 1:
+            entry['sample_rate'] = record.sample_rate  # each line stands for 1/sample_rate events
+        entry.update(_fields(record))
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+# Human-readable variant for running locally
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = ' '.join(f'{key}={value}' for key, value in _fields(record).items())
+        line = f'{self.formatTime(record)} {record.levelname:<7} [{record.request_id}] {record.name}: {record.getMessage()}'
+        line = f'{line} {fields}' if fields else line
+        return f'{line}\n{record.exc_text}' if record.exc_text else line
+
+
+# Runs in the calling thread: stamps the request id and drops sampled-out records before they
+# are queued. Pass extra={'sample_rate': r} to keep only a fraction r of a high-volume message;
+# warnings and errors are never sampled.
+class RequestContextFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        sample_rate = getattr(record, 'sample_rate', 1.0)
+        record.sample_rate = sample_rate
+        return sample_rate >= 1 or record.levelno >= logging.WARNING or random.random() < sample_rate
+
+
+# Hands records to the writer thread without blocking; when the queue is full they are dropped
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Format the message and traceback here, where the arguments and exc_info are still
+        # valid; the writer thread only sees plain values
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# The writer thread, named so it can be told apart from the app's other background threads
+class LogWriter(QueueListener):
+    def start(self):
+        super().start()
+        self._thread.name = 'log-writer'
+
+
+_handler = None
+_writer = None
+_writer_started = False
+_writer_lock = threading.Lock()
+
+
+# Route the root logger through a bounded queue to a background thread that writes to stdout.
+# The thread is started by start_log_writer(); until then records wait in the queue.
+def configure_logging(level='INFO', fmt='json', queue_size=10000, stream=None):
+    global _handler, _writer
+    if _handler is not None:
+        return _handler
+    stream_handler = logging.StreamHandler(stream or sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    _handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    _handler.addFilter(RequestContextFilter())
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    root.addHandler(_handler)
+    _writer = LogWriter(_handler.queue, stream_handler, respect_handler_level=True)
+    atexit.register(_flush_log_queue)
+    return _handler
+
+
+# Safe to call more than once; only the first call starts the writer thread. The app calls it
+# from its first request rather than at import, so a server that forks workers after loading
+# the app gets a writer in each worker instead of one left behind in the parent.
+def start_log_writer():
+    global _writer_started
+    with _writer_lock:
+        if _writer is None or _writer_started:
+            return
+        _writer.start()
+        _writer_started = True
+
+
+# On shutdown, stop the writer thread, which writes what is still queued; a process that never
+# started it (a script importing the app) writes the queued records itself
+def _flush_log_queue():
+    if _writer_started:
+        _writer.stop()
+        return
+    while True:
+        try:
+            record = _writer.queue.get_nowait()
+        except queue.Empty:
+            return
+        _writer.handle(record)
+
+
+def logging_stats():
+    if _handler is None:
+        return {'queued': 0, 'dropped': 0}
+    return {'queued': _handler.queue.qsize(), 'dropped': _handler.dropped}
@@ -0,0 +1,224 @@
+import logging
+import smtplib
+import threading
+import time
+import uuid
+
+from db import get_db
+from metrics import REPORT_STAGE_SECONDS
+
+log = logging.getLogger(__name__)
+
+
+def is_transient_smtp_error(error):
+    # 4xx replies, dropped connections and network errors are worth another attempt;
+    # 5xx replies (bad credentials, rejected recipients) are not
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):  # SMTPException subclasses OSError
+        return False
+    return isinstance(error, OSError)
+
+
+# Delivers mail queued in the outbox table. Callers add messages with enqueue() inside their
+# own transaction and call wake() after committing; one delivery thread per process claims due
+# messages in batches and sends them over a single authenticated SMTP session, which is kept
+# open between batches until it has been idle for idle_timeout seconds.
+class Mailer:
+    def __init__(self, server, port, username, password, starttls=True, timeout=30, batch_size=50,
+                 max_attempts=5, retry_backoff=30, poll_interval=5, idle_timeout=60,
+                 max_messages_per_session=100, claim_timeout=600):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.max_messages_per_session = max_messages_per_session
+        self.claim_timeout = claim_timeout
+        self._smtp = None
+        self._smtp_sent = 0
+        self._smtp_last_used = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._connections_opened = 0
+        self._sent = 0
+        self._retried = 0
+        self._failed = 0
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    # Safe to call more than once; only the first call starts the delivery thread
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='mailer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._close_session()
+
+    def wake(self):
+        self._wake.set()
+
+    # Add a message to the outbox; it is sent once the caller's transaction commits
+    def enqueue(self, conn, kind, msg):
+        now = time.time()
+        cursor = conn.execute(
+            '''INSERT INTO outbox (kind, sender, recipients, subject, message, status, attempts, created_at, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?, 'queued', 0, ?, ?)''',
+            (kind, msg['From'], msg['To'], msg['Subject'], msg.as_string(), now, now))
+        return cursor.lastrowid
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                delivered = self.deliver_due()
+            except Exception:
+                log.exception('Outbox delivery failed')
+                delivered = 0
+            if delivered < self.batch_size:
+                # Outbox drained; hang up if the session has been idle too long, then wait for more mail
+                if self._smtp is not None and time.monotonic() - self._smtp_last_used > self.idle_timeout:
+                    self._close_session()
+                self._wake.wait(self.poll_interval)
+        self._close_session()
+
+    # Claim and send one batch of due messages; returns how many were claimed
+    def deliver_due(self):
+        batch = self._claim()
+        for index, (message_id, sender, recipients, message, attempts) in enumerate(batch):
+            try:
+                session = self._session()
+            except Exception as e:
+                # Connection and login failures say nothing about the messages themselves,
+                # so the rest of the batch is retried later like a 4xx reply
+                for row in batch[index:]:
+                    self._record_failure(row[0], row[4] + 1, e, transient=True)
+                break
+            try:
+                with REPORT_STAGE_SECONDS.time('smtp'):
+                    session.sendmail(sender, recipients.split(','), message)
+            except Exception as e:
+                if not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                    # The connection is in an unknown state; the next message reconnects
+                    self._close_session()
+                self._record_failure(message_id, attempts + 1, e, transient=is_transient_smtp_error(e))
+            else:
+                self._smtp_sent += 1
+                self._smtp_last_used = time.monotonic()
+                self._record_sent(message_id, attempts + 1)
+        return len(batch)
+
+    def _claim(self):
+        # A claimed message becomes due again after claim_timeout, so mail claimed by a
+        # worker process that died mid-batch is picked up by another one
+        now = time.time()
+        claim_id = str(uuid.uuid4())
+        with get_db() as conn:
+            conn.execute(
+                '''UPDATE outbox SET status = 'sending', claim_id = ?, next_attempt_at = ?
+                WHERE id IN (
+                    SELECT id FROM outbox WHERE status IN ('queued', 'sending') AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at LIMIT ?
+                )''',
+                (claim_id, now + self.claim_timeout, now, self.batch_size))
+            conn.commit()
+            return conn.execute(
+                'SELECT id, sender, recipients, message, attempts FROM outbox WHERE claim_id = ? ORDER BY id',
+                (claim_id,)).fetchall()
+
+    def _session(self):
+        if self._smtp is not None and (
+                self._smtp_sent >= self.max_messages_per_session
+                or time.monotonic() - self._smtp_last_used > self.idle_timeout):
+            self._close_session()
+        if self._smtp is None:
+            log.info('Connecting to SMTP server', extra={'server': self.server, 'port': self.port})
+            smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+            try:
+                smtp.ehlo()
+                if self.starttls:
+                    smtp.starttls()
+                    smtp.ehlo()
+                if self.username and self.password:
+                    smtp.login(self.username, self.password)
+            except Exception:
+                smtp.close()
+                raise
+            self._smtp = smtp
+            self._smtp_sent = 0
+            self._smtp_last_used = time.monotonic()
+            with self._lock:
+                self._connections_opened += 1
+        return self._smtp
+
+    def _close_session(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def _record_sent(self, message_id, attempts):
+        with get_db() as conn:
+            # The body is only needed until it has been delivered
+            conn.execute(
+                "UPDATE outbox SET status = 'sent', attempts = ?, sent_at = ?, next_attempt_at = NULL, last_error = NULL, message = '', claim_id = NULL WHERE id = ?",
+                (attempts, time.time(), message_id))
+            conn.commit()
+        with self._lock:
+            self._sent += 1
+
+    def _record_failure(self, message_id, attempts, error, transient):
+        if transient and attempts < self.max_attempts:
+            log.warning('Delivery failed with a transient error, retrying', extra={'message_id': message_id, 'attempts': attempts, 'error': str(error)})
+            status = 'queued'
+            next_attempt_at = time.time() + self.retry_backoff * 2 ** (attempts - 1)
+            with self._lock:
+                self._retried += 1
+        else:
+            log.error('Delivery failed', extra={'message_id': message_id, 'attempts': attempts, 'error': str(error)})
+            status = 'failed'
+            next_attempt_at = None
+            with self._lock:
+                self._failed += 1
+        with get_db() as conn:
+            conn.execute(
+                'UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, claim_id = NULL WHERE id = ?',
+                (status, attempts, next_attempt_at, str(error), message_id))
+            conn.commit()
+
+    def stats(self):
+        with get_db() as conn:
+            by_status = dict(conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+        with self._lock:
+            return {
+                'queued': by_status.get('queued', 0),
+                'sending': by_status.get('sending', 0),
+                'sent': by_status.get('sent', 0),
+                'failed': by_status.get('failed', 0),
+                'connections_opened': self._connections_opened,
+                'delivered': self._sent,
+                'retried': self._retried,
+                'delivery_failures': self._failed
+            }
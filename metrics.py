@@ -0,0 +1,134 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a cached lookup up to a slow PDF render
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labelvalues, (list(counts), total, count)) for labelvalues, (counts, total, count) in self._series.items())
+        for labelvalues, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == '+Inf' else f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labelvalues)} {count}')
+        return lines
+
+
+# Metrics plus callbacks that report point-in-time gauges (queue depths, cache sizes) at scrape time
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._gauge_callbacks = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    # callback() returns {gauge name: value} or {gauge name: {label value: value}} (one label, named label)
+    def register_gauges(self, documentation, callback, label=None):
+        self._gauge_callbacks.append((documentation, callback, label))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for documentation, callback, label in self._gauge_callbacks:
+            for name, value in callback().items():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} gauge')
+                if isinstance(value, dict):
+                    for labelvalue, item in sorted(value.items()):
+                        lines.append(f'{name}{_format_labels((label,), (labelvalue,))} {_format_value(item)}')
+                else:
+                    lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter('ted_http_requests_total', 'HTTP requests by route, method and status.', ('route', 'method', 'status'))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram('ted_http_request_duration_seconds', 'Time spent handling a request, until the response is returned.', ('route', 'method'))
+SQL_STATEMENT_SECONDS = REGISTRY.histogram('ted_sql_statement_duration_seconds', 'Time spent in execute()/executemany() per SQL statement.', ('statement',))
+SQL_FETCH_SECONDS = REGISTRY.counter('ted_sql_fetch_seconds_total', 'Time spent in fetchone/fetchmany/fetchall per SQL statement.', ('statement',))
+SQL_ROWS = REGISTRY.counter('ted_sql_rows_returned_total', 'Rows returned per SQL statement.', ('statement',))
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram('ted_db_pool_wait_seconds', 'Time spent waiting for a pooled SQLite connection.')
+REPORT_STAGE_SECONDS = REGISTRY.histogram('ted_report_stage_seconds', 'Report pipeline stage timings (aggregate, html, pdf, xlsx, smtp).', ('stage',))
+JOB_QUEUE_SECONDS = REGISTRY.histogram('ted_job_queue_wait_seconds', 'Time a background job waited for a worker.', ('kind',))
+JOB_SECONDS = REGISTRY.histogram('ted_job_duration_seconds', 'Background job run time by outcome.', ('kind', 'status'))
@@ -0,0 +1,82 @@
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PdfRenderError(Exception):
+    pass
+
+
+# Converts HTML to PDF with wkhtmltopdf on a bounded pool of render workers.
+# wkhtmltopdf has no long-running server mode, so each render is still one process,
+# but at most `workers` of them run at once and the HTML is piped in over stdin.
+class PdfRenderer:
+    def __init__(self, wkhtmltopdf_path, workers, timeout):
+        self.wkhtmltopdf_path = wkhtmltopdf_path
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pdf-render')
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._rendered = 0
+        self._failed = 0
+        self._timed_out = 0
+        self._render_seconds = 0.0
+
+    def render(self, html):
+        with self._lock:
+            self._queued += 1
+        future = self._executor.submit(self._render, html)
+        return future.result()
+
+    def _render(self, html):
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+        started = time.perf_counter()
+        try:
+            result = subprocess.run(
+                [self.wkhtmltopdf_path, '--quiet', '--encoding', 'UTF-8', '-', '-'],
+                input=html.encode('utf-8'),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=self.timeout,
+            )
+        except subprocess.TimeoutExpired:
+            with self._lock:
+                self._timed_out += 1
+                self._failed += 1
+            raise PdfRenderError(f'wkhtmltopdf timed out after {self.timeout}s')
+        except OSError as e:
+            with self._lock:
+                self._failed += 1
+            raise PdfRenderError(f'Could not run wkhtmltopdf at {self.wkhtmltopdf_path}: {e}')
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._render_seconds += time.perf_counter() - started
+
+        if result.returncode != 0 or not result.stdout:
+            with self._lock:
+                self._failed += 1
+            raise PdfRenderError(f'wkhtmltopdf exited with {result.returncode}: {result.stderr.decode(errors="replace").strip()}')
+        with self._lock:
+            self._rendered += 1
+        return result.stdout
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self._queued,
+                'active': self._active,
+                'rendered': self._rendered,
+                'failed': self._failed,
+                'timed_out': self._timed_out,
+                'render_seconds_total': self._render_seconds
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,138 @@
+import io
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+PROFILE_SUFFIX = '.prof'
+PROFILE_NAME_RE = re.compile(r'^(?P<route>[\w.-]+?)-(?P<stamp>\d{8}T\d{6}\d{6})-(?P<status>\w+)-(?P<ms>\d+)ms\.prof$')
+
+
+# Route pattern as a file name part: '/get_report' -> 'get_report', '/outbox/<int:message_id>' -> 'outbox_message_id'
+def route_slug(route):
+    slug = re.sub(r'<(?:[^:>]*:)?([^>]*)>', r'\1', route)
+    return re.sub(r'[^\w.]+', '_', slug).strip('_') or 'root'
+
+
+# Opt-in cProfile capture for single requests or background jobs. A call is profiled when the
+# client sends the profile header (and the token, if one is configured) or when it falls into
+# the sample_rate. Each capture is written as <route>-<timestamp>-<status>-<ms>ms.prof, which
+# pstats, snakeviz and flameprof read directly. Only the newest max_files captures are kept.
+class RequestProfiler:
+    def __init__(self, directory, enabled=False, sample_rate=0.0, token='', max_files=100):
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.token = token
+        self.max_files = max_files
+        self.captured = 0
+        self.skipped = 0  # wanted a profile but another one was already running
+        self._lock = threading.Lock()
+
+    def wanted(self, header_value):
+        if not self.enabled:
+            return False
+        if header_value:
+            return not self.token or header_value == self.token
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    # Returns a running profiler, or None when one cannot be started (Python 3.12+ allows
+    # only one active profiler per process)
+    def start(self):
+        import cProfile  # imported on first use; most processes never profile anything
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            with self._lock:
+                self.skipped += 1
+            return None
+        return profile
+
+    def stop(self, profile, route, status, elapsed):
+        profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        name = f'{route_slug(route)}-{stamp}-{status}-{int(elapsed * 1000)}ms{PROFILE_SUFFIX}'
+        profile.dump_stats(os.path.join(self.directory, name))
+        with self._lock:
+            self.captured += 1
+            self._prune()
+        return name
+
+    # Wrap a function so the call is profiled in whichever thread runs it (cProfile only sees
+    # the thread it was enabled in, so work handed to a job queue needs its own capture)
+    def wrap(self, func, route):
+        def profiled(*args, **kwargs):
+            profile = self.start()
+            if profile is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            status = 'error'
+            try:
+                result = func(*args, **kwargs)
+                status = 'ok'
+                return result
+            finally:
+                self.stop(profile, route, status, time.perf_counter() - started)
+        return profiled
+
+    def list(self):
+        profiles = []
+        if not os.path.isdir(self.directory):
+            return profiles
+        for entry in os.scandir(self.directory):
+            match = PROFILE_NAME_RE.match(entry.name)
+            if not match:
+                continue
+            profiles.append({
+                'name': entry.name,
+                'route': match.group('route'),
+                'created_at': datetime.strptime(match.group('stamp'), '%Y%m%dT%H%M%S%f').isoformat(),
+                'status': match.group('status'),
+                'duration_ms': int(match.group('ms')),
+                'size_bytes': entry.stat().st_size
+            })
+        profiles.sort(key=lambda profile: profile['created_at'], reverse=True)
+        return profiles
+
+    # Path of a capture by name, or None if there is no such file
+    def path(self, name):
+        if not PROFILE_NAME_RE.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    # Top functions of a capture as pstats text
+    def summary(self, name, sort='cumulative', limit=40):
+        path = self.path(name)
+        if path is None:
+            return None
+        import pstats
+
+        out = io.StringIO()
+        stats = pstats.Stats(path, stream=out)
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sample_rate': self.sample_rate,
+                'directory': self.directory,
+                'captured': self.captured,
+                'skipped': self.skipped
+            }
+
+    def _prune(self):
+        # Names start with the route, so order by the timestamp part, oldest first
+        matches = sorted(filter(None, map(PROFILE_NAME_RE.match, os.listdir(self.directory))), key=lambda match: match.group('stamp'))
+        for name in [match.string for match in matches[:max(0, len(matches) - self.max_files)]]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
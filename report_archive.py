@@ -0,0 +1,345 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from db import get_db
+
+# A gzipped copy is kept only when it saves at least this much; PDF and XLSX are already compressed
+MIN_GZIP_SAVING = 0.1
+
+# Paging for list()
+ARCHIVE_PAGE_SIZE = 50
+MAX_ARCHIVE_PAGE_SIZE = 500
+
+ARCHIVE_COLUMNS = ('id', 'user_id', 'from_date', 'to_date', 'role', 'name', 'formats', 'size_bytes', 'content_hash',
+                   'created_at', 'last_sent_at', 'send_count')
+
+# Files written by send_report before the archive existed: reports/<user_id>/report_<user_id>_<date info>.<format>
+LEGACY_NAME_RE = re.compile(r'^(?P<name>report_.+?_(?:from_(?P<from>\d{4}-\d{2}-\d{2})_to_(?P<to>\d{4}-\d{2}-\d{2})'
+                            r'|on_(?P<on>\d{4}-\d{2}-\d{2})))\.(?P<format>html|pdf|xlsx)$')
+
+
+def archive_to_dict(row):
+    entry = dict(zip(ARCHIVE_COLUMNS, row))
+    entry['formats'] = entry['formats'].split(',')
+    return entry
+
+
+# Archive of sent reports. Each format's bytes are stored once per content hash as
+# <directory>/<hash[:2]>/<hash>[.gz], gzipped when that is worth it, and indexed in the
+# report_archive, report_archive_files and report_blobs tables, so listing and retention never
+# walk the directory. Re-sending an identical report only bumps last_sent_at and send_count.
+# Entries older than retention_days go first, then the least recently sent while the stored
+# size is over max_bytes (0 disables either limit).
+class ReportArchive:
+    def __init__(self, directory, max_bytes=0, retention_days=0, compress_level=6):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.retention_days = retention_days
+        self.compress_level = compress_level
+        self.stored = 0
+        self.deduplicated = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def _blob_path(self, blob_hash, encoding):
+        suffix = '.gz' if encoding == 'gzip' else ''
+        return os.path.join(self.directory, blob_hash[:2], blob_hash + suffix)
+
+    # Returns (encoding, stored size)
+    def _write_blob(self, blob_hash, data):
+        compressed = gzip.compress(data, self.compress_level, mtime=0)
+        if len(compressed) <= len(data) * (1 - MIN_GZIP_SAVING):
+            encoding, stored = 'gzip', compressed
+        else:
+            encoding, stored = 'identity', data
+        path = self._blob_path(blob_hash, encoding)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name first so readers never see a partial file
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(stored)
+        os.replace(tmp_path, path)
+        return encoding, len(stored)
+
+    # Record a sent report ({format: bytes}); returns its archive id. With enforce_limits off the
+    # retention and size limits are left for a later enforce_limits() call.
+    def put(self, user_id, from_date, to_date, role, name, buffers, sent_at=None, enforce_limits=True):
+        sent_at = sent_at or time.time()
+        blob_hashes = {fmt: hashlib.sha256(data).hexdigest() for fmt, data in sorted(buffers.items())}
+        content_hash = hashlib.sha256(json.dumps(blob_hashes).encode()).hexdigest()
+        with get_db() as conn:
+            # Blob files are written and deleted only while holding the write lock, so eviction in
+            # another worker cannot remove a blob between our lookup and our insert
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT id FROM report_archive WHERE user_id = ? AND content_hash = ?',
+                                   (user_id, content_hash)).fetchone()
+                if row:
+                    archive_id = row[0]
+                    conn.execute('''
+                        UPDATE report_archive SET last_sent_at = MAX(last_sent_at, ?), send_count = send_count + 1
+                        WHERE id = ?
+                    ''', (sent_at, archive_id))
+                else:
+                    archive_id = self._insert(conn, user_id, from_date, to_date, role, name, buffers, blob_hashes,
+                                              content_hash, sent_at)
+                evicted = self._enforce_limits(conn, archive_id) if enforce_limits else 0
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        with self._lock:
+            if row:
+                self.deduplicated += 1
+            else:
+                self.stored += 1
+            self.evicted += evicted
+        return archive_id
+
+    def _insert(self, conn, user_id, from_date, to_date, role, name, buffers, blob_hashes, content_hash, sent_at):
+        known = {row[0] for row in conn.execute(
+            'SELECT hash FROM report_blobs WHERE hash IN (SELECT value FROM json_each(?))',
+            (json.dumps(list(blob_hashes.values())),))}
+        for fmt, blob_hash in blob_hashes.items():
+            if blob_hash in known:
+                continue
+            encoding, stored_size = self._write_blob(blob_hash, buffers[fmt])
+            conn.execute('INSERT INTO report_blobs (hash, size, stored_size, encoding) VALUES (?, ?, ?, ?)',
+                         (blob_hash, len(buffers[fmt]), stored_size, encoding))
+            known.add(blob_hash)
+        cursor = conn.execute('''
+            INSERT INTO report_archive (user_id, from_date, to_date, role, name, formats, size_bytes, content_hash,
+                                        created_at, last_sent_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, from_date, to_date, role, name, ','.join(blob_hashes), sum(len(data) for data in buffers.values()),
+              content_hash, sent_at, sent_at))
+        conn.executemany('INSERT INTO report_archive_files (archive_id, format, blob_hash) VALUES (?, ?, ?)',
+                         [(cursor.lastrowid, fmt, blob_hash) for fmt, blob_hash in blob_hashes.items()])
+        return cursor.lastrowid
+
+    # Apply retention_days and max_bytes now; returns the number of entries removed
+    def enforce_limits(self):
+        with get_db() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                evicted = self._enforce_limits(conn)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        with self._lock:
+            self.evicted += evicted
+        return evicted
+
+    # Apply retention_days and max_bytes, never evicting keep_id (the report just sent, 0 for none); returns entries removed
+    def _enforce_limits(self, conn, keep_id=0):
+        removed = 0
+        if self.retention_days:
+            cutoff = time.time() - self.retention_days * 86400
+            expired = [row[0] for row in conn.execute(
+                'SELECT id FROM report_archive WHERE last_sent_at < ? AND id != ?', (cutoff, keep_id))]
+            self._delete(conn, expired)
+            removed += len(expired)
+        if self.max_bytes:
+            total = conn.execute('SELECT COALESCE(SUM(stored_size), 0) FROM report_blobs').fetchone()[0]
+            while total > self.max_bytes:
+                oldest = conn.execute(
+                    'SELECT id FROM report_archive WHERE id != ? ORDER BY last_sent_at LIMIT 1', (keep_id,)).fetchone()
+                if oldest is None:
+                    break
+                total -= self._delete(conn, [oldest[0]])
+                removed += 1
+        return removed
+
+    # Drop archive entries and any blobs no other entry uses; returns the stored bytes freed
+    def _delete(self, conn, archive_ids):
+        if not archive_ids:
+            return 0
+        ids = json.dumps(archive_ids)
+        candidates = [row[0] for row in conn.execute(
+            'SELECT DISTINCT blob_hash FROM report_archive_files WHERE archive_id IN (SELECT value FROM json_each(?))', (ids,))]
+        conn.execute('DELETE FROM report_archive_files WHERE archive_id IN (SELECT value FROM json_each(?))', (ids,))
+        conn.execute('DELETE FROM report_archive WHERE id IN (SELECT value FROM json_each(?))', (ids,))
+        freed = 0
+        for blob_hash in candidates:
+            if conn.execute('SELECT 1 FROM report_archive_files WHERE blob_hash = ? LIMIT 1', (blob_hash,)).fetchone():
+                continue
+            stored_size, encoding = conn.execute(
+                'SELECT stored_size, encoding FROM report_blobs WHERE hash = ?', (blob_hash,)).fetchone()
+            conn.execute('DELETE FROM report_blobs WHERE hash = ?', (blob_hash,))
+            try:
+                os.remove(self._blob_path(blob_hash, encoding))
+            except FileNotFoundError:
+                pass
+            freed += stored_size
+        return freed
+
+    # Archive entries, most recently sent first. Filters: user_id, and a date range the report
+    # overlaps. after is the (last_sent_at, id) of the previous page's last entry.
+    def list(self, user_id=None, from_date=None, to_date=None, limit=ARCHIVE_PAGE_SIZE, after=None):
+        query = f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM report_archive WHERE 1 = 1"
+        params = []
+        if user_id:
+            query += ' AND user_id = ?'
+            params.append(user_id)
+        if from_date:
+            query += ' AND to_date >= ?'
+            params.append(from_date)
+        if to_date:
+            query += ' AND from_date <= ?'
+            params.append(to_date)
+        if after:
+            query += ' AND (last_sent_at, id) < (?, ?)'
+            params.extend(after)
+        query += ' ORDER BY last_sent_at DESC, id DESC LIMIT ?'
+        params.append(limit)
+        with get_db() as conn:
+            return [archive_to_dict(row) for row in conn.execute(query, params)]
+
+    # One archive entry with its files, or None
+    def entry(self, archive_id):
+        with get_db() as conn:
+            row = conn.execute(f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM report_archive WHERE id = ?",
+                               (archive_id,)).fetchone()
+            if row is None:
+                return None
+            files = conn.execute('''
+                SELECT f.format, b.size, b.stored_size, b.encoding
+                FROM report_archive_files f JOIN report_blobs b ON b.hash = f.blob_hash
+                WHERE f.archive_id = ?
+            ''', (archive_id,)).fetchall()
+        entry = archive_to_dict(row)
+        entry['files'] = {fmt: {'size_bytes': size, 'stored_bytes': stored_size, 'encoding': encoding}
+                          for fmt, size, stored_size, encoding in files}
+        return entry
+
+    # Returns (name, bytes) of one format of an archived report, or None
+    def get(self, archive_id, fmt):
+        with get_db() as conn:
+            row = conn.execute('''
+                SELECT a.name, b.hash, b.encoding
+                FROM report_archive a
+                JOIN report_archive_files f ON f.archive_id = a.id
+                JOIN report_blobs b ON b.hash = f.blob_hash
+                WHERE a.id = ? AND f.format = ?
+            ''', (archive_id, fmt)).fetchone()
+        if row is None:
+            return None
+        name, blob_hash, encoding = row
+        data = self._read_blob(blob_hash, encoding)
+        return (name, data) if data is not None else None
+
+    # Returns {format: bytes} of every format of an archived report, or None
+    def buffers(self, archive_id):
+        with get_db() as conn:
+            rows = conn.execute('''
+                SELECT f.format, b.hash, b.encoding
+                FROM report_archive_files f JOIN report_blobs b ON b.hash = f.blob_hash
+                WHERE f.archive_id = ?
+            ''', (archive_id,)).fetchall()
+        if not rows:
+            return None
+        buffers = {}
+        for fmt, blob_hash, encoding in rows:
+            buffers[fmt] = self._read_blob(blob_hash, encoding)
+            if buffers[fmt] is None:
+                return None
+        return buffers
+
+    def _read_blob(self, blob_hash, encoding):
+        try:
+            with open(self._blob_path(blob_hash, encoding), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None  # evicted by another worker since it was looked up, or removed by hand
+        return gzip.decompress(data) if encoding == 'gzip' else data
+
+    def stats(self):
+        with get_db() as conn:
+            entries, size_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM report_archive').fetchone()
+            blobs, blob_bytes, stored_bytes = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM report_blobs').fetchone()
+        with self._lock:
+            return {
+                'entries': entries,
+                'size_bytes': size_bytes,  # as sent, counting duplicates
+                'blobs': blobs,
+                'blob_bytes': blob_bytes,  # after deduplication
+                'stored_bytes': stored_bytes,  # after deduplication and compression
+                'max_bytes': self.max_bytes,
+                'retention_days': self.retention_days,
+                'stored': self.stored,
+                'deduplicated': self.deduplicated,
+                'evicted': self.evicted
+            }
+
+    # Move reports saved by older versions (reports/<user_id>/report_*.<format>) into the archive.
+    # The limits are applied once, after everything is imported, so an old report cannot evict the
+    # ones imported before it. Returns (reports archived, reports outside the limits); with delete
+    # set, only the files of reports still in the archive at the end are removed.
+    def import_legacy(self, directory, delete=False):
+        imported = []  # (archive id, source paths)
+        for user_id in sorted(os.listdir(directory)):
+            user_dir = os.path.join(directory, user_id)
+            if user_id.startswith('.') or not os.path.isdir(user_dir):
+                continue
+            reports = {}
+            for filename in os.listdir(user_dir):
+                match = LEGACY_NAME_RE.match(filename)
+                if match:
+                    reports.setdefault(match.group('name'), []).append(match)
+            for name, matches in sorted(reports.items()):
+                buffers = {}
+                paths = []
+                for match in matches:
+                    path = os.path.join(user_dir, match.string)
+                    with open(path, 'rb') as file:
+                        buffers[match.group('format')] = file.read()
+                    paths.append(path)
+                first = matches[0]
+                from_date = first.group('from') or first.group('on')
+                to_date = first.group('to') or first.group('on')
+                sent_at = max(os.path.getmtime(path) for path in paths)
+                archive_id = self.put(user_id, from_date, to_date, None, name, buffers, sent_at=sent_at, enforce_limits=False)
+                imported.append((archive_id, paths))
+        self.enforce_limits()
+
+        with get_db() as conn:
+            archived = {row[0] for row in conn.execute(
+                'SELECT id FROM report_archive WHERE id IN (SELECT value FROM json_each(?))',
+                (json.dumps([archive_id for archive_id, _ in imported]),))}
+        kept = [(archive_id, paths) for archive_id, paths in imported if archive_id in archived]
+        if delete:
+            for _, paths in kept:
+                for path in paths:
+                    os.remove(path)
+        return len(kept), len(imported) - len(kept)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from config import REPORT_ARCHIVE_DIR, REPORT_ARCHIVE_MAX_BYTES, REPORT_ARCHIVE_RETENTION_DAYS
+
+    parser = argparse.ArgumentParser(description='TED report archive maintenance')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('stats')
+    import_parser = subcommands.add_parser('import-legacy', help='archive the reports/<user_id>/ files saved by older versions')
+    import_parser.add_argument('path', nargs='?', default='reports')
+    import_parser.add_argument('--delete', action='store_true', help='remove the files once archived')
+    args = parser.parse_args()
+
+    archive = ReportArchive(REPORT_ARCHIVE_DIR, REPORT_ARCHIVE_MAX_BYTES, REPORT_ARCHIVE_RETENTION_DAYS)
+    if args.command == 'import-legacy':
+        archived, evicted = archive.import_legacy(args.path, args.delete)
+        print(f'{archived} reports imported from {args.path}')
+        if evicted:
+            print(f'{evicted} reports are outside REPORT_ARCHIVE_RETENTION_DAYS/REPORT_ARCHIVE_MAX_BYTES '
+                  f'and were not kept; their files were left in place')
+    else:
+        print(json.dumps(archive.stats(), indent=2))
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+import time
+
+from db import get_db
+
+
+# Maps a report's inputs to the archive entry holding what they rendered, so sending the same
+# report again reads the files back from the ReportArchive instead of rendering them. The key
+# covers everything that shows up in a report, including a hash of the task rows, so an entry
+# can never go stale; invalidate() just drops a user's entries early. An entry is deleted with
+# its archive entry (trg_report_archive_cache_delete), so the archive's limits bound the cache.
+class ReportCache:
+    def __init__(self, archive, enabled=True):
+        self.archive = archive
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(user_id, user_email, role, date_info, tasks, working_days):
+        digest = hashlib.sha256()
+        digest.update(repr((user_id, user_email, role, date_info, working_days)).encode())
+        for task in tasks:
+            digest.update(repr(task).encode())
+        return digest.hexdigest()
+
+    # Returns {format: bytes} for a cached report, or None
+    def get(self, user_id, key):
+        if not self.enabled:
+            return None
+        with get_db() as conn:
+            row = conn.execute('SELECT archive_id FROM report_cache WHERE key = ? AND user_id = ?', (key, user_id)).fetchone()
+        buffers = self.archive.buffers(row[0]) if row else None
+        if row and buffers is None:
+            # The archive entry was evicted after this entry was read, or its files were removed by hand
+            with get_db() as conn:
+                conn.execute('DELETE FROM report_cache WHERE key = ?', (key,))
+                conn.commit()
+        with self._lock:
+            if buffers is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return buffers
+
+    # Remember the archive entry a freshly rendered report was stored as
+    def put(self, user_id, key, archive_id):
+        if not self.enabled:
+            return
+        with get_db() as conn:
+            conn.execute('''
+                INSERT INTO report_cache (key, user_id, archive_id, created_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET archive_id = excluded.archive_id, created_at = excluded.created_at
+            ''', (key, user_id, archive_id, time.time()))
+            conn.commit()
+
+    def invalidate(self, user_id):
+        if not self.enabled:
+            return
+        with get_db() as conn:
+            conn.execute('DELETE FROM report_cache WHERE user_id = ?', (user_id,))
+            conn.commit()
+
+    def stats(self):
+        with get_db() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM report_cache').fetchone()[0]
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses
+            }
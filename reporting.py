@@ -0,0 +1,242 @@
+from functools import lru_cache
+
+from db import extend_calendar
+
+# Column order of SELECT * FROM tasks
+TASK_COLUMNS = (
+    'id',
+    'user_id',
+    'area_of_effort',
+    'effort_hours',
+    'effort_minutes',
+    'effort_towards',
+    'time_log_type',
+    'manager_note',
+    'broad_area_of_work',
+    'reviewer_note',
+    'output_file',
+    'output_location',
+    'task_date',
+)
+
+
+def task_to_dict(task):
+    return dict(zip(TASK_COLUMNS, task))
+
+
+def task_hours(task):
+    return (task[3] or 0) + (task[4] or 0) / 60.0
+
+
+def _group_order(key):
+    # Same ordering SQLite uses for GROUP BY on a text column: NULL first, then by value
+    return (key is not None, key or '')
+
+
+# Weekdays that are not company holidays, from the calendar table
+def fetch_working_days(conn, from_date, to_date):
+    extend_calendar(conn, from_date, to_date)
+    cursor = conn.execute(
+        'SELECT date FROM calendar WHERE date BETWEEN ? AND ? AND is_weekday = 1 AND is_holiday = 0 ORDER BY date',
+        (from_date, to_date))
+    return [row[0] for row in cursor.fetchall()]
+
+
+# Working days with no tasks logged
+def find_missed_dates(dates_with_tasks, working_days):
+    return [day for day in working_days if day not in dates_with_tasks]
+
+
+# Fetch a user's task slice once; every report metric is computed from these rows
+def fetch_tasks(conn, user_id, from_date, to_date):
+    cursor = conn.execute(
+        'SELECT * FROM tasks WHERE user_id = ? AND task_date BETWEEN ? AND ? ORDER BY task_date, id',
+        (user_id, from_date, to_date))
+    return cursor.fetchall()
+
+
+# Compute every get_report / send_report metric over the rows from fetch_tasks in a single pass
+def aggregate_tasks(tasks, working_days):
+    total_effort_hours = 0.0
+    hours_by_date = {}
+    hours_by_broad_area = {}
+    hours_by_effort_towards = {}
+    missing_files_tasks = []
+    notes = []
+
+    for task in tasks:
+        hours = task_hours(task)
+        task_date = task[12]
+        total_effort_hours += hours
+        hours_by_date[task_date] = hours_by_date.get(task_date, 0.0) + hours
+        hours_by_broad_area[task[8]] = hours_by_broad_area.get(task[8], 0.0) + hours
+        hours_by_effort_towards[task[5]] = hours_by_effort_towards.get(task[5], 0.0) + hours
+        if not task[10]:
+            missing_files_tasks.append((task_date, task[2]))
+        notes.append((task_date, task[2], task[7], task[9]))
+
+    # NULL and empty broad areas are both reported as 'Undefined'
+    broad_area_of_work_hours = {}
+    for area in sorted(hours_by_broad_area, key=_group_order):
+        label = area or 'Undefined'
+        broad_area_of_work_hours[label] = broad_area_of_work_hours.get(label, 0.0) + hours_by_broad_area[area]
+
+    return {
+        'missed_dates': find_missed_dates(hours_by_date, working_days),
+        'total_effort_hours': total_effort_hours,
+        'broad_area_of_work_hours': list(broad_area_of_work_hours.items()),
+        'less_than_8_hours_dates': sorted(day for day, hours in hours_by_date.items() if hours < 8),
+        'missing_files_tasks': missing_files_tasks,
+        'effort_towards_hours': [(key, hours_by_effort_towards[key]) for key in sorted(hours_by_effort_towards, key=_group_order)],
+        'notes': notes,
+        'total_working_days': len(working_days)
+    }
+
+
+# Report metrics for every employee over one date range with three queries: the employee
+# list, the working days and a single scan of the range's tasks, split by user and aggregated per user
+def build_team_report(conn, from_date, to_date):
+    working_days = fetch_working_days(conn, from_date, to_date)
+    employees = conn.execute("SELECT user_id, email FROM users WHERE role = 'employee' ORDER BY user_id").fetchall()
+    tasks_by_user = {user_id: [] for user_id, _ in employees}
+    cursor = conn.execute('SELECT * FROM tasks WHERE task_date BETWEEN ? AND ? ORDER BY task_date, id', (from_date, to_date))
+    for task in cursor:
+        # Tasks logged by managers, reviewers or removed users are not part of the team report
+        user_tasks = tasks_by_user.get(task[1])
+        if user_tasks is not None:
+            user_tasks.append(task)
+
+    emails = dict(employees)
+    users = []
+    for user_id, tasks in tasks_by_user.items():
+        report = aggregate_tasks(tasks, working_days)
+        del report['notes']
+        report['user_id'] = user_id
+        report['email'] = emails[user_id]
+        report['task_count'] = len(tasks)
+        users.append(report)
+    return users
+
+
+# Per-day totals for a user from the daily_effort rollup (one small row per day worked)
+def fetch_daily_effort(conn, user_id, from_date, to_date):
+    cursor = conn.execute(
+        '''SELECT task_date, total_minutes, task_count, missing_file_count
+        FROM daily_effort
+        WHERE user_id = ? AND task_date BETWEEN ? AND ?
+        ORDER BY task_date''',
+        (user_id, from_date, to_date))
+    return cursor.fetchall()
+
+
+# Day-level report metrics (totals, < 8 hours dates, missed dates) from fetch_daily_effort rows
+def summarize_daily_effort(days, working_days):
+    hours_by_date = {day[0]: day[1] / 60.0 for day in days}
+    return {
+        'total_effort_hours': sum(hours_by_date.values()),
+        'task_count': sum(day[2] for day in days),
+        'missing_file_count': sum(day[3] for day in days),
+        'less_than_8_hours_dates': [day for day, hours in hours_by_date.items() if hours < 8],
+        'missed_dates': find_missed_dates(hours_by_date, working_days),
+        'total_working_days': len(working_days),
+        'days': [
+            {'task_date': day[0], 'effort_hours': day[1] / 60.0, 'task_count': day[2], 'missing_file_count': day[3]}
+            for day in days
+        ]
+    }
+
+
+TASK_SHEET_HEADERS = ['Task Date', 'Area of Effort', 'Effort (hours)', 'Effort Towards', 'Time Log Type', 'Output File', 'Output Location']
+REVIEW_SHEET_HEADERS = ['Manager Note', 'Broad Area of Work', 'Reviewer Note']
+
+
+# openpyxl (which pulls in numpy) is imported on first use rather than at startup: only report
+# rendering needs it, and it is the largest part of the app's import time
+@lru_cache(maxsize=None)
+def _excel_styles():
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    thin = Side(style='thin')
+    return Alignment(wrap_text=True), Font(bold=True), Border(left=thin, right=thin, top=thin, bottom=thin)
+
+
+def summary_rows(user_email, total_effort_hours, report, role):
+    rows = [
+        ('Employee Email', user_email),
+        ('Total Effort Hours', f"{total_effort_hours:.2f} hours")
+    ]
+    if role != 'employee':
+        rows += [
+            ('Total Working Days', report['total_working_days'] if report else ''),
+            ('Missed TED Dates', ', '.join(report['missed_dates']) if report else ''),
+            ('Broad Area of Work and Time Effort Hours', ', '.join([f"{item[0]}: {item[1]:.2f} hours" for item in report['broad_area_of_work_hours']]) if report else ''),
+            ('Less than 8 hours TED Dates', ', '.join(report['less_than_8_hours_dates']) if report else ''),
+            ('No Files of TED Link Missing Dates', ', '.join([f"{task[0]}: {task[1]}" for task in report['missing_files_tasks']]) if report else ''),
+            ('Effort Towards and Time Effort Hours', ', '.join([f"{item[0]}: {item[1]:.2f} hours" for item in report['effort_towards_hours']]) if report else '')
+        ]
+    return rows
+
+
+def task_sheet_rows(tasks_by_date, role):
+    for date, tasks in tasks_by_date.items():
+        for task in tasks:
+            row = (
+                date,
+                task['area_of_effort'],
+                f"{task['effort_hours']}h {task['effort_minutes']}m",
+                task['effort_towards'],
+                task['time_log_type'],
+                task['output_file'],
+                task['output_location'],
+            )
+            if role != 'employee':
+                row += (task['manager_note'], task['broad_area_of_work'], task['reviewer_note'])
+            yield row
+
+
+def _write_sheet(workbook, title, headers, rows):
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    wrap, header_font, header_border = _excel_styles()
+    worksheet = workbook.create_sheet(title)
+
+    # A write-only sheet emits its column widths before the first row, so widths are
+    # measured while the rows are collected and set before anything is appended
+    widths = [len(header) for header in headers]
+    collected = []
+    for row in rows:
+        for i, value in enumerate(row):
+            if value is not None and len(str(value)) > widths[i]:
+                widths[i] = len(str(value))
+        collected.append(row)
+    for i, width in enumerate(widths, start=1):
+        worksheet.column_dimensions[get_column_letter(i)].width = width + 2
+
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(worksheet, value=header)
+        cell.font = header_font
+        cell.border = header_border
+        cell.alignment = wrap
+        header_cells.append(cell)
+    worksheet.append(header_cells)
+
+    for row in collected:
+        cells = []
+        for value in row:
+            cell = WriteOnlyCell(worksheet, value=value)
+            cell.alignment = wrap
+            cells.append(cell)
+        worksheet.append(cells)
+
+
+# Write the Summary and Tasks sheets straight to an .xlsx path or file object in one pass
+def write_excel_report(target, user_email, tasks_by_date, total_effort_hours, report, role):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    _write_sheet(workbook, 'Summary', ['Section', 'Details'], summary_rows(user_email, total_effort_hours, report, role))
+    headers = TASK_SHEET_HEADERS + (REVIEW_SHEET_HEADERS if role != 'employee' else [])
+    _write_sheet(workbook, 'Tasks', headers, task_sheet_rows(tasks_by_date, role))
+    workbook.save(target)
@@ -0,0 +1,32 @@
+# config.py reads the environment once, on import, and load_dotenv() never overrides variables that
+# are already set: point every path at a scratch directory and SMTP at a closed local port before any
+# test imports the app, so a test run can neither touch ted.db nor send mail with the .env credentials.
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCRATCH = tempfile.mkdtemp(prefix='ted-test-')
+os.environ.update({
+    'DB_PATH': os.path.join(SCRATCH, 'ted.db'),
+    'DB_AUTO_MIGRATE': 'false',
+    'SMTP_SERVER': '127.0.0.1',
+    'SMTP_PORT': '1',
+    'SMTP_USERNAME': '',
+    'SMTP_PASSWORD': '',
+    'SMTP_STARTTLS': 'false',
+    'REPORT_ARCHIVE_DIR': os.path.join(SCRATCH, 'reports', 'archive'),
+    'PROFILE_DIR': os.path.join(SCRATCH, 'profiles'),
+})
+
+import pytest  # noqa: E402
+
+
+# The scratch database, migrated once per run
+@pytest.fixture(scope='session')
+def database():
+    import db
+    db.init_db()
+    return os.environ['DB_PATH']
@@ -0,0 +1,61 @@
+# Report routes take their date range from the request. Malformed or reversed ranges must be
+# rejected before they reach the calendar, and no request may grow the calendar without bound.
+import pytest
+
+import db
+
+
+@pytest.fixture(scope='module')
+def client(database):
+    from app import app
+    return app.test_client()
+
+
+def calendar_span():
+    with db.get_db() as conn:
+        return tuple(conn.execute('SELECT MIN(date), MAX(date), COUNT(*) FROM calendar').fetchone())
+
+
+@pytest.mark.parametrize('path', ['/get_report', '/get_team_report', '/get_effort_summary'])
+@pytest.mark.parametrize('from_date, to_date', [
+    ('2024-04-01', 'zzz'),
+    ('zzz', '2024-04-30'),
+    ('2024-04-01', '2024-02-30'),
+    ('2024-04-30', '2024-04-01'),
+    ('2024-04-01', None),
+])
+def test_bad_dates_are_rejected(client, path, from_date, to_date):
+    before = calendar_span()
+    params = {'user_id': 'alice', 'from_date': from_date, 'to_date': to_date}
+    response = client.get(path, query_string={name: value for name, value in params.items() if value is not None})
+    assert response.status_code == 400
+    assert calendar_span() == before
+
+
+@pytest.mark.parametrize('path', ['/get_report', '/get_team_report', '/get_effort_summary'])
+def test_ranges_far_outside_the_calendar_are_rejected(client, path):
+    before = calendar_span()
+    response = client.get(path, query_string={'user_id': 'alice', 'from_date': '2024-04-01', 'to_date': '9999-12-31'})
+    assert response.status_code == 400
+    assert calendar_span() == before
+
+
+def test_good_dates_are_served(client):
+    response = client.get('/get_effort_summary', query_string={'user_id': 'alice', 'from_date': '2024-04-01',
+                                                               'to_date': '2024-04-30'})
+    assert response.status_code == 200
+
+
+def test_extend_calendar_takes_only_iso_dates(database):
+    with db.get_db() as conn:
+        for from_date, to_date in [('2024-04-01', 'zzz'), ('2024-4-1', '2024-04-30'), (None, '2024-04-30')]:
+            with pytest.raises(db.CalendarRangeError):
+                db.extend_calendar(conn, from_date, to_date)
+        assert db._calendar_bounds[1] <= db.CALENDAR_END
+
+
+def test_extend_calendar_fills_within_the_limit(database):
+    low, high, count = calendar_span()
+    with db.get_db() as conn:
+        db.extend_calendar(conn, '2041-01-01', '2041-01-31')
+    assert calendar_span() == (low, '2041-01-31', count + 31)
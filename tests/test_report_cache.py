@@ -0,0 +1,83 @@
+# user_id comes from the request body, so it must never pick the paths the report cache and
+# archive read, write or delete. Cache entries point at archive entries and go with them.
+import os
+
+import pytest
+
+import db
+from report_archive import ReportArchive
+from report_cache import ReportCache
+
+HOSTILE_USER_IDS = ['..', '/', '../..', '../../etc', '.', '', 7, 'a/../../b']
+
+
+def report(text='report'):
+    return {'html': text.encode(), 'pdf': b'%PDF ' + text.encode(), 'xlsx': b'PK ' + text.encode()}
+
+
+def files_under(path):
+    return sorted(os.path.join(directory, name) for directory, _, names in os.walk(path) for name in names)
+
+
+@pytest.fixture
+def archive(database, tmp_path):
+    with db.get_db() as conn:
+        for table in ('report_cache', 'report_archive_files', 'report_archive', 'report_blobs'):
+            conn.execute(f'DELETE FROM {table}')
+        conn.commit()
+    # A sibling of the archive directory, which a traversal would reach first
+    (tmp_path / 'outside').mkdir()
+    (tmp_path / 'outside' / 'keep.html').write_bytes(b'keep')
+    return ReportArchive(str(tmp_path / 'archive'))
+
+
+def send(archive, cache, user_id, key, buffers):
+    archive_id = archive.put(user_id, '2024-04-01', '2024-04-30', 'employee', 'report', buffers)
+    cache.put(user_id, key, archive_id)
+    return archive_id
+
+
+@pytest.mark.parametrize('user_id', HOSTILE_USER_IDS)
+def test_user_ids_stay_inside_the_archive(tmp_path, archive, user_id):
+    cache = ReportCache(archive)
+    send(archive, cache, user_id, 'key', report())
+    assert cache.get(user_id, 'key') == report()
+    assert all(path.startswith(archive.directory + os.sep) for path in files_under(tmp_path) if 'outside' not in path)
+    cache.invalidate(user_id)
+    assert cache.get(user_id, 'key') is None
+    assert files_under(tmp_path / 'outside') == [str(tmp_path / 'outside' / 'keep.html')]
+
+
+def test_invalidate_only_drops_that_user(archive):
+    cache = ReportCache(archive)
+    send(archive, cache, '..', 'key-1', report('one'))
+    send(archive, cache, 'alice', 'key-2', report('two'))
+    cache.invalidate('..')
+    assert cache.get('..', 'key-1') is None
+    assert cache.get('alice', 'key-2') == report('two')
+
+
+def test_entries_go_with_their_archive_entry(archive):
+    cache = ReportCache(archive)
+    send(archive, cache, 'alice', 'key-1', report('one'))
+    send(archive, cache, 'alice', 'key-2', report('two'))
+    archive.max_bytes = 1
+    archive.put('bob', '2024-04-01', '2024-04-30', 'employee', 'report', report('three'))
+    assert cache.stats()['entries'] == 0
+    assert cache.get('alice', 'key-1') is None
+
+
+def test_missing_files_are_a_miss(archive):
+    cache = ReportCache(archive)
+    send(archive, cache, 'alice', 'key', report())
+    for path in files_under(archive.directory):
+        os.remove(path)
+    assert cache.get('alice', 'key') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_disabled_cache_stores_nothing(archive):
+    cache = ReportCache(archive, enabled=False)
+    send(archive, cache, 'alice', 'key', report())
+    assert cache.get('alice', 'key') is None
+    assert cache.stats()['entries'] == 0
@@ -0,0 +1,137 @@
+# The daily_effort and payroll_department_summary rollups are kept up to date by triggers.
+# These tests run scripted writes against a scratch database and, after every step, compare
+# each rollup with what its BACKFILL_* statements rebuild from scratch.
+import sqlite3
+
+import pytest
+
+import db
+
+DAILY_EFFORT = ('daily_effort', db.BACKFILL_DAILY_EFFORT, 'user_id, task_date')
+PAYROLL_SUMMARY = ('payroll_department_summary', db.BACKFILL_PAYROLL_SUMMARY, 'department, period')
+
+
+# A fresh copy of the migrated schema per test, in autocommit mode so rollup checks can use savepoints
+@pytest.fixture
+def conn(database, tmp_path):
+    source = sqlite3.connect(database)
+    conn = sqlite3.connect(tmp_path / 'ted.db', isolation_level=None)
+    source.backup(conn)
+    source.close()
+    yield conn
+    conn.close()
+
+
+def rows(conn, table, order_by):
+    return [tuple(row) for row in conn.execute(f'SELECT * FROM {table} ORDER BY {order_by}')]
+
+
+# The rollup as the triggers left it must equal the rollup rebuilt by its backfill statements
+def assert_matches_backfill(conn, rollup, step):
+    table, backfill, order_by = rollup
+    actual = rows(conn, table, order_by)
+    conn.execute('SAVEPOINT backfill')
+    for statement in backfill:
+        conn.execute(statement)
+    expected = rows(conn, table, order_by)
+    conn.execute('ROLLBACK TO backfill')
+    conn.execute('RELEASE backfill')
+    # Keys must match exactly; summed amounts may differ in the last bits of a float
+    assert [row[:2] for row in actual] == [row[:2] for row in expected], step
+    for got, want in zip(actual, expected):
+        assert got[2:] == pytest.approx(want[2:]), step
+
+
+def run_steps(conn, rollup, steps):
+    assert_matches_backfill(conn, rollup, 'initial')
+    for step, statements in steps:
+        for statement in statements:
+            conn.execute(*statement) if isinstance(statement, tuple) else conn.execute(statement)
+        assert_matches_backfill(conn, rollup, step)
+
+
+def add_task(user_id, task_date, hours, minutes, output_file=''):
+    return ('INSERT INTO tasks (user_id, effort_hours, effort_minutes, output_file, task_date) VALUES (?, ?, ?, ?, ?)',
+            (user_id, hours, minutes, output_file, task_date))
+
+
+def test_daily_effort_matches_backfill(conn):
+    run_steps(conn, DAILY_EFFORT, [
+        ('insert tasks', [
+            add_task('alice', '2024-04-01', 2, 30),
+            add_task('alice', '2024-04-01', 1, 15, 'https://files.example.com/1'),
+            add_task('alice', '2024-04-02', 3, 0, None),
+            add_task('bob', '2024-04-01', 0, 45),
+            add_task('bob', '2024-04-02', None, None),
+        ]),
+        ('insert a task without a date', [add_task('bob', None, 1, 0)]),
+        ('change effort', ["UPDATE tasks SET effort_hours = 5, effort_minutes = 10 WHERE user_id = 'alice' AND task_date = '2024-04-01' AND effort_hours = 2"]),
+        ('set effort to NULL', ["UPDATE tasks SET effort_minutes = NULL WHERE user_id = 'bob' AND task_date = '2024-04-01'"]),
+        ('attach an output file', ["UPDATE tasks SET output_file = 'https://files.example.com/2' WHERE user_id = 'alice' AND task_date = '2024-04-02'"]),
+        ('move a task to another day', ["UPDATE tasks SET task_date = '2024-04-03' WHERE user_id = 'alice' AND effort_hours = 1"]),
+        ('move a task to another user', ["UPDATE tasks SET user_id = 'carol' WHERE user_id = 'bob' AND task_date = '2024-04-02'"]),
+        ('date a task that had none', ["UPDATE tasks SET task_date = '2024-04-01' WHERE task_date IS NULL"]),
+        ('clear a task date', ["UPDATE tasks SET task_date = NULL WHERE user_id = 'alice' AND task_date = '2024-04-03'"]),
+        ('update columns the rollup ignores', ["UPDATE tasks SET manager_note = 'ok', reviewer_note = 'fine'"]),
+        ('delete one of several tasks in a day', ["DELETE FROM tasks WHERE user_id = 'alice' AND task_date = '2024-04-01' AND effort_hours = 5"]),
+        ('delete the last task of a day', ["DELETE FROM tasks WHERE user_id = 'carol'"]),
+        ('delete everything', ['DELETE FROM tasks']),
+    ])
+    assert rows(conn, 'daily_effort', 'user_id') == []
+
+
+def test_payroll_summary_matches_backfill(conn):
+    def add_employee(name, department):
+        return ('INSERT INTO employees (name, email, department) VALUES (?, ?, ?)', (name, f'{name}@example.com', department))
+
+    def add_payroll(name, period, salary, bonus=0, deductions=0, tax=0):
+        return ('''INSERT INTO payroll (employee_id, period, salary, bonus, deductions, tax, net_salary)
+                   SELECT id, ?, ?, ?, ?, ?, ? FROM employees WHERE name = ?''',
+                (period, salary, bonus, deductions, tax, salary + (bonus or 0) - (deductions or 0) - (tax or 0), name))
+
+    run_steps(conn, PAYROLL_SUMMARY, [
+        ('insert employees', [
+            add_employee('ann', 'Engineering'),
+            add_employee('ben', 'Engineering'),
+            add_employee('cat', 'Sales'),
+            add_employee('dan', 'Sales'),
+        ]),
+        ('insert payroll', [
+            add_payroll('ann', '2024-01', 5000, 250, 100, 900),
+            add_payroll('ann', '2024-02', 5000, 0, 100, 850),
+            add_payroll('ben', '2024-01', 4200.5, 0, 0, 700),
+            add_payroll('cat', '2024-01', 3900, 400, 50, 600),
+            add_payroll('cat', '2024-02', 3900, None, None, None),
+            add_payroll('dan', '2024-02', 3600, 100, 0, 500),
+        ]),
+        ('a second payroll row for an employee and period', [add_payroll('ann', '2024-01', 300), add_payroll('ann', '2024-01', 50)]),
+        ('change the amounts of one of several rows', ["UPDATE payroll SET salary = 400, net_salary = 400 WHERE salary = 300"]),
+        ('move one of several rows to another period', ["UPDATE payroll SET period = '2024-02' WHERE salary = 400"]),
+        ('delete one of several rows', ["DELETE FROM payroll WHERE salary = 50"]),
+        ('payroll for an unknown employee', [
+            ('INSERT INTO payroll (employee_id, period, salary, net_salary) VALUES (999, ?, ?, ?)', ('2024-01', 1000, 1000)),
+        ]),
+        ('change amounts', ["UPDATE payroll SET salary = 5500, net_salary = net_salary + 500 WHERE period = '2024-02' AND employee_id = (SELECT id FROM employees WHERE name = 'ann')"]),
+        ('move a payroll row to another period', ["UPDATE payroll SET period = '2024-03' WHERE employee_id = (SELECT id FROM employees WHERE name = 'dan')"]),
+        ('move a payroll row to another employee', ["UPDATE payroll SET employee_id = (SELECT id FROM employees WHERE name = 'cat') WHERE employee_id = (SELECT id FROM employees WHERE name = 'ben')"]),
+        ('move an employee to another department', ["UPDATE employees SET department = 'Sales' WHERE name = 'ann'"]),
+        ('move an employee to a new department', ["UPDATE employees SET department = 'Support' WHERE name = 'cat'"]),
+        ('move the last employee out of a department', ["UPDATE employees SET department = 'Sales' WHERE name = 'ben'"]),
+        ('rename an employee', ["UPDATE employees SET name = 'daniel' WHERE name = 'dan'"]),
+        ('change an employee id', ["UPDATE employees SET id = 500 WHERE name = 'ann'"]),
+        ('delete a payroll row', ["DELETE FROM payroll WHERE period = '2024-01' AND employee_id = (SELECT id FROM employees WHERE name = 'cat')"]),
+        ('delete an employee with payroll rows', ["DELETE FROM employees WHERE name = 'daniel'"]),
+        ('delete all payroll', ['DELETE FROM payroll']),
+    ])
+    assert rows(conn, 'payroll_department_summary', 'department') == []
+
+
+def test_payroll_headcount_counts_employees(conn):
+    conn.execute("INSERT INTO employees (id, name, email, department) VALUES (1, 'ann', 'ann@example.com', 'Sales')")
+    conn.executemany('INSERT INTO payroll (employee_id, period, salary, net_salary) VALUES (1, ?, ?, ?)',
+                     [('2024-01', 1000, 1000), ('2024-01', 200, 200)])
+    assert rows(conn, 'payroll_department_summary', 'department') == [('Sales', '2024-01', 1, 1200, 0, 0, 0, 1200)]
+    conn.execute('DELETE FROM payroll WHERE salary = 200')
+    assert rows(conn, 'payroll_department_summary', 'department') == [('Sales', '2024-01', 1, 1000, 0, 0, 0, 1000)]
+    conn.execute('DELETE FROM payroll')
+    assert rows(conn, 'payroll_department_summary', 'department') == []
@@ -0,0 +1,18 @@
+# The team report covers employees only, even when other users have logged tasks in the range.
+import db
+from reporting import build_team_report
+
+
+def test_only_employees_are_reported(database):
+    with db.get_db() as conn:
+        conn.executemany("INSERT INTO users (user_id, email, password, role) VALUES (?, ?, 'x', ?)",
+                         [('team-emp', 'emp@example.com', 'employee'), ('team-mgr', 'mgr@example.com', 'manager')])
+        conn.executemany('INSERT INTO tasks (user_id, effort_hours, effort_minutes, task_date) VALUES (?, 2, 0, ?)',
+                         [('team-emp', '2024-04-01'), ('team-mgr', '2024-04-01'), ('team-gone', '2024-04-02')])
+        try:
+            users = {user['user_id']: user for user in build_team_report(conn, '2024-04-01', '2024-04-30')}
+        finally:
+            conn.rollback()
+    assert 'team-mgr' not in users and 'team-gone' not in users
+    assert users['team-emp']['email'] == 'emp@example.com'
+    assert users['team-emp']['task_count'] == 1
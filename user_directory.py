@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db import get_db
+
+
+# In-process cache of user_id -> (email, role, status), including users that do not exist.
+# register() invalidates its own entry; entries expire after ttl seconds so users added or
+# changed through another worker process show up without a restart.
+class UserDirectory:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._users = OrderedDict()  # user_id -> (user or None, loaded_at), least recently used first
+        self._generation = 0  # bumped by invalidate() so a lookup racing it does not cache stale data
+        self._lock = threading.Lock()
+
+    # Returns (email, role, status) for user_id, or None if there is no such user
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        with get_db() as conn:
+            user = conn.execute('SELECT email, role, status FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        user = tuple(user) if user else None
+
+        with self._lock:
+            if generation != self._generation:
+                return user
+            self._users[user_id] = (user, now)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_entries:
+                self._users.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._users),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+# special_users.json, parsed once and re-read only when its mtime or size changes
+class SpecialUsers:
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._data = None
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if signature == self._signature:
+                self.hits += 1
+                return self._data
+            self.misses += 1
+            with open(self.path, 'r') as f:
+                self._data = json.load(f)
+            self._signature = signature
+            return self._data
+
+    def stats(self):
+        with self._lock:
+            return {'path': self.path, 'hits': self.hits, 'misses': self.misses}